@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from functools import lru_cache
 from pathlib import Path
-from typing import List
+from typing import List, Literal
 
 from pydantic import Field, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -36,6 +36,40 @@ class Settings(BaseSettings):
 
     rate_limit_auth_per_minute: int = Field(100, alias="RATE_LIMIT_AUTH_PER_MINUTE")
     redis_url: str | None = Field(None, alias="REDIS_URL")
+    realtime_broker: Literal["memory", "redis"] = Field("memory", alias="REALTIME_BROKER")
+    ws_send_queue_size: int = Field(256, alias="WS_SEND_QUEUE_SIZE")
+    ws_send_timeout_seconds: float = Field(10.0, alias="WS_SEND_TIMEOUT_SECONDS")
+    ws_ping_interval_seconds: float = Field(25.0, alias="WS_PING_INTERVAL_SECONDS")
+    ws_idle_timeout_seconds: float = Field(60.0, alias="WS_IDLE_TIMEOUT_SECONDS")
+    typing_broadcast_interval_seconds: float = Field(0.5, alias="TYPING_BROADCAST_INTERVAL_SECONDS")
+    typing_ttl_seconds: float = Field(5.0, alias="TYPING_TTL_SECONDS")
+    presence_broadcast_interval_seconds: float = Field(1.0, alias="PRESENCE_BROADCAST_INTERVAL_SECONDS")
+    presence_flush_interval_seconds: float = Field(30.0, alias="PRESENCE_FLUSH_INTERVAL_SECONDS")
+    presence_away_after_seconds: float = Field(300.0, alias="PRESENCE_AWAY_AFTER_SECONDS")
+    presence_shared_ttl_seconds: float = Field(120.0, alias="PRESENCE_SHARED_TTL_SECONDS")
+    presence_contacts_cache_size: int = Field(10_000, alias="PRESENCE_CONTACTS_CACHE_SIZE")
+    presence_contacts_ttl_seconds: float = Field(60.0, alias="PRESENCE_CONTACTS_TTL_SECONDS")
+    pending_events_max_per_user: int = Field(200, alias="PENDING_EVENTS_MAX_PER_USER")
+    pending_events_ttl_seconds: float = Field(21_600.0, alias="PENDING_EVENTS_TTL_SECONDS")
+    pending_events_memory_per_user: int = Field(200, alias="PENDING_EVENTS_MEMORY_PER_USER")
+    pending_events_spill: bool = Field(False, alias="PENDING_EVENTS_SPILL")
+
+    chat_cache_size: int = Field(10_000, alias="CHAT_CACHE_SIZE")
+    chat_cache_ttl_seconds: float = Field(60.0, alias="CHAT_CACHE_TTL_SECONDS")
+    message_cache_per_chat: int = Field(100, alias="MESSAGE_CACHE_PER_CHAT")
+    message_cache_memory_bytes: int = Field(64 * 1024 * 1024, alias="MESSAGE_CACHE_MEMORY_BYTES")
+    message_cache_ttl_seconds: float = Field(60.0, alias="MESSAGE_CACHE_TTL_SECONDS")
+    message_storage: Literal["documents", "buckets"] = Field("documents", alias="MESSAGE_STORAGE")
+    message_bucket_size: int = Field(200, alias="MESSAGE_BUCKET_SIZE")
+    message_archive_path: Path | None = Field(None, alias="MESSAGE_ARCHIVE_PATH")
+    message_archive_after_days: int = Field(180, alias="MESSAGE_ARCHIVE_AFTER_DAYS")
+    message_archive_segment_size: int = Field(5_000, alias="MESSAGE_ARCHIVE_SEGMENT_SIZE")
+    message_archive_cache_segments: int = Field(32, alias="MESSAGE_ARCHIVE_CACHE_SEGMENTS")
+    message_dedupe_cache_size: int = Field(10_000, alias="MESSAGE_DEDUPE_CACHE_SIZE")
+    message_dedupe_ttl_seconds: float = Field(300.0, alias="MESSAGE_DEDUPE_TTL_SECONDS")
+    chat_changes_retention_days: int = Field(7, alias="CHAT_CHANGES_RETENTION_DAYS")
+    chat_changes_gap_grace_seconds: float = Field(30.0, alias="CHAT_CHANGES_GAP_GRACE_SECONDS")
+    feed_total_ttl_seconds: float = Field(30.0, alias="FEED_TOTAL_TTL_SECONDS")
 
     log_level: str = Field("INFO", alias="LOG_LEVEL")
 
@@ -7,7 +7,9 @@ from app.config import settings
 from app.core.security import TokenError, decode_token
 from app.db.mongo import get_database
 from app.repositories.file_repository import FileRepository
-from app.repositories.message_repository import ChatRepository, MessageRepository
+from app.repositories.message_bucket_repository import create_message_repository
+from app.repositories.message_repository import ChatChangeRepository, ChatRepository, MessageRepository
+from app.repositories.message_search_repository import MessageSearchRepository
 from app.repositories.notification_repository import NotificationRepository
 from app.repositories.post_repository import PostRepository
 from app.repositories.token_repository import RefreshTokenRepository
@@ -39,7 +41,15 @@ def get_chat_repository(db=Depends(get_db)) -> ChatRepository:
 
 
 def get_message_repository(db=Depends(get_db)) -> MessageRepository:
-    return MessageRepository(db)
+    return create_message_repository(db)
+
+
+def get_chat_change_repository(db=Depends(get_db)) -> ChatChangeRepository:
+    return ChatChangeRepository(db)
+
+
+def get_message_search_repository(db=Depends(get_db)) -> MessageSearchRepository:
+    return MessageSearchRepository(db)
 
 
 def get_notification_repository(db=Depends(get_db)) -> NotificationRepository:
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+from datetime import datetime
+from enum import Enum
+from typing import Any, Literal, Optional
+
+import msgpack
+import orjson
+
+WireEncoding = Literal["json", "msgpack"]
+
+# Compact event profile, version 1: full key -> abbreviation. Versions only ever add keys.
+COMPACT_PROFILE_VERSION = 1
+COMPACT_KEYS: dict[str, str] = {
+    "event": "e",
+    "data": "d",
+    "chat_id": "c",
+    "seq": "s",
+    "_id": "i",
+    "event_id": "n",
+    "sender_id": "f",
+    "sender": "F",
+    "content": "t",
+    "type": "y",
+    "attachments": "a",
+    "reply_to_id": "r",
+    "client_id": "k",
+    "seen_by": "b",
+    "created_at": "ca",
+    "updated_at": "ua",
+    "edited": "ed",
+    "message": "m",
+    "message_id": "mi",
+    "unread_count": "u",
+    "user_id": "ui",
+    "user_ids": "us",
+    "stopped": "st",
+    "status": "ss",
+    "last_seen_at": "ls",
+    "post_id": "p",
+    "like_count": "lc",
+    "comment_count": "cc",
+    "read": "rd",
+    "recipient_id": "ri",
+    "full_name": "fn",
+    "avatar_url": "av",
+    "username": "un",
+    "filename": "fl",
+    "url": "ur",
+    "content_type": "ct",
+    "size": "sz",
+    "thumbnail_url": "tu",
+}
+# Field values that equal the schema default and can be left out as well.
+_COMPACT_DEFAULTS: dict[str, Any] = {"type": "text"}
+_NO_DEFAULT = object()
+
+
+def _default(value: Any) -> Any:
+    # ObjectIds (and anything else unknown) go out as strings, like the REST responses.
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return str(value)
+
+
+def dumps_json(value: Any) -> bytes:
+    return orjson.dumps(value, default=_default)
+
+
+def loads_json(data: str | bytes) -> Any:
+    return orjson.loads(data)
+
+
+def dumps_msgpack(value: Any) -> bytes:
+    return msgpack.packb(value, default=_default)
+
+
+def loads_msgpack(data: bytes) -> Any:
+    return msgpack.unpackb(data)
+
+
+def negotiate_encoding(requested: Optional[str]) -> WireEncoding:
+    """Wire encoding for a socket's ``encoding`` query parameter; JSON unless MessagePack is asked for."""
+
+    return "msgpack" if requested == "msgpack" else "json"
+
+
+def negotiate_profile(requested: Optional[str], version: Optional[str]) -> Optional[int]:
+    """Compact profile version for a socket's ``profile``/``profile_version`` query parameters.
+
+    Returns ``None`` for the full profile. Clients asking for a newer version than the
+    server knows get the newest one the server has.
+    """
+
+    if requested != "compact":
+        return None
+    if version is None:
+        return COMPACT_PROFILE_VERSION
+    if not version.isdigit() or int(version) < 1:
+        return None
+    return min(int(version), COMPACT_PROFILE_VERSION)
+
+
+def compact_frame(value: Any) -> Any:
+    """Apply the compact profile: drop null, false and empty values and abbreviate known keys.
+
+    Clients read a missing key as null, false or empty (or as the field's default).
+    """
+
+    if isinstance(value, dict):
+        compacted = {}
+        for key, item in value.items():
+            # Defaults are checked on the original value, emptiness after compaction.
+            if _COMPACT_DEFAULTS.get(key, _NO_DEFAULT) == item:
+                continue
+            item = compact_frame(item)
+            if not _is_omitted(item):
+                compacted[COMPACT_KEYS.get(key, key)] = item
+        return compacted
+    if isinstance(value, list):
+        return [compact_frame(item) for item in value]
+    return value
+
+
+def _is_omitted(value: Any) -> bool:
+    return value is None or value is False or (isinstance(value, (str, list, dict)) and not value)
+
+
+class EncodedFrame:
+    """A realtime frame encoded at most once per wire encoding and event profile.
+
+    One instance is queued for every socket that should receive the frame, so a broadcast
+    to a large chat serializes the payload once rather than once per socket. ``raw``
+    frames (handshakes) are always sent in the full profile.
+    """
+
+    __slots__ = ("frame", "raw", "_compact", "_encoded")
+
+    def __init__(self, frame: dict[str, Any], *, raw: bool = False) -> None:
+        self.frame = frame
+        self.raw = raw
+        self._compact: Optional[dict[str, Any]] = None
+        self._encoded: dict[tuple[bool, bool], str | bytes] = {}
+
+    def text(self, compact: bool = False) -> str:
+        return self._encode(False, compact)  # type: ignore[return-value]
+
+    def binary(self, compact: bool = False) -> bytes:
+        return self._encode(True, compact)  # type: ignore[return-value]
+
+    def _encode(self, binary: bool, compact: bool) -> str | bytes:
+        compact = compact and not self.raw
+        key = (binary, compact)
+        encoded = self._encoded.get(key)
+        if encoded is None:
+            if compact and self._compact is None:
+                self._compact = compact_frame(self.frame)
+            payload = self._compact if compact else self.frame
+            encoded = dumps_msgpack(payload) if binary else dumps_json(payload).decode()
+            self._encoded[key] = encoded
+        return encoded
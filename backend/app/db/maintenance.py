@@ -0,0 +1,213 @@
+"""Offline maintenance jobs.
+
+Run from the backend directory, e.g. ``python -m app.db.maintenance reindex-search``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from app.config import settings
+from app.core.logging_config import configure_logging
+from app.core.utils import to_object_id
+from app.db.mongo import close_client, get_database, init_indexes
+from app.repositories.message_archive_repository import MessageArchiveRepository
+from app.repositories.message_bucket_repository import BucketedMessageRepository, create_message_repository
+from app.repositories.message_repository import ChatRepository, MessageRepository
+from app.repositories.message_search_repository import MessageSearchRepository
+from app.repositories.post_repository import PostRepository
+from app.schemas.message import ChatReadMarker, MessageInDB
+
+logger = logging.getLogger(__name__)
+
+# Messages are migrated in chunks of this many full buckets.
+MIGRATION_CHUNK_BUCKETS = 20
+
+
+async def reindex_search(db: AsyncIOMotorDatabase, chat_id: Optional[str] = None) -> int:
+    """Rebuild the message search index, for one chat or for every chat."""
+
+    search = MessageSearchRepository(db)
+    await search.clear(chat_id)
+    indexed = 0
+    async for message in create_message_repository(db).iter_messages(chat_id):
+        await search.index_message(message)
+        indexed += 1
+    logger.info("Indexed %s messages for search", indexed)
+    return indexed
+
+
+async def migrate_messages(
+    db: AsyncIOMotorDatabase,
+    target: str,
+    chat_id: Optional[str] = None,
+    purge: bool = False,
+) -> int:
+    """Copy messages into the ``documents`` or ``buckets`` layout, one chat at a time.
+
+    A chat's copy is dropped and rewritten from a cursor over the source, a chunk at a
+    time, so the job can be re-run after an interrupted pass and never holds more than a
+    chunk in memory. The source layout is left intact unless ``purge`` is set; switch
+    ``MESSAGE_STORAGE`` once the copy is complete.
+    """
+
+    documents, buckets = MessageRepository(db), BucketedMessageRepository(db)
+    source, destination = (documents, buckets) if target == "buckets" else (buckets, documents)
+    chunk_size = buckets.bucket_size * MIGRATION_CHUNK_BUCKETS
+    query = {"_id": to_object_id(chat_id)} if chat_id else {}
+    chats = migrated = 0
+    async for chat in db.chats.find(query, {"_id": 1}):
+        await destination.delete_chat_messages(chat["_id"])
+        chunk: list[MessageInDB] = []
+        async for message in source.iter_messages(chat["_id"]):
+            chunk.append(message)
+            if len(chunk) == chunk_size:
+                await destination.append_chat_messages(chat["_id"], chunk)
+                migrated += len(chunk)
+                chunk = []
+        if chunk:
+            await destination.append_chat_messages(chat["_id"], chunk)
+            migrated += len(chunk)
+        if purge:
+            await source.delete_chat_messages(chat["_id"])
+        chats += 1
+    logger.info("Migrated %s messages in %s chats to %s storage", migrated, chats, target)
+    return migrated
+
+
+async def migrate_read_markers(db: AsyncIOMotorDatabase, chat_id: Optional[str] = None) -> int:
+    """Turn the legacy per-message ``seen_by`` lists into members' read watermarks.
+
+    Each member's newest seen message becomes their watermark, unless they already have a
+    later one, and their unread counter is recomputed from it. ``seen_by`` is then removed
+    from the chat's messages, so the job can be re-run.
+    """
+
+    chats, messages = ChatRepository(db), MessageRepository(db)
+    query = {"_id": to_object_id(chat_id)} if chat_id else {}
+    migrated = 0
+    async for chat in chats.collection.find(query, {"member_ids": 1}):
+        legacy = {"chat_id": chat["_id"], "seen_by": {"$exists": True}}
+        if not await messages.collection.find_one(legacy, {"_id": 1}):
+            continue
+        for member in chat.get("member_ids", []):
+            seen = await messages.collection.find_one(
+                {"chat_id": chat["_id"], "seen_by": member},
+                {"created_at": 1},
+                sort=[("created_at", -1), ("_id", -1)],
+            )
+            if not seen:
+                continue
+            marker = ChatReadMarker(message_id=seen["_id"], created_at=seen["created_at"])
+            unread = await messages.count_unread(chat["_id"], member, after=seen["created_at"])
+            if await chats.backfill_read_marker(chat["_id"], member, marker, unread):
+                migrated += 1
+        await messages.collection.update_many(legacy, {"$unset": {"seen_by": ""}})
+    logger.info("Migrated %s read watermarks from seen_by", migrated)
+    return migrated
+
+
+async def archive_messages(
+    db: AsyncIOMotorDatabase,
+    older_than_days: Optional[int] = None,
+    chat_id: Optional[str] = None,
+) -> int:
+    """Move messages older than the cutoff from hot storage into archive segments.
+
+    Each batch of up to ``MESSAGE_ARCHIVE_SEGMENT_SIZE`` messages becomes one segment file
+    and is removed from hot storage and the search index only after the segment is
+    registered, so an interrupted run at worst archives a batch twice (reads de-duplicate).
+    """
+
+    if settings.message_archive_path is None:
+        logger.error("MESSAGE_ARCHIVE_PATH is not configured; nothing archived")
+        return 0
+    days = older_than_days if older_than_days is not None else settings.message_archive_after_days
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    messages = create_message_repository(db)
+    archive = MessageArchiveRepository(db, settings.message_archive_path)
+    search = MessageSearchRepository(db)
+    batch_size = settings.message_archive_segment_size
+    chat_ids = [to_object_id(chat_id)] if chat_id else await messages.archivable_chat_ids(cutoff)
+    archived = 0
+    for chat in chat_ids:
+        while True:
+            batch = await messages.list_archivable(chat, cutoff, batch_size)
+            if not batch:
+                break
+            await archive.write_segment(chat, batch)
+            message_ids = [message.id for message in batch]
+            await messages.delete_messages(chat, message_ids)
+            await search.remove_messages(message_ids)
+            archived += len(batch)
+            if len(batch) < batch_size:
+                break
+    logger.info("Archived %s messages older than %s days", archived, days)
+    return archived
+
+
+async def reconcile_post_counters(db: AsyncIOMotorDatabase, post_id: Optional[str] = None) -> int:
+    """Recompute ``like_count``/``comment_count`` of one post or every post and fix drifted ones.
+
+    Also backfills the counters of posts created before they were maintained.
+    """
+
+    posts = PostRepository(db)
+    query = {"_id": to_object_id(post_id)} if post_id else {}
+    checked = fixed = 0
+    # Stream the ids instead of collecting them: distinct() is capped at 16MB per reply.
+    async for post in posts.collection.find(query, {"_id": 1}):
+        checked += 1
+        if await posts.reconcile_counts(post["_id"]):
+            fixed += 1
+    logger.info("Fixed counters of %s of %s posts", fixed, checked)
+    return fixed
+
+
+async def _run(args: argparse.Namespace) -> None:
+    db = get_database()
+    await init_indexes()
+    try:
+        if args.command == "reindex-search":
+            await reindex_search(db, args.chat_id)
+        elif args.command == "archive-messages":
+            await archive_messages(db, args.older_than_days, args.chat_id)
+        elif args.command == "migrate-read-markers":
+            await migrate_read_markers(db, args.chat_id)
+        elif args.command == "migrate-messages":
+            await migrate_messages(db, args.to, args.chat_id, args.purge)
+        elif args.command == "reconcile-post-counters":
+            await reconcile_post_counters(db, args.post_id)
+    finally:
+        await close_client()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="TeleGramApp maintenance jobs")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    reindex = subcommands.add_parser("reindex-search", help="Rebuild the message search index")
+    reindex.add_argument("--chat-id", default=None)
+    archive = subcommands.add_parser("archive-messages", help="Move old messages into compressed archive segments")
+    archive.add_argument("--older-than-days", type=int, default=None)
+    archive.add_argument("--chat-id", default=None)
+    markers = subcommands.add_parser("migrate-read-markers", help="Turn legacy seen_by lists into read watermarks")
+    markers.add_argument("--chat-id", default=None)
+    migrate = subcommands.add_parser("migrate-messages", help="Move messages between storage layouts")
+    migrate.add_argument("--to", choices=["documents", "buckets"], required=True)
+    migrate.add_argument("--chat-id", default=None)
+    migrate.add_argument("--purge", action="store_true", help="Delete migrated messages from the source layout")
+    reconcile = subcommands.add_parser("reconcile-post-counters", help="Fix drifted like and comment counters on posts")
+    reconcile.add_argument("--post-id", default=None)
+
+    configure_logging()
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,17 @@ import logging
 from typing import Optional
 
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo.errors import OperationFailure
 
 from app.config import settings
+from app.repositories.message_bucket_repository import create_message_repository
+from app.repositories.message_repository import ChatRepository
+from app.repositories.post_repository import PostRepository
+from app.repositories.notification_repository import (
+    ROLLING_NOTIFICATION_FILTER,
+    ROLLING_NOTIFICATION_KEYS,
+    NotificationRepository,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -39,19 +48,57 @@ async def init_indexes() -> None:
     await db.users.create_index("email", unique=True)
     await db.users.create_index("username", unique=True)
     await db.users.create_index([("department", 1)])
+    await db.users.create_index([("full_name", 1), ("_id", 1)])
 
     await db.posts.create_index([("created_at", -1)])
+    await db.posts.create_index([("pinned", -1), ("created_at", -1), ("_id", -1)])
+    await db.posts.create_index([("department", 1), ("pinned", -1), ("created_at", -1), ("_id", -1)])
     await db.posts.create_index([("author_id", 1), ("created_at", -1)])
     await db.posts.create_index([("tags", 1)])
+    await PostRepository(db).backfill_counts()
 
     await db.comments.create_index([("post_id", 1), ("created_at", 1)])
     await db.comments.create_index([("author_id", 1)])
 
-    await db.chats.create_index([("members", 1)])
-    await db.messages.create_index([("chat_id", 1), ("created_at", 1)])
+    await db.chats.create_index([("member_ids", 1), ("updated_at", -1)])
+    await ChatRepository(db).backfill_direct_keys()
+    await ChatRepository(db).backfill_last_messages(create_message_repository(db))
+    await db.chats.create_index("direct_key", unique=True, sparse=True)
+    await db.messages.create_index([("chat_id", 1), ("created_at", 1), ("_id", 1)])
+    await db.messages.create_index(
+        [("chat_id", 1), ("sender_id", 1), ("client_id", 1)],
+        unique=True,
+        partialFilterExpression={"client_id": {"$type": "string"}},
+    )
+    await db.message_buckets.create_index([("chat_id", 1), ("count", 1)])
+    await db.message_buckets.create_index([("chat_id", 1), ("last_at", -1)])
+    await db.message_buckets.create_index([("chat_id", 1), ("first_at", 1)])
+    await db.message_buckets.create_index([("messages._id", 1)])
+    await db.message_buckets.create_index([("chat_id", 1), ("messages.client_id", 1)], sparse=True)
+    await db.message_segments.create_index([("chat_id", 1), ("last_at", -1)])
+    await db.message_segments.create_index([("chat_id", 1), ("first_at", 1)])
+    await db.message_segments.create_index([("chat_id", 1), ("message_ids", 1)])
+    await db.message_terms.create_index([("chat_id", 1), ("term", 1), ("created_at", -1), ("message_id", -1)])
+    await db.message_terms.create_index([("message_id", 1)])
+    await db.message_term_stats.create_index([("chat_id", 1), ("term", 1)], unique=True)
+    await db.chat_changes.create_index([("chat_id", 1), ("seq", 1)], unique=True)
+    await db.chat_changes.create_index("created_at", expireAfterSeconds=settings.chat_changes_retention_days * 86400)
+    await db.pending_events.create_index([("user_id", 1), ("event_id", 1)], unique=True)
+    await db.pending_events.create_index("expires_at", expireAfterSeconds=0)
 
     await db.notifications.create_index([("recipient_id", 1), ("created_at", -1)])
     await db.notifications.create_index([("read", 1)])
+    try:
+        await db.notifications.create_index(
+            ROLLING_NOTIFICATION_KEYS, unique=True, partialFilterExpression=ROLLING_NOTIFICATION_FILTER
+        )
+    except OperationFailure:
+        # Duplicates left by concurrent sends from before the index existed.
+        merged = await NotificationRepository(db).merge_rolling_duplicates()
+        logger.warning("Merged %s duplicate rolling message notifications", merged)
+        await db.notifications.create_index(
+            ROLLING_NOTIFICATION_KEYS, unique=True, partialFilterExpression=ROLLING_NOTIFICATION_FILTER
+        )
 
     await db.refresh_tokens.create_index("token", unique=True)
     await db.refresh_tokens.create_index("user_id")
@@ -9,8 +9,12 @@ from starlette.staticfiles import StaticFiles
 
 from app.config import settings
 from app.core.logging_config import configure_logging
-from app.db.mongo import close_client, init_indexes
+from app.db import mongo
 from app.routes import api_router
+from app.services.broker import create_broker
+from app.services.presence import presence_service
+from app.services.realtime import connection_manager
+from app.services.typing import typing_aggregator
 
 configure_logging()
 
@@ -50,7 +54,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"],
     allow_headers=["*"],
-    expose_headers=["Content-Range", "X-Content-Range", "Content-Disposition"],
+    expose_headers=["Content-Range", "X-Content-Range", "Content-Disposition", "X-Next-Cursor"],
     max_age=600,
 )
 
@@ -63,12 +67,18 @@ if settings.media_base_path.exists():
 @app.on_event("startup")
 async def on_startup() -> None:
     app.state.started_at = datetime.utcnow()
-    await init_indexes()
+    await mongo.init_indexes()
+    await connection_manager.start(create_broker())
+    await connection_manager.pending.start(mongo.get_database())
+    await presence_service.start(mongo.get_database())
 
 
 @app.on_event("shutdown")
 async def on_shutdown() -> None:
-    await close_client()
+    await typing_aggregator.close()
+    await presence_service.close()
+    await connection_manager.close()
+    await mongo.close_client()
 
 
 @app.get("/", include_in_schema=False)
@@ -1,11 +1,83 @@
 from __future__ import annotations
 
-from typing import Any, Generic, Iterable, Optional, TypeVar
+import base64
+import binascii
+from typing import Any, Generic, Iterable, Optional, Sequence, TypeVar
 
+from bson import json_util
+from bson.errors import InvalidId
 from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorDatabase
 
 T = TypeVar("T")
 
+SortSpec = list[tuple[str, int]]
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded or does not match the sort spec."""
+
+
+def encode_cursor(values: list[Any]) -> str:
+    raw = json_util.dumps(values).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list[Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json_util.loads(raw)
+    except (binascii.Error, ValueError, InvalidId) as exc:
+        raise InvalidCursorError("Invalid cursor") from exc
+    if not isinstance(values, list):
+        raise InvalidCursorError("Invalid cursor")
+    return values
+
+
+def with_tiebreak(sort: Iterable[tuple[str, int]]) -> SortSpec:
+    spec = list(sort)
+    if not any(field == "_id" for field, _ in spec):
+        spec.append(("_id", spec[-1][1] if spec else -1))
+    return spec
+
+
+def keyset_filter(sort: SortSpec, values: list[Any]) -> dict[str, Any]:
+    """Build the filter selecting documents strictly after ``values`` in ``sort`` order.
+
+    For a spec ``(a, b, _id)`` this expands to
+    ``a > va OR (a == va AND b > vb) OR (a == va AND b == vb AND _id > vid)``
+    with the comparison flipped for descending keys.
+    """
+
+    if len(values) != len(sort):
+        raise InvalidCursorError("Cursor does not match sort order")
+    clauses: list[dict[str, Any]] = []
+    for index, (field, direction) in enumerate(sort):
+        clause = {prefix_field: values[i] for i, (prefix_field, _) in enumerate(sort[:index])}
+        clause[field] = {"$gt" if direction == 1 else "$lt": values[index]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+
+def _field_value(document: dict[str, Any], path: str) -> Any:
+    value: Any = document
+    for part in path.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def _page_filter(query: dict[str, Any], spec: SortSpec, cursor: Optional[str]) -> dict[str, Any]:
+    if not cursor:
+        return query
+    return {"$and": [query, keyset_filter(spec, decode_cursor(cursor))]}
+
+
+def _split_page(documents: list[dict[str, Any]], spec: SortSpec, limit: int) -> tuple[list[dict[str, Any]], Optional[str]]:
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = encode_cursor([_field_value(documents[-1], field) for field, _ in spec])
+    return documents, next_cursor
+
 
 class BaseRepository(Generic[T]):
     def __init__(self, db: AsyncIOMotorDatabase, collection_name: str) -> None:
@@ -37,5 +109,54 @@ class BaseRepository(Generic[T]):
             cursor = cursor.limit(limit)
         return await cursor.to_list(length=limit)
 
+    async def find_page(
+        self,
+        query: dict[str, Any],
+        *,
+        sort: Iterable[tuple[str, int]],
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        skip: int = 0,
+        projection: Optional[dict[str, Any]] = None,
+        collection: Optional[AsyncIOMotorCollection] = None,
+    ) -> tuple[list[dict[str, Any]], Optional[str]]:
+        """Keyset page over ``query`` ordered by ``sort`` with an ``_id`` tiebreak.
+
+        Sort keys must be present on every matching document. ``skip`` is only honoured
+        without a cursor, for clients still paging by offset.
+        """
+
+        spec = with_tiebreak(sort)
+        target = collection if collection is not None else self.collection
+        find_cursor = target.find(_page_filter(query, spec, cursor), projection).sort(spec)
+        if skip and not cursor:
+            find_cursor = find_cursor.skip(skip)
+        documents = await find_cursor.limit(limit + 1).to_list(length=limit + 1)
+        return _split_page(documents, spec, limit)
+
+    async def aggregate_page(
+        self,
+        query: dict[str, Any],
+        *,
+        sort: Iterable[tuple[str, int]],
+        stages: Sequence[dict[str, Any]],
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        skip: int = 0,
+    ) -> tuple[list[dict[str, Any]], Optional[str]]:
+        """Keyset page like ``find_page``, with ``stages`` applied to the page in the same aggregation.
+
+        ``stages`` run after the match/sort/limit, so they only see the page's documents
+        (plus the one that tells whether there is a next page) and must keep the sort keys.
+        """
+
+        spec = with_tiebreak(sort)
+        pipeline: list[dict[str, Any]] = [{"$match": _page_filter(query, spec, cursor)}, {"$sort": dict(spec)}]
+        if skip and not cursor:
+            pipeline.append({"$skip": skip})
+        pipeline += [{"$limit": limit + 1}, *stages]
+        documents = await self.collection.aggregate(pipeline).to_list(length=limit + 1)
+        return _split_page(documents, spec, limit)
+
     async def count_documents(self, query: dict[str, Any]) -> int:
         return await self.collection.count_documents(query)
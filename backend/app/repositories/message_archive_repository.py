@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import gzip
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+
+import aiofiles
+from bson import ObjectId, json_util
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from app.config import settings
+from app.core.cache import LRUCache
+from app.core.utils import to_object_id
+from app.repositories.base import BaseRepository
+from app.repositories.message_repository import in_position_range, message_position
+from app.schemas.message import MessageInDB
+
+# Decoded segments keyed by path; segments are immutable once written.
+segment_cache: LRUCache[str, list[dict[str, Any]]] = LRUCache(settings.message_archive_cache_segments)
+
+
+class MessageArchiveRepository(BaseRepository[dict]):
+    """Cold storage for old chat history.
+
+    Archived messages live in gzip-compressed JSON-lines segment files under ``base_path``,
+    one directory per chat, written once and never modified. ``message_segments`` indexes
+    them by ``(chat_id, first_at, last_at)`` so paging only opens segments in range, and
+    by the ids they hold so history anchors can point at archived messages. Archived
+    messages are read-only and only reachable through history paging.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase, base_path: Path) -> None:
+        super().__init__(db, "message_segments")
+        self.base_path = base_path
+
+    async def write_segment(self, chat_id: ObjectId, messages: list[MessageInDB]) -> dict[str, Any]:
+        """Persist ``messages`` (oldest first) as a new segment and register it."""
+
+        segment_id = ObjectId()
+        relative = Path(str(chat_id)) / f"{segment_id}.jsonl.gz"
+        path = self.base_path / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        lines = []
+        for message in messages:
+            data = message.model_dump(by_alias=True, exclude_none=True)
+            data["_id"] = message.id
+            lines.append(json_util.dumps(data))
+        payload = gzip.compress("\n".join(lines).encode())
+        temporary = path.with_suffix(".tmp")
+        async with aiofiles.open(temporary, "wb") as out_file:
+            await out_file.write(payload)
+        os.replace(temporary, path)
+        segment = {
+            "_id": segment_id,
+            "chat_id": chat_id,
+            "path": relative.as_posix(),
+            "first_at": messages[0].created_at,
+            "last_at": messages[-1].created_at,
+            "count": len(messages),
+            "message_ids": [message.id for message in messages],
+            "bytes": len(payload),
+            "created_at": datetime.utcnow(),
+        }
+        await self.collection.insert_one(segment)
+        return segment
+
+    async def get_message(self, chat_id: str | ObjectId, message_id: ObjectId) -> Optional[MessageInDB]:
+        segment = await self.collection.find_one({"chat_id": to_object_id(chat_id), "message_ids": message_id}, {"path": 1})
+        if not segment:
+            return None
+        for message in await self._read_segment(segment["path"]):
+            if message["_id"] == message_id:
+                return MessageInDB(**message)
+        return None
+
+    async def list_before(
+        self,
+        chat_id: str | ObjectId,
+        *,
+        limit: int,
+        before: Optional[datetime] = None,
+        before_id: Optional[ObjectId] = None,
+        inclusive: bool = False,
+    ) -> list[MessageInDB]:
+        """Newest-first archived messages older than ``(before, before_id)``."""
+
+        filters: dict[str, Any] = {"chat_id": to_object_id(chat_id)}
+        if before:
+            filters["first_at"] = {"$lte": before}
+        bound = (before, before_id) if before else None
+        return await self._scan(filters, bound, limit=limit, newest_first=True, inclusive=inclusive)
+
+    async def list_after(
+        self,
+        chat_id: str | ObjectId,
+        *,
+        limit: int,
+        after: Optional[datetime] = None,
+        after_id: Optional[ObjectId] = None,
+    ) -> list[MessageInDB]:
+        """Oldest-first archived messages newer than ``(after, after_id)``."""
+
+        filters: dict[str, Any] = {"chat_id": to_object_id(chat_id)}
+        if after:
+            filters["last_at"] = {"$gte": after}
+        bound = (after, after_id) if after else None
+        return await self._scan(filters, bound, limit=limit, newest_first=False)
+
+    async def _scan(
+        self,
+        filters: dict[str, Any],
+        bound: Optional[tuple[datetime, Optional[ObjectId]]],
+        *,
+        limit: int,
+        newest_first: bool,
+        inclusive: bool = False,
+    ) -> list[MessageInDB]:
+        edge_field = "last_at" if newest_first else "first_at"
+        page: list[dict[str, Any]] = []
+        async for segment in self.collection.find(filters).sort([(edge_field, -1 if newest_first else 1)]):
+            if len(page) >= limit:
+                page_edge = page[limit - 1]["created_at"]
+                if (segment[edge_field] < page_edge) if newest_first else (segment[edge_field] > page_edge):
+                    break
+            page.extend(
+                message
+                for message in await self._read_segment(segment["path"])
+                if in_position_range(message, bound, older=newest_first, inclusive=inclusive)
+            )
+            # An archival run interrupted before its hot delete re-archives the same messages.
+            page = list({message["_id"]: message for message in page}.values())
+            page.sort(key=message_position, reverse=newest_first)
+            del page[limit:]
+        return [MessageInDB(**message) for message in page]
+
+    async def _read_segment(self, relative: str) -> list[dict[str, Any]]:
+        cached = segment_cache.get(relative)
+        if cached is not None:
+            return cached
+        async with aiofiles.open(self.base_path / relative, "rb") as in_file:
+            payload = await in_file.read()
+        messages = [json_util.loads(line) for line in gzip.decompress(payload).decode().splitlines() if line]
+        segment_cache.set(relative, messages)
+        return messages
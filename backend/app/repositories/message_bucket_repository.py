@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Any, AsyncIterator, Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+
+from app.config import settings
+from app.core.utils import to_object_id
+from app.repositories.message_archive_repository import MessageArchiveRepository
+from app.repositories.message_repository import MessageRepository, in_position_range, message_position
+from app.schemas.message import MessageInDB
+
+def create_message_repository(db: AsyncIOMotorDatabase) -> MessageRepository:
+    """Return the message repository for the configured ``MESSAGE_STORAGE`` layout.
+
+    When ``MESSAGE_ARCHIVE_PATH`` is set, history paging reads through to archived segments.
+    """
+
+    archive = MessageArchiveRepository(db, settings.message_archive_path) if settings.message_archive_path else None
+    if settings.message_storage == "buckets":
+        return BucketedMessageRepository(db, archive=archive)
+    return MessageRepository(db, archive=archive)
+
+
+class BucketedMessageRepository(MessageRepository):
+    """Stores a chat's messages in fixed-size bucket documents instead of one document each.
+
+    A bucket holds up to ``bucket_size`` messages of one chat in ``messages`` together with
+    the ``first_at``/``last_at`` range they cover, so a history page reads a handful of
+    buckets through the ``(chat_id, last_at)`` index. ``count`` tracks slots ever used and
+    is never decremented: removed messages leave gaps and only the newest bucket of a chat
+    accepts appends. Messages are stored without ``chat_id``, which lives on the bucket.
+    """
+
+    def __init__(
+        self,
+        db: AsyncIOMotorDatabase,
+        bucket_size: Optional[int] = None,
+        archive: Optional[MessageArchiveRepository] = None,
+    ) -> None:
+        super().__init__(db, archive=archive)
+        self.collection = db["message_buckets"]
+        self.bucket_size = bucket_size or settings.message_bucket_size
+
+    async def create_message(self, message: MessageInDB) -> MessageInDB:
+        if message.id is None:
+            message.id = ObjectId()
+        # Arrays cannot carry a cross-document unique index; check client ids up front.
+        if message.client_id and await self.find_by_client_id(message.chat_id, message.sender_id, message.client_id):
+            raise DuplicateKeyError("Duplicate client_id for this chat and sender")
+        await self.collection.update_one(
+            {"chat_id": message.chat_id, "count": {"$lt": self.bucket_size}},
+            {
+                "$push": {"messages": self._to_embedded(message)},
+                "$inc": {"count": 1},
+                "$min": {"first_at": message.created_at},
+                "$max": {"last_at": message.created_at},
+            },
+            upsert=True,
+        )
+        return message
+
+    async def _find_before(
+        self,
+        chat_id: str | ObjectId,
+        *,
+        limit: int,
+        before: Optional[datetime] = None,
+        before_id: Optional[ObjectId] = None,
+        inclusive: bool = False,
+    ) -> list[MessageInDB]:
+        filters: dict[str, Any] = {"chat_id": to_object_id(chat_id)}
+        if before:
+            filters["first_at"] = {"$lte": before}
+        bound = (before, before_id) if before else None
+        return await self._scan(filters, bound, limit=limit, newest_first=True, inclusive=inclusive)
+
+    async def _find_after(
+        self,
+        chat_id: str | ObjectId,
+        *,
+        limit: int,
+        after: Optional[datetime] = None,
+        after_id: Optional[ObjectId] = None,
+    ) -> list[MessageInDB]:
+        filters: dict[str, Any] = {"chat_id": to_object_id(chat_id)}
+        if after:
+            filters["last_at"] = {"$gte": after}
+        bound = (after, after_id) if after else None
+        return await self._scan(filters, bound, limit=limit, newest_first=False)
+
+    async def get_message(self, message_id: str | ObjectId) -> Optional[MessageInDB]:
+        oid = to_object_id(message_id)
+        bucket = await self.collection.find_one(
+            {"messages._id": oid},
+            {"chat_id": 1, "messages": {"$elemMatch": {"_id": oid}}},
+        )
+        if not bucket or not bucket.get("messages"):
+            return None
+        return self._from_embedded(bucket["chat_id"], bucket["messages"][0])
+
+    async def find_by_client_id(
+        self,
+        chat_id: str | ObjectId,
+        sender_id: str | ObjectId,
+        client_id: str,
+    ) -> Optional[MessageInDB]:
+        match = {"sender_id": to_object_id(sender_id), "client_id": client_id}
+        bucket = await self.collection.find_one(
+            {"chat_id": to_object_id(chat_id), "messages": {"$elemMatch": match}},
+            {"chat_id": 1, "messages": {"$elemMatch": match}},
+        )
+        if not bucket or not bucket.get("messages"):
+            return None
+        return self._from_embedded(bucket["chat_id"], bucket["messages"][0])
+
+    async def get_messages(self, message_ids: list[ObjectId]) -> list[MessageInDB]:
+        if not message_ids:
+            return []
+        return await self._unwind({"messages._id": {"$in": message_ids}}, {"messages._id": {"$in": message_ids}})
+
+    async def update_message(self, message_id: str | ObjectId, updates: dict, seq: Optional[int] = None) -> Optional[MessageInDB]:
+        updates["updated_at"] = datetime.utcnow()
+        updates["edited"] = True
+        if seq is not None:
+            updates["seq"] = seq
+        await self._set_fields(message_id, updates)
+        return await self.get_message(message_id)
+
+    async def delete_message(self, message_id: str | ObjectId, for_everyone: bool = False, seq: Optional[int] = None) -> bool:
+        oid = to_object_id(message_id)
+        if for_everyone:
+            result = await self.collection.update_one({"messages._id": oid}, {"$pull": {"messages": {"_id": oid}}})
+            return result.modified_count > 0
+        updates: dict = {"content": None, "attachments": [], "type": "system"}
+        if seq is not None:
+            updates["seq"] = seq
+        return await self._set_fields(oid, updates)
+
+    async def count_unread(self, chat_id: str | ObjectId, user_id: str | ObjectId, after: Optional[datetime] = None) -> int:
+        bucket_filter: dict[str, Any] = {"chat_id": to_object_id(chat_id)}
+        message_filter: dict[str, Any] = {"messages.sender_id": {"$ne": to_object_id(user_id)}}
+        if after:
+            bucket_filter["last_at"] = {"$gt": after}
+            message_filter["messages.created_at"] = {"$gt": after}
+        return await self._count(bucket_filter, message_filter)
+
+    async def count_since(self, after: datetime) -> int:
+        return await self._count({"last_at": {"$gte": after}}, {"messages.created_at": {"$gte": after}})
+
+    async def iter_messages(self, chat_id: Optional[str | ObjectId] = None) -> AsyncIterator[MessageInDB]:
+        query = {"chat_id": to_object_id(chat_id)} if chat_id else {}
+        async for bucket in self.collection.find(query).sort([("chat_id", 1), ("first_at", 1)]):
+            for embedded in sorted(bucket["messages"], key=message_position):
+                yield self._from_embedded(bucket["chat_id"], embedded)
+
+    async def archivable_chat_ids(self, cutoff: datetime) -> list[ObjectId]:
+        return await self.collection.distinct("chat_id", {"first_at": {"$lt": cutoff}})
+
+    async def delete_messages(self, chat_id: str | ObjectId, message_ids: list[ObjectId]) -> None:
+        chat_oid = to_object_id(chat_id)
+        await self.collection.update_many(
+            {"chat_id": chat_oid, "messages._id": {"$in": message_ids}},
+            {"$pull": {"messages": {"_id": {"$in": message_ids}}}},
+        )
+        # Full buckets left empty will never receive appends again.
+        await self.collection.delete_many({"chat_id": chat_oid, "count": {"$gte": self.bucket_size}, "messages": {"$size": 0}})
+
+    async def append_chat_messages(self, chat_id: str | ObjectId, messages: list[MessageInDB]) -> None:
+        # Chunks that are a multiple of bucket_size leave only the chat's last bucket partial.
+        chat_oid = to_object_id(chat_id)
+        ordered = sorted(messages, key=lambda message: (message.created_at, message.id))
+        buckets = []
+        for start in range(0, len(ordered), self.bucket_size):
+            chunk = ordered[start : start + self.bucket_size]
+            buckets.append(
+                {
+                    "chat_id": chat_oid,
+                    "count": len(chunk),
+                    "first_at": chunk[0].created_at,
+                    "last_at": chunk[-1].created_at,
+                    "messages": [self._to_embedded(message) for message in chunk],
+                }
+            )
+        if buckets:
+            await self.collection.insert_many(buckets)
+
+    async def _scan(
+        self,
+        filters: dict[str, Any],
+        bound: Optional[tuple[datetime, Optional[ObjectId]]],
+        *,
+        limit: int,
+        newest_first: bool,
+        inclusive: bool = False,
+    ) -> list[MessageInDB]:
+        # Buckets of one chat rarely overlap (only when appends race into two new buckets),
+        # so the walk stops once the next bucket cannot hold anything past the page edge.
+        edge_field = "last_at" if newest_first else "first_at"
+        page: list[dict[str, Any]] = []
+        chat_id = filters["chat_id"]
+        async for bucket in self.collection.find(filters).sort([(edge_field, -1 if newest_first else 1)]):
+            if len(page) >= limit:
+                page_edge = page[limit - 1]["created_at"]
+                if (bucket[edge_field] < page_edge) if newest_first else (bucket[edge_field] > page_edge):
+                    break
+            page.extend(
+                message
+                for message in bucket["messages"]
+                if in_position_range(message, bound, older=newest_first, inclusive=inclusive)
+            )
+            page.sort(key=message_position, reverse=newest_first)
+            del page[limit:]
+        return [self._from_embedded(chat_id, message) for message in page]
+
+    async def _unwind(self, bucket_filter: dict[str, Any], message_filter: dict[str, Any]) -> list[MessageInDB]:
+        pipeline = [{"$match": bucket_filter}, {"$unwind": "$messages"}, {"$match": message_filter}]
+        rows = await self.collection.aggregate(pipeline).to_list(length=None)
+        return [self._from_embedded(row["chat_id"], row["messages"]) for row in rows]
+
+    async def _count(self, bucket_filter: dict[str, Any], message_filter: dict[str, Any]) -> int:
+        pipeline = [
+            {"$match": bucket_filter},
+            {"$unwind": "$messages"},
+            {"$match": message_filter},
+            {"$count": "total"},
+        ]
+        result = await self.collection.aggregate(pipeline).to_list(length=1)
+        return result[0]["total"] if result else 0
+
+    async def _set_fields(self, message_id: str | ObjectId, updates: dict) -> bool:
+        result = await self.collection.update_one(
+            {"messages._id": to_object_id(message_id)},
+            {"$set": {f"messages.$.{field}": value for field, value in updates.items()}},
+        )
+        return result.modified_count > 0
+
+    @staticmethod
+    def _to_embedded(message: MessageInDB) -> dict[str, Any]:
+        data = message.model_dump(by_alias=True, exclude_none=True, exclude={"chat_id"})
+        data["_id"] = message.id
+        return data
+
+    @staticmethod
+    def _from_embedded(chat_id: ObjectId, embedded: dict[str, Any]) -> MessageInDB:
+        return MessageInDB(**embedded, chat_id=chat_id)
@@ -1,14 +1,86 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Optional
+from typing import TYPE_CHECKING, Any, AsyncIterator, Optional
 
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
+from app.config import settings
+from app.core.cache import LRUCache
 from app.core.utils import to_object_id
 from app.repositories.base import BaseRepository
-from app.schemas.message import ChatInDB, ChatType, MessageInDB
+from app.schemas.message import (
+    ChatChangeKind,
+    ChatInDB,
+    ChatLastMessage,
+    ChatMembership,
+    ChatReadMarker,
+    ChatSummary,
+    ChatType,
+    MessageInDB,
+)
+
+if TYPE_CHECKING:
+    from app.repositories.message_archive_repository import MessageArchiveRepository
+
+PREVIEW_LENGTH = 200
+
+# Process-wide; ChatRepository instances are per request.
+chat_membership_cache: LRUCache[str, ChatMembership] = LRUCache(
+    settings.chat_cache_size,
+    ttl_seconds=settings.chat_cache_ttl_seconds,
+)
+
+
+def direct_chat_key(user_a: str | ObjectId, user_b: str | ObjectId) -> str:
+    """Order-independent key identifying the direct chat between two users."""
+
+    return ":".join(sorted([str(user_a), str(user_b)]))
+
+
+def _last_message_snapshot(message: MessageInDB) -> dict:
+    snapshot = ChatLastMessage(
+        id=message.id,
+        sender_id=message.sender_id,
+        preview=message.content[:PREVIEW_LENGTH] if message.content else None,
+        type=message.type,
+        created_at=message.created_at,
+    )
+    return snapshot.model_dump()
+
+
+def _position_filter(created_at: datetime, message_id: Optional[ObjectId], op: str, inclusive: bool = False) -> dict:
+    # Messages are ordered by (created_at, _id); without an id the bound is purely by time.
+    if message_id is None:
+        return {"created_at": {op: created_at}}
+    id_op = f"{op}e" if inclusive else op
+    return {"$or": [{"created_at": {op: created_at}}, {"created_at": created_at, "_id": {id_op: message_id}}]}
+
+
+def message_position(message: dict[str, Any]) -> tuple[datetime, ObjectId]:
+    return message["created_at"], message["_id"]
+
+
+def in_position_range(
+    message: dict[str, Any],
+    bound: Optional[tuple[datetime, Optional[ObjectId]]],
+    *,
+    older: bool,
+    inclusive: bool = False,
+) -> bool:
+    """In-memory counterpart of ``_position_filter`` for messages held outside the collection."""
+
+    if bound is None:
+        return True
+    created_at, message_id = bound
+    key: Any = message["created_at"] if message_id is None else message_position(message)
+    edge: Any = created_at if message_id is None else bound
+    if older:
+        return key <= edge if inclusive else key < edge
+    return key >= edge if inclusive else key > edge
 
 
 class ChatRepository(BaseRepository[ChatInDB]):
@@ -25,17 +97,87 @@ class ChatRepository(BaseRepository[ChatInDB]):
         document = await self.collection.find_one({"_id": to_object_id(chat_id)})
         return ChatInDB(**document) if document else None
 
+    async def get_membership(self, chat_id: str | ObjectId) -> Optional[ChatMembership]:
+        """Cached membership view used to authorize hot paths without a Mongo read."""
+
+        key = str(chat_id)
+        membership = chat_membership_cache.get(key)
+        if membership is not None:
+            return membership
+        document = await self.collection.find_one(
+            {"_id": to_object_id(chat_id)},
+            {"type": 1, "member_ids": 1, "admin_ids": 1},
+        )
+        if not document:
+            return None
+        membership = ChatMembership(**document)
+        chat_membership_cache.set(key, membership)
+        return membership
+
+    async def get_read_marker(self, chat_id: str | ObjectId, user_id: str | ObjectId) -> Optional[ChatReadMarker]:
+        key = f"read_markers.{user_id}"
+        document = await self.collection.find_one({"_id": to_object_id(chat_id)}, {key: 1})
+        marker = (document or {}).get("read_markers", {}).get(str(user_id))
+        return ChatReadMarker(**marker) if marker else None
+
     async def find_direct_chat(self, user_a: str | ObjectId, user_b: str | ObjectId) -> Optional[ChatInDB]:
-        query = {
-            "type": ChatType.DIRECT.value,
-            "member_ids": {"$all": [to_object_id(user_a), to_object_id(user_b)], "$size": 2},
-        }
-        document = await self.collection.find_one(query)
+        document = await self.collection.find_one({"direct_key": direct_chat_key(user_a, user_b)})
         return ChatInDB(**document) if document else None
 
+    async def get_or_create_direct_chat(self, chat: ChatInDB) -> ChatInDB:
+        """Single upsert on the unique direct_key; concurrent callers converge on one chat."""
+
+        key = direct_chat_key(*chat.member_ids)
+        data = chat.model_dump(by_alias=True, exclude_none=True, exclude={"id", "direct_key"})
+        try:
+            document = await self.collection.find_one_and_update(
+                {"direct_key": key},
+                {"$setOnInsert": data},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Lost the race against another upsert for the same pair; theirs is the chat.
+            document = await self.collection.find_one({"direct_key": key})
+        return ChatInDB(**document)
+
+    async def backfill_direct_keys(self) -> int:
+        """Stamp direct_key on direct chats created before it existed, skipping duplicate pairs."""
+
+        stamped = 0
+        async for document in self.collection.find({"type": ChatType.DIRECT.value, "direct_key": {"$exists": False}}):
+            members = document.get("member_ids", [])
+            if len(members) != 2:
+                continue
+            key = direct_chat_key(*members)
+            if await self.collection.find_one({"direct_key": key}, {"_id": 1}):
+                continue
+            await self.collection.update_one({"_id": document["_id"]}, {"$set": {"direct_key": key}})
+            stamped += 1
+        return stamped
+
+    async def backfill_last_messages(self, messages: MessageRepository) -> int:
+        """Snapshot the newest message onto chats written before ``last_message`` existed.
+
+        Chats without messages get an explicit null, so each chat is only looked at once.
+        """
+
+        stamped = 0
+        async for document in self.collection.find({"last_message": {"$exists": False}}, {"_id": 1}):
+            latest = await messages.latest_message(document["_id"])
+            update: dict = {"$set": {"last_message": _last_message_snapshot(latest) if latest else None}}
+            if latest:
+                update["$max"] = {"updated_at": latest.created_at}
+            # A send since the read already wrote a newer snapshot.
+            result = await self.collection.update_one({"_id": document["_id"], "last_message": {"$exists": False}}, update)
+            if latest and result.modified_count:
+                stamped += 1
+        return stamped
+
     async def update_chat(self, chat_id: str | ObjectId, updates: dict) -> Optional[ChatInDB]:
         updates["updated_at"] = datetime.utcnow()
         await self.collection.update_one({"_id": to_object_id(chat_id)}, {"$set": updates})
+        chat_membership_cache.invalidate(str(chat_id))
         return await self.get_chat(chat_id)
 
     async def add_members(self, chat_id: str | ObjectId, member_ids: list[str | ObjectId]) -> None:
@@ -43,64 +185,362 @@ class ChatRepository(BaseRepository[ChatInDB]):
             {"_id": to_object_id(chat_id)},
             {"$addToSet": {"member_ids": {"$each": [to_object_id(i) for i in member_ids]}}},
         )
+        chat_membership_cache.invalidate(str(chat_id))
 
     async def remove_members(self, chat_id: str | ObjectId, member_ids: list[str | ObjectId]) -> None:
         await self.collection.update_one(
             {"_id": to_object_id(chat_id)},
             {"$pull": {"member_ids": {"$in": [to_object_id(i) for i in member_ids]}}},
         )
+        chat_membership_cache.invalidate(str(chat_id))
+
+    async def get_seq(self, chat_id: str | ObjectId) -> int:
+        document = await self.collection.find_one({"_id": to_object_id(chat_id)}, {"seq": 1})
+        return document.get("seq", 0) if document else 0
+
+    async def next_seq(self, chat_id: str | ObjectId) -> int:
+        document = await self.collection.find_one_and_update(
+            {"_id": to_object_id(chat_id)},
+            {"$inc": {"seq": 1}},
+            projection={"seq": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        return document["seq"] if document else 0
+
+    async def record_message(self, chat: ChatInDB | ChatMembership, message: MessageInDB) -> tuple[int, dict[str, int]]:
+        """Apply a new message to the chat in one write.
+
+        The write covers the last-message snapshot, unread counters, the sender's watermark
+        and the chat's change sequence. Returns the sequence number given to the message and
+        the members' updated unread counters.
+        """
+
+        sender = str(message.sender_id)
+        marker = ChatReadMarker(message_id=message.id, created_at=message.created_at)
+        update: dict = {
+            "$set": {
+                "last_message": _last_message_snapshot(message),
+                "updated_at": message.created_at,
+                f"read_markers.{sender}": marker.model_dump(),
+                f"unread_counts.{sender}": 0,
+            },
+        }
+        increments = {f"unread_counts.{member}": 1 for member in chat.member_ids if str(member) != sender}
+        update["$inc"] = {"seq": 1, **increments}
+        document = await self.collection.find_one_and_update(
+            {"_id": chat.id},
+            update,
+            projection={"seq": 1, "unread_counts": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if not document:
+            return 0, {}
+        return document["seq"], document.get("unread_counts", {})
+
+    async def set_read_marker(
+        self,
+        chat_id: str | ObjectId,
+        user_id: str | ObjectId,
+        marker: ChatReadMarker,
+        unread_count: int,
+    ) -> Optional[int]:
+        """Advance a member's watermark; returns the change sequence, or None if it did not move."""
+
+        # Watermarks only move forward; re-reading an older message is a no-op.
+        key = str(user_id)
+        document = await self.collection.find_one_and_update(
+            {
+                "_id": to_object_id(chat_id),
+                "$or": [
+                    {f"read_markers.{key}": None},
+                    {f"read_markers.{key}.created_at": {"$lt": marker.created_at}},
+                ],
+            },
+            {
+                "$set": {f"read_markers.{key}": marker.model_dump(), f"unread_counts.{key}": unread_count},
+                "$inc": {"seq": 1},
+            },
+            projection={"seq": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        return document["seq"] if document else None
+
+    async def backfill_read_marker(
+        self,
+        chat_id: str | ObjectId,
+        user_id: str | ObjectId,
+        marker: ChatReadMarker,
+        unread_count: int,
+    ) -> bool:
+        """Set a watermark derived from legacy data without logging a change; True if it moved."""
+
+        key = str(user_id)
+        result = await self.collection.update_one(
+            {
+                "_id": to_object_id(chat_id),
+                "$or": [
+                    {f"read_markers.{key}": None},
+                    {f"read_markers.{key}.created_at": {"$lt": marker.created_at}},
+                ],
+            },
+            {"$set": {f"read_markers.{key}": marker.model_dump(), f"unread_counts.{key}": unread_count}},
+        )
+        return result.modified_count > 0
+
+    async def discount_unread(self, chat: ChatInDB, message: MessageInDB) -> None:
+        """Decrement unread counters of members who had not yet read a message removed for everyone."""
+
+        decrements = {}
+        for member in chat.member_ids:
+            key = str(member)
+            marker = chat.read_markers.get(key)
+            if member == message.sender_id or (marker and marker.created_at >= message.created_at):
+                continue
+            if chat.unread_counts.get(key, 0) > 0:
+                decrements[f"unread_counts.{key}"] = -1
+        if decrements:
+            await self.collection.update_one({"_id": chat.id}, {"$inc": decrements})
+
+    async def update_last_message(self, chat_id: str | ObjectId, message: MessageInDB) -> None:
+        await self.collection.update_one(
+            {"_id": to_object_id(chat_id), "last_message.id": message.id},
+            {"$set": {"last_message": _last_message_snapshot(message)}},
+        )
+
+    async def replace_last_message(
+        self,
+        chat_id: str | ObjectId,
+        removed_id: str | ObjectId,
+        replacement: Optional[MessageInDB],
+    ) -> None:
+        snapshot = _last_message_snapshot(replacement) if replacement else None
+        await self.collection.update_one(
+            {"_id": to_object_id(chat_id), "last_message.id": to_object_id(removed_id)},
+            {"$set": {"last_message": snapshot}},
+        )
 
-    async def list_user_chats(self, user_id: str | ObjectId, limit: int = 50) -> list[ChatInDB]:
+    async def list_user_chats(self, user_id: str | ObjectId, limit: int = 50) -> list[ChatSummary]:
         cursor = self.collection.find({"member_ids": to_object_id(user_id)}).sort([("updated_at", -1)]).limit(limit)
         documents = await cursor.to_list(length=limit)
-        return [ChatInDB(**doc) for doc in documents]
+        summaries: list[ChatSummary] = []
+        for doc in documents:
+            summary = ChatSummary(**doc)
+            summary.unread_count = summary.unread_counts.get(str(user_id), 0)
+            if summary.last_message:
+                summary.last_message_preview = summary.last_message.preview
+                summary.last_message_at = summary.last_message.created_at
+            summaries.append(summary)
+        return summaries
+
+    async def list_contact_ids(self, user_id: str | ObjectId) -> set[str]:
+        """Ids of every user who shares at least one chat with ``user_id``."""
+
+        oid = to_object_id(user_id)
+        contacts: set[str] = set()
+        async for doc in self.collection.find({"member_ids": oid}, {"member_ids": 1}):
+            contacts.update(str(member_id) for member_id in doc.get("member_ids", []) if member_id != oid)
+        return contacts
 
 
 class MessageRepository(BaseRepository[MessageInDB]):
-    def __init__(self, db: AsyncIOMotorDatabase) -> None:
+    """Hot message storage, with optional read-through to archived history segments."""
+
+    def __init__(self, db: AsyncIOMotorDatabase, archive: Optional[MessageArchiveRepository] = None) -> None:
         super().__init__(db, "messages")
+        self.archive = archive
 
     async def create_message(self, message: MessageInDB) -> MessageInDB:
         data = message.model_dump(by_alias=True, exclude_none=True)
+        if message.id is not None:
+            # The serializer renders ids as strings; keep a pre-assigned id an ObjectId.
+            data["_id"] = message.id
         result = await self.collection.insert_one(data)
         message.id = result.inserted_id
         return message
 
-    async def list_messages(self, chat_id: str | ObjectId, *, limit: int = 50, before: Optional[datetime] = None) -> list[MessageInDB]:
+    async def list_messages(
+        self,
+        chat_id: str | ObjectId,
+        *,
+        limit: int = 50,
+        before: Optional[datetime] = None,
+        before_id: Optional[ObjectId] = None,
+        inclusive: bool = False,
+    ) -> list[MessageInDB]:
+        """Newest-first page of messages older than ``(before, before_id)``, continuing into the archive."""
+
+        messages = await self._find_before(chat_id, limit=limit, before=before, before_id=before_id, inclusive=inclusive)
+        if self.archive is None or len(messages) >= limit:
+            return messages
+        if messages:
+            oldest = messages[-1]
+            before, before_id, inclusive = oldest.created_at, oldest.id, False
+        archived = await self.archive.list_before(
+            chat_id, limit=limit - len(messages), before=before, before_id=before_id, inclusive=inclusive
+        )
+        return messages + archived
+
+    async def list_messages_after(
+        self,
+        chat_id: str | ObjectId,
+        *,
+        limit: int = 50,
+        after: Optional[datetime] = None,
+        after_id: Optional[ObjectId] = None,
+    ) -> list[MessageInDB]:
+        """Oldest-first page of messages newer than ``(after, after_id)``, starting in the archive."""
+
+        if self.archive is not None:
+            archived = await self.archive.list_after(chat_id, limit=limit, after=after, after_id=after_id)
+            if len(archived) >= limit:
+                return archived
+            if archived:
+                newest = archived[-1]
+                hot = await self._find_after(chat_id, limit=limit - len(archived), after=newest.created_at, after_id=newest.id)
+                return archived + hot
+        return await self._find_after(chat_id, limit=limit, after=after, after_id=after_id)
+
+    async def _find_before(
+        self,
+        chat_id: str | ObjectId,
+        *,
+        limit: int,
+        before: Optional[datetime] = None,
+        before_id: Optional[ObjectId] = None,
+        inclusive: bool = False,
+    ) -> list[MessageInDB]:
         filters: dict = {"chat_id": to_object_id(chat_id)}
         if before:
-            filters["created_at"] = {"$lt": before}
-        cursor = self.collection.find(filters).sort([("created_at", -1)]).limit(limit)
+            filters.update(_position_filter(before, before_id, "$lt", inclusive))
+        cursor = self.collection.find(filters).sort([("created_at", -1), ("_id", -1)]).limit(limit)
+        documents = await cursor.to_list(length=limit)
+        return [MessageInDB(**doc) for doc in documents]
+
+    async def _find_after(
+        self,
+        chat_id: str | ObjectId,
+        *,
+        limit: int,
+        after: Optional[datetime] = None,
+        after_id: Optional[ObjectId] = None,
+    ) -> list[MessageInDB]:
+        filters: dict = {"chat_id": to_object_id(chat_id)}
+        if after:
+            filters.update(_position_filter(after, after_id, "$gt"))
+        cursor = self.collection.find(filters).sort([("created_at", 1), ("_id", 1)]).limit(limit)
         documents = await cursor.to_list(length=limit)
         return [MessageInDB(**doc) for doc in documents]
 
+    async def latest_message(self, chat_id: str | ObjectId) -> Optional[MessageInDB]:
+        messages = await self.list_messages(chat_id, limit=1)
+        return messages[0] if messages else None
+
     async def get_message(self, message_id: str | ObjectId) -> Optional[MessageInDB]:
         document = await self.collection.find_one({"_id": to_object_id(message_id)})
         return MessageInDB(**document) if document else None
 
-    async def update_message(self, message_id: str | ObjectId, updates: dict) -> Optional[MessageInDB]:
+    async def get_history_message(self, chat_id: str | ObjectId, message_id: str | ObjectId) -> Optional[MessageInDB]:
+        """A message of ``chat_id`` from hot storage or, once moved there, from the archive."""
+
+        message = await self.get_message(message_id)
+        if message is None and self.archive is not None:
+            message = await self.archive.get_message(chat_id, to_object_id(message_id))
+        return message if message is not None and message.chat_id == to_object_id(chat_id) else None
+
+    async def find_by_client_id(
+        self,
+        chat_id: str | ObjectId,
+        sender_id: str | ObjectId,
+        client_id: str,
+    ) -> Optional[MessageInDB]:
+        document = await self.collection.find_one(
+            {"chat_id": to_object_id(chat_id), "sender_id": to_object_id(sender_id), "client_id": client_id}
+        )
+        return MessageInDB(**document) if document else None
+
+    async def get_messages(self, message_ids: list[ObjectId]) -> list[MessageInDB]:
+        if not message_ids:
+            return []
+        documents = await self.collection.find({"_id": {"$in": message_ids}}).to_list(length=len(message_ids))
+        return [MessageInDB(**doc) for doc in documents]
+
+    async def update_message(self, message_id: str | ObjectId, updates: dict, seq: Optional[int] = None) -> Optional[MessageInDB]:
         updates["updated_at"] = datetime.utcnow()
         updates["edited"] = True
+        if seq is not None:
+            updates["seq"] = seq
         await self.collection.update_one({"_id": to_object_id(message_id)}, {"$set": updates})
         return await self.get_message(message_id)
 
-    async def delete_message(self, message_id: str | ObjectId, for_everyone: bool = False) -> bool:
+    async def delete_message(self, message_id: str | ObjectId, for_everyone: bool = False, seq: Optional[int] = None) -> bool:
         if for_everyone:
             result = await self.collection.delete_one({"_id": to_object_id(message_id)})
             return result.deleted_count > 0
-        result = await self.collection.update_one(
-            {"_id": to_object_id(message_id)},
-            {"$set": {"content": None, "attachments": [], "type": "system"}},
-        )
+        updates: dict = {"content": None, "attachments": [], "type": "system"}
+        if seq is not None:
+            updates["seq"] = seq
+        result = await self.collection.update_one({"_id": to_object_id(message_id)}, {"$set": updates})
         return result.modified_count > 0
 
-    async def mark_as_seen(self, message_id: str | ObjectId, user_id: str | ObjectId) -> None:
-        await self.collection.update_one(
-            {"_id": to_object_id(message_id)},
-            {"$addToSet": {"seen_by": to_object_id(user_id)}},
-        )
+    async def count_unread(self, chat_id: str | ObjectId, user_id: str | ObjectId, after: Optional[datetime] = None) -> int:
+        # Range count on the (chat_id, created_at) index, starting at the member's watermark.
+        filters: dict = {"chat_id": to_object_id(chat_id), "sender_id": {"$ne": to_object_id(user_id)}}
+        if after:
+            filters["created_at"] = {"$gt": after}
+        return await self.collection.count_documents(filters)
+
+    async def count_since(self, after: datetime) -> int:
+        return await self.collection.count_documents({"created_at": {"$gte": after}})
+
+    async def iter_messages(self, chat_id: Optional[str | ObjectId] = None) -> AsyncIterator[MessageInDB]:
+        query = {"chat_id": to_object_id(chat_id)} if chat_id else {}
+        async for document in self.collection.find(query).sort([("chat_id", 1), ("created_at", 1), ("_id", 1)]):
+            yield MessageInDB(**document)
+
+    async def append_chat_messages(self, chat_id: str | ObjectId, messages: list[MessageInDB]) -> None:
+        """Bulk-load a chunk of a chat's messages, oldest first, after those already loaded."""
+
+        documents = []
+        for message in messages:
+            data = message.model_dump(by_alias=True, exclude_none=True)
+            data["_id"] = message.id
+            documents.append(data)
+        if documents:
+            await self.collection.insert_many(documents)
+
+    async def archivable_chat_ids(self, cutoff: datetime) -> list[ObjectId]:
+        return await self.collection.distinct("chat_id", {"created_at": {"$lt": cutoff}})
 
-    async def count_unread(self, chat_id: str | ObjectId, user_id: str | ObjectId) -> int:
-        return await self.collection.count_documents(
-            {"chat_id": to_object_id(chat_id), "seen_by": {"$ne": to_object_id(user_id)}},
+    async def list_archivable(self, chat_id: str | ObjectId, cutoff: datetime, limit: int) -> list[MessageInDB]:
+        """Oldest hot messages of a chat created before ``cutoff``, oldest first."""
+
+        messages = await self._find_after(chat_id, limit=limit)
+        return [message for message in messages if message.created_at < cutoff]
+
+    async def delete_messages(self, chat_id: str | ObjectId, message_ids: list[ObjectId]) -> None:
+        await self.collection.delete_many({"chat_id": to_object_id(chat_id), "_id": {"$in": message_ids}})
+
+    async def delete_chat_messages(self, chat_id: str | ObjectId) -> int:
+        result = await self.collection.delete_many({"chat_id": to_object_id(chat_id)})
+        return result.deleted_count
+
+
+class ChatChangeRepository(BaseRepository[dict]):
+    """Append-only log of chat mutations keyed by the chat's sequence number."""
+
+    def __init__(self, db: AsyncIOMotorDatabase) -> None:
+        super().__init__(db, "chat_changes")
+
+    async def record(self, chat_id: str | ObjectId, seq: int, kind: ChatChangeKind, **fields: Any) -> None:
+        await self.collection.insert_one(
+            {"chat_id": to_object_id(chat_id), "seq": seq, "kind": kind.value, "created_at": datetime.utcnow(), **fields},
         )
+
+    async def list_since(self, chat_id: str | ObjectId, since: int, limit: int) -> list[dict]:
+        cursor = self.collection.find({"chat_id": to_object_id(chat_id), "seq": {"$gt": since}}).sort([("seq", 1)]).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def has_entries_through(self, chat_id: str | ObjectId, seq: int) -> bool:
+        """Whether the log still holds any entry at or before ``seq``."""
+
+        return await self.collection.find_one({"chat_id": to_object_id(chat_id), "seq": {"$lte": seq}}, {"_id": 1}) is not None
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import re
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Any, Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+from app.core.utils import to_object_id
+from app.repositories.base import BaseRepository, decode_cursor, encode_cursor, keyset_filter
+from app.schemas.message import MessageInDB
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 8
+
+_POSTING_SORT = [("created_at", -1), ("message_id", -1)]
+
+
+def tokenize(text: Optional[str]) -> dict[str, list[list[int]]]:
+    """Map each normalized term in ``text`` to its ``[start, end)`` character offsets."""
+
+    terms: dict[str, list[list[int]]] = defaultdict(list)
+    if not text:
+        return terms
+    for match in TOKEN_PATTERN.finditer(text):
+        term = match.group().casefold()
+        if len(term) <= MAX_TERM_LENGTH:
+            terms[term].append([match.start(), match.end()])
+    return terms
+
+
+class MessageSearchRepository(BaseRepository[dict]):
+    """Inverted index over message content: one posting per (message, term).
+
+    ``message_term_stats`` keeps each (chat, term)'s document frequency next to the
+    postings, so a search picks its rarest term with one indexed read.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase) -> None:
+        super().__init__(db, "message_terms")
+        self.stats = db["message_term_stats"]
+
+    async def index_message(self, message: MessageInDB) -> None:
+        postings = [
+            {
+                "chat_id": message.chat_id,
+                "message_id": message.id,
+                "term": term,
+                "positions": positions,
+                "created_at": message.created_at,
+            }
+            for term, positions in tokenize(message.content).items()
+        ]
+        if postings:
+            await self.collection.insert_many(postings)
+            await self._change_frequencies(Counter((message.chat_id, posting["term"]) for posting in postings), 1)
+
+    async def remove_message(self, message_id: str | ObjectId) -> None:
+        await self.remove_messages([to_object_id(message_id)])
+
+    async def remove_messages(self, message_ids: list[ObjectId]) -> None:
+        query = {"message_id": {"$in": message_ids}}
+        removed = Counter(
+            [(posting["chat_id"], posting["term"]) async for posting in self.collection.find(query, {"chat_id": 1, "term": 1})]
+        )
+        await self.collection.delete_many(query)
+        await self._change_frequencies(removed, -1)
+
+    async def clear(self, chat_id: Optional[str | ObjectId] = None) -> None:
+        """Drop the postings and frequencies of one chat, or of every chat."""
+
+        query = {"chat_id": to_object_id(chat_id)} if chat_id else {}
+        await self.collection.delete_many(query)
+        await self.stats.delete_many(query)
+
+    async def reindex_message(self, message: MessageInDB) -> None:
+        await self.remove_message(message.id)
+        await self.index_message(message)
+
+    async def search(
+        self,
+        chat_id: str | ObjectId,
+        terms: list[str],
+        *,
+        limit: int = 50,
+        before: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+    ) -> tuple[list[dict[str, Any]], Optional[str]]:
+        """Return messages containing every term, a page of the newest matches at a time.
+
+        Postings of the rarest term drive the scan in index order; the remaining terms
+        are checked per batch with an ``$in`` lookup, so each page touches only index
+        ranges. Hits carry ``message_id``, ``score`` (term occurrences) and ``highlights``;
+        within a page they are ranked by score, newest first on ties. A term without a
+        frequency matches nothing (``reindex-search`` backfills them for older data).
+        """
+
+        if not terms:
+            return [], None
+        chat_oid = to_object_id(chat_id)
+        counts = {
+            stat["term"]: stat["count"]
+            async for stat in self.stats.find({"chat_id": chat_oid, "term": {"$in": terms}}, {"term": 1, "count": 1})
+        }
+        if len(counts) < len(set(terms)) or any(count <= 0 for count in counts.values()):
+            return [], None
+        driver = min(terms, key=counts.__getitem__)
+        others = [term for term in terms if term != driver]
+
+        position = decode_cursor(cursor) if cursor else None
+        batch_size = max(limit * 2, 20)
+        hits: list[dict[str, Any]] = []
+        exhausted = False
+        while len(hits) < limit:
+            filters: dict[str, Any] = {"chat_id": chat_oid, "term": driver}
+            if before:
+                filters["created_at"] = {"$lt": before}
+            if position:
+                filters = {"$and": [filters, keyset_filter(_POSTING_SORT, position)]}
+            batch = await self.collection.find(filters).sort(_POSTING_SORT).limit(batch_size).to_list(length=batch_size)
+            if not batch:
+                exhausted = True
+                break
+
+            matches: dict[ObjectId, list[dict[str, Any]]] = defaultdict(list)
+            if others:
+                related = self.collection.find(
+                    {"chat_id": chat_oid, "term": {"$in": others}, "message_id": {"$in": [p["message_id"] for p in batch]}}
+                )
+                async for posting in related:
+                    matches[posting["message_id"]].append(posting)
+
+            for index, posting in enumerate(batch):
+                position = [posting["created_at"], posting["message_id"]]
+                found = [posting] + matches.get(posting["message_id"], [])
+                if len({p["term"] for p in found}) < len(terms):
+                    continue
+                offsets = sorted(offset for p in found for offset in p["positions"])
+                hits.append({"message_id": posting["message_id"], "score": len(offsets), "highlights": offsets})
+                if len(hits) == limit:
+                    exhausted = len(batch) < batch_size and index == len(batch) - 1
+                    break
+            else:
+                if len(batch) < batch_size:
+                    exhausted = True
+                    break
+
+        next_cursor = None if exhausted or position is None else encode_cursor(position)
+        hits.sort(key=lambda hit: hit["score"], reverse=True)
+        return hits, next_cursor
+
+    async def _change_frequencies(self, terms: Counter[tuple[ObjectId, str]], sign: int) -> None:
+        if not terms:
+            return
+        await self.stats.bulk_write(
+            [
+                UpdateOne({"chat_id": chat_id, "term": term}, {"$inc": {"count": sign * count}}, upsert=True)
+                for (chat_id, term), count in terms.items()
+            ],
+            ordered=False,
+        )
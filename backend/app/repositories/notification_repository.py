@@ -1,44 +1,213 @@
 from __future__ import annotations
 
+from datetime import datetime
 from typing import List, Optional
 
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 
 from app.core.utils import to_object_id
 from app.repositories.base import BaseRepository
-from app.schemas.notification import NotificationInDB
+from app.schemas.notification import NotificationInDB, NotificationType
+
+DUPLICATE_KEY = 11000
+# A partial unique index allows one unread message notification per recipient and chat.
+ROLLING_NOTIFICATION_KEYS = [("recipient_id", 1), ("type", 1), ("data.chat_id", 1)]
+ROLLING_NOTIFICATION_FILTER = {"type": NotificationType.MESSAGE.value, "read": False}
+_UPSERT_ATTEMPTS = 3
 
 
 class NotificationRepository(BaseRepository[NotificationInDB]):
+    """Notifications plus a per-user unread counter in ``notification_counters``.
+
+    Every write that changes a user's unread set adjusts the counter atomically, so badge
+    reads are a single ``_id`` lookup. Counters are seeded by counting the user's unread
+    notifications on first read; an increment racing that count can be lost, and
+    ``mark_all_as_read`` then resets the counter to its true value of zero.
+    """
+
     def __init__(self, db: AsyncIOMotorDatabase) -> None:
         super().__init__(db, "notifications")
+        self.counters = db["notification_counters"]
 
     async def create_notification(self, notification: NotificationInDB) -> NotificationInDB:
         data = notification.model_dump(by_alias=True, exclude_none=True)
         result = await self.collection.insert_one(data)
         notification.id = result.inserted_id
+        if not notification.read:
+            await self._change_unread(notification.recipient_id, 1)
         return notification
 
-    async def list_for_user(self, user_id: str | ObjectId, *, limit: int = 50, skip: int = 0) -> tuple[List[NotificationInDB], int]:
-        query = {"recipient_id": to_object_id(user_id)}
-        cursor = self.collection.find(query).sort([("created_at", -1)]).skip(skip).limit(limit)
-        documents = await cursor.to_list(length=limit)
-        total = await self.collection.count_documents(query)
-        return [NotificationInDB(**doc) for doc in documents], total
-
-    async def mark_as_read(self, notification_id: str | ObjectId) -> None:
-        await self.collection.update_one(
-            {"_id": to_object_id(notification_id)},
-            {"$set": {"read": True}},
+    async def upsert_message_notifications(
+        self,
+        chat_id: str | ObjectId,
+        message_id: str | ObjectId,
+        sender_id: str | ObjectId,
+        recipient_ids: list[ObjectId],
+    ) -> list[NotificationInDB]:
+        """Fold a chat message into each recipient's rolling unread notification for that chat.
+
+        One unordered bulk write for all recipients; a recipient with an unread
+        notification for the chat gets its counter bumped instead of a new document.
+        ``created_at`` is kept from the first message, so list cursors stay stable, and
+        ``updated_at`` follows the latest one. An upsert that lost a race against a
+        concurrent one for the same recipient is retried as an update. Returns the
+        notifications this created, i.e. for recipients whose unread count grew.
+        """
+
+        if not recipient_ids:
+            return []
+        now = datetime.utcnow()
+        update = {
+            "$set": {"data.message_id": str(message_id), "data.sender_id": str(sender_id), "updated_at": now},
+            "$setOnInsert": {"created_at": now},
+            "$inc": {"data.count": 1},
+        }
+        upserted: dict[int, ObjectId] = {}
+        remaining = list(range(len(recipient_ids)))
+        for attempt in range(_UPSERT_ATTEMPTS):
+            operations = [
+                UpdateOne(
+                    {**ROLLING_NOTIFICATION_FILTER, "recipient_id": recipient_ids[index], "data.chat_id": str(chat_id)},
+                    update,
+                    upsert=True,
+                )
+                for index in remaining
+            ]
+            try:
+                result = await self.collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as exc:
+                errors = exc.details.get("writeErrors", [])
+                if attempt == _UPSERT_ATTEMPTS - 1 or any(error["code"] != DUPLICATE_KEY for error in errors):
+                    raise
+                upserted.update({remaining[row["index"]]: row["_id"] for row in exc.details.get("upserted", [])})
+                remaining = [remaining[error["index"]] for error in errors]
+                continue
+            upserted.update({remaining[index]: notification_id for index, notification_id in result.upserted_ids.items()})
+            break
+        # An upserted document holds exactly the filter's equality fields plus the update.
+        created = [
+            NotificationInDB(
+                _id=notification_id,
+                recipient_id=recipient_ids[index],
+                type=NotificationType.MESSAGE,
+                read=False,
+                created_at=now,
+                updated_at=now,
+                data={"chat_id": str(chat_id), "message_id": str(message_id), "sender_id": str(sender_id), "count": 1},
+            )
+            for index, notification_id in sorted(upserted.items())
+        ]
+        if created:
+            await self.counters.update_many(
+                {"_id": {"$in": [notification.recipient_id for notification in created]}}, {"$inc": {"unread": 1}}
+            )
+        return created
+
+    async def merge_rolling_duplicates(self) -> int:
+        """Fold duplicate unread message notifications of a chat into the newest; returns how many went.
+
+        Concurrent sends could create them before the partial unique index existed.
+        """
+
+        merged = 0
+        async for group in self.collection.aggregate(
+            [
+                {"$match": ROLLING_NOTIFICATION_FILTER},
+                {"$sort": {"created_at": -1}},
+                {
+                    "$group": {
+                        "_id": {"recipient_id": "$recipient_id", "chat_id": "$data.chat_id"},
+                        "ids": {"$push": "$_id"},
+                        "count": {"$sum": "$data.count"},
+                        "documents": {"$sum": 1},
+                    }
+                },
+                {"$match": {"documents": {"$gt": 1}}},
+            ]
+        ):
+            keep, *duplicates = group["ids"]
+            await self.collection.update_one({"_id": keep}, {"$set": {"data.count": group["count"]}})
+            await self.collection.delete_many({"_id": {"$in": duplicates}})
+            await self._change_unread(group["_id"]["recipient_id"], -len(duplicates))
+            merged += len(duplicates)
+        return merged
+
+    async def get_notification(self, notification_id: str | ObjectId) -> Optional[NotificationInDB]:
+        document = await self.collection.find_one({"_id": to_object_id(notification_id)})
+        return NotificationInDB(**document) if document else None
+
+    async def list_for_user(
+        self,
+        user_id: str | ObjectId,
+        *,
+        limit: int = 50,
+        skip: int = 0,
+        cursor: Optional[str] = None,
+    ) -> tuple[List[NotificationInDB], Optional[str]]:
+        documents, next_cursor = await self.find_page(
+            {"recipient_id": to_object_id(user_id)},
+            sort=[("created_at", -1)],
+            limit=limit,
+            cursor=cursor,
+            skip=skip,
         )
+        return [NotificationInDB(**doc) for doc in documents], next_cursor
+
+    async def count_for_user(self, user_id: str | ObjectId) -> int:
+        return await self.collection.count_documents({"recipient_id": to_object_id(user_id)})
+
+    async def mark_as_read(self, notification_id: str | ObjectId) -> bool:
+        document = await self.collection.find_one_and_update(
+            {"_id": to_object_id(notification_id), "read": False},
+            {"$set": {"read": True, "read_at": datetime.utcnow()}},
+        )
+        if document is None:
+            return False
+        await self._change_unread(document["recipient_id"], -1)
+        return True
 
     async def mark_all_as_read(self, user_id: str | ObjectId) -> int:
         result = await self.collection.update_many(
             {"recipient_id": to_object_id(user_id), "read": False},
-            {"$set": {"read": True}},
+            {"$set": {"read": True, "read_at": datetime.utcnow()}},
         )
+        # Nothing is unread now; setting rather than decrementing heals a drifted counter.
+        await self.counters.update_one({"_id": to_object_id(user_id)}, {"$set": {"unread": 0}}, upsert=True)
         return result.modified_count
 
     async def unread_count(self, user_id: str | ObjectId) -> int:
-        return await self.collection.count_documents({"recipient_id": to_object_id(user_id), "read": False})
+        return (await self.unread_counts([to_object_id(user_id)]))[str(user_id)]
+
+    async def unread_counts(self, user_ids: list[ObjectId]) -> dict[str, int]:
+        """Unread notification counts keyed by user id string, seeding missing counters.
+
+        Missing counters are counted with one aggregation and seeded with one bulk write.
+        """
+
+        counts = {str(doc["_id"]): max(doc["unread"], 0) async for doc in self.counters.find({"_id": {"$in": user_ids}})}
+        missing = [user_id for user_id in user_ids if str(user_id) not in counts]
+        if not missing:
+            return counts
+        unread = {user_id: 0 for user_id in missing}
+        async for row in self.collection.aggregate(
+            [
+                {"$match": {"recipient_id": {"$in": missing}, "read": False}},
+                {"$group": {"_id": "$recipient_id", "unread": {"$sum": 1}}},
+            ]
+        ):
+            unread[row["_id"]] = row["unread"]
+        await self.counters.bulk_write(
+            [UpdateOne({"_id": user_id}, {"$setOnInsert": {"unread": count}}, upsert=True) for user_id, count in unread.items()],
+            ordered=False,
+        )
+        # Re-read: a concurrent request may have seeded (and moved) a counter first.
+        async for doc in self.counters.find({"_id": {"$in": missing}}):
+            counts[str(doc["_id"])] = max(doc["unread"], 0)
+        return counts
+
+    async def _change_unread(self, user_id: str | ObjectId, delta: int) -> None:
+        # Unseeded counters are left alone; the first read counts the documents instead.
+        await self.counters.update_one({"_id": to_object_id(user_id)}, {"$inc": {"unread": delta}})
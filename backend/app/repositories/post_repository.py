@@ -1,14 +1,41 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Optional
+from typing import Any, Mapping, Optional
 
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
 
+from app.config import settings
+from app.core.cache import LRUCache
 from app.core.utils import to_object_id
 from app.repositories.base import BaseRepository
-from app.schemas.post import CommentInDB, PostInDB
+from app.schemas.post import CommentInDB, PostInDB, PostPublic
+
+# Feed totals per department ("" for the whole feed); may be off by recent posts for up to the TTL.
+feed_totals: LRUCache[str, int] = LRUCache(1_000, ttl_seconds=settings.feed_total_ttl_seconds)
+
+# Public fields of a post or comment author, besides its id.
+AUTHOR_FIELDS = ("full_name", "avatar_url", "username")
+
+# Run on each feed page inside its aggregation: the author's public fields. Counts are
+# maintained on the post, so the liker list is dropped before it leaves the server.
+_FEED_PAGE_STAGES: list[dict[str, Any]] = [
+    {"$project": {"like_user_ids": 0}},
+    {"$lookup": {"from": "users", "localField": "author_id", "foreignField": "_id", "as": "author"}},
+    {
+        "$addFields": {
+            "author": {
+                "$map": {
+                    "input": "$author",
+                    "as": "user",
+                    "in": {"id": "$$user._id", **{field: f"$$user.{field}" for field in AUTHOR_FIELDS}},
+                }
+            },
+        }
+    },
+]
 
 
 class PostRepository(BaseRepository[PostInDB]):
@@ -20,6 +47,7 @@ class PostRepository(BaseRepository[PostInDB]):
         data = post.model_dump(by_alias=True, exclude_none=True)
         result = await self.collection.insert_one(data)
         post.id = result.inserted_id
+        _invalidate_totals(post.department)
         return post
 
     async def get_post(self, post_id: str | ObjectId) -> Optional[PostInDB]:
@@ -32,37 +60,84 @@ class PostRepository(BaseRepository[PostInDB]):
         return await self.get_post(post_id)
 
     async def delete_post(self, post_id: str | ObjectId) -> bool:
-        result = await self.collection.delete_one({"_id": to_object_id(post_id)})
+        document = await self.collection.find_one_and_delete({"_id": to_object_id(post_id)}, projection={"department": 1})
         await self.comments.delete_many({"post_id": to_object_id(post_id)})
-        return result.deleted_count > 0
+        if not document:
+            return False
+        _invalidate_totals(document.get("department"))
+        return True
+
+    async def list_feed(
+        self,
+        *,
+        limit: int,
+        skip: int = 0,
+        cursor: Optional[str] = None,
+        department: Optional[str] = None,
+        author_ids: Optional[list[ObjectId]] = None,
+        viewer_id: Optional[str | ObjectId] = None,
+    ) -> tuple[list[PostPublic], Optional[str]]:
+        """One feed page, with author summaries and ``viewer_id``'s likes, in a single aggregation."""
 
-    async def list_feed(self, *, skip: int, limit: int, department: Optional[str] = None, author_ids: Optional[list[ObjectId]] = None) -> list[PostInDB]:
         filters: dict = {}
         if department:
             filters["department"] = department
         if author_ids:
             filters["author_id"] = {"$in": author_ids}
 
-        cursor = self.collection.find(filters).sort([("pinned", -1), ("created_at", -1)]).skip(skip).limit(limit)
-        documents = await cursor.to_list(length=limit)
-        return [PostInDB(**doc) for doc in documents]
-
-    async def like_post(self, post_id: str | ObjectId, user_id: str | ObjectId) -> None:
-        await self.collection.update_one(
-            {"_id": to_object_id(post_id)},
-            {"$addToSet": {"like_user_ids": to_object_id(user_id)}},
+        stages = _FEED_PAGE_STAGES
+        if viewer_id is not None:
+            liked = {"$in": [to_object_id(viewer_id), {"$ifNull": ["$like_user_ids", []]}]}
+            stages = [{"$addFields": {"liked": liked}}, *stages]
+        documents, next_cursor = await self.aggregate_page(
+            filters,
+            sort=[("pinned", -1), ("created_at", -1)],
+            stages=stages,
+            limit=limit,
+            cursor=cursor,
+            skip=skip,
+        )
+        return [_feed_post(doc) for doc in documents], next_cursor
+
+    async def count_feed(self, department: Optional[str] = None) -> int:
+        """Posts in the feed (of ``department``), cached for ``FEED_TOTAL_TTL_SECONDS``.
+
+        The whole feed uses the collection's estimated count rather than a scan.
+        """
+
+        key = department or ""
+        total = feed_totals.get(key)
+        if total is None:
+            if department:
+                total = await self.collection.count_documents({"department": department})
+            else:
+                total = await self.collection.estimated_document_count()
+            feed_totals.set(key, total)
+        return total
+
+    async def like_post(self, post_id: str | ObjectId, user_id: str | ObjectId) -> Optional[PostInDB]:
+        """Add the like and bump ``like_count`` in one update; a repeated like changes nothing."""
+
+        document = await self.collection.find_one_and_update(
+            {"_id": to_object_id(post_id), "like_user_ids": {"$ne": to_object_id(user_id)}},
+            {"$addToSet": {"like_user_ids": to_object_id(user_id)}, "$inc": {"like_count": 1}},
+            return_document=ReturnDocument.AFTER,
         )
+        return PostInDB(**document) if document else await self.get_post(post_id)
 
-    async def unlike_post(self, post_id: str | ObjectId, user_id: str | ObjectId) -> None:
-        await self.collection.update_one(
-            {"_id": to_object_id(post_id)},
-            {"$pull": {"like_user_ids": to_object_id(user_id)}},
+    async def unlike_post(self, post_id: str | ObjectId, user_id: str | ObjectId) -> Optional[PostInDB]:
+        document = await self.collection.find_one_and_update(
+            {"_id": to_object_id(post_id), "like_user_ids": to_object_id(user_id)},
+            {"$pull": {"like_user_ids": to_object_id(user_id)}, "$inc": {"like_count": -1}},
+            return_document=ReturnDocument.AFTER,
         )
+        return PostInDB(**document) if document else await self.get_post(post_id)
 
     async def add_comment(self, comment: CommentInDB) -> CommentInDB:
         data = comment.model_dump(by_alias=True, exclude_none=True)
         result = await self.comments.insert_one(data)
         comment.id = result.inserted_id
+        await self.collection.update_one({"_id": comment.post_id}, {"$inc": {"comment_count": 1}})
         return comment
 
     async def update_comment(self, comment_id: str | ObjectId, updates: dict) -> Optional[CommentInDB]:
@@ -71,14 +146,89 @@ class PostRepository(BaseRepository[PostInDB]):
         document = await self.comments.find_one({"_id": to_object_id(comment_id)})
         return CommentInDB(**document) if document else None
 
-    async def delete_comment(self, comment_id: str | ObjectId, user_id: str | ObjectId) -> bool:
-        result = await self.comments.delete_one({"_id": to_object_id(comment_id), "author_id": to_object_id(user_id)})
-        return result.deleted_count > 0
+    async def delete_comment(self, comment_id: str | ObjectId, user_id: str | ObjectId) -> Optional[CommentInDB]:
+        document = await self.comments.find_one_and_delete({"_id": to_object_id(comment_id), "author_id": to_object_id(user_id)})
+        if not document:
+            return None
+        await self.collection.update_one({"_id": document["post_id"]}, {"$inc": {"comment_count": -1}})
+        return CommentInDB(**document)
+
+    async def list_comments(
+        self,
+        post_id: str | ObjectId,
+        *,
+        skip: int = 0,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+    ) -> tuple[list[CommentInDB], Optional[str]]:
+        documents, next_cursor = await self.find_page(
+            {"post_id": to_object_id(post_id)},
+            sort=[("created_at", 1)],
+            limit=limit,
+            cursor=cursor,
+            skip=skip,
+            collection=self.comments,
+        )
+        return [CommentInDB(**doc) for doc in documents], next_cursor
+
+    async def get_counts(self, post_id: str | ObjectId) -> tuple[int, int]:
+        """The post's maintained ``(like_count, comment_count)``."""
+
+        document = await self.collection.find_one({"_id": to_object_id(post_id)}, {"like_count": 1, "comment_count": 1})
+        document = document or {}
+        return document.get("like_count", 0), document.get("comment_count", 0)
+
+    async def backfill_counts(self) -> int:
+        """Compute the counters of posts written before they were maintained.
+
+        Run before serving, so a like or comment never increments a missing counter.
+        """
+
+        filled = 0
+        query = {"$or": [{"like_count": {"$exists": False}}, {"comment_count": {"$exists": False}}]}
+        async for post in self.collection.find(query, {"_id": 1}):
+            if await self.reconcile_counts(post["_id"]):
+                filled += 1
+        return filled
+
+    async def reconcile_counts(self, post_id: str | ObjectId) -> bool:
+        """Recompute the post's counters from its likers and comments; True if they had drifted.
+
+        The new values are only written if the counters did not move meanwhile, so a
+        concurrent like or comment is never overwritten; a later run picks the post up again.
+        """
+
+        document = await self.collection.find_one(
+            {"_id": to_object_id(post_id)}, {"like_user_ids": 1, "like_count": 1, "comment_count": 1}
+        )
+        if not document:
+            return False
+        like_count = len(document.get("like_user_ids", []))
+        comment_count = await self.comments.count_documents({"post_id": document["_id"]})
+        stored = (document.get("like_count"), document.get("comment_count"))
+        if stored == (like_count, comment_count):
+            return False
+        result = await self.collection.update_one(
+            {"_id": document["_id"], "like_count": stored[0], "comment_count": stored[1]},
+            {"$set": {"like_count": like_count, "comment_count": comment_count}},
+        )
+        return result.modified_count > 0
+
+
+def author_summary(user: Optional[Mapping[str, Any]]) -> Optional[dict[str, Any]]:
+    """The ``author`` of a post or comment, from a user's ``model_dump()`` or the feed lookup."""
+
+    if not user:
+        return None
+    return {"id": str(user["id"]), **{field: user.get(field) for field in AUTHOR_FIELDS}}
+
+
+def _feed_post(document: dict[str, Any]) -> PostPublic:
+    authors = document.pop("author", [])
+    return PostPublic(**document, author=author_summary(authors[0] if authors else None))
 
-    async def list_comments(self, post_id: str | ObjectId, *, skip: int = 0, limit: int = 50) -> list[CommentInDB]:
-        cursor = self.comments.find({"post_id": to_object_id(post_id)}).sort([("created_at", 1)]).skip(skip).limit(limit)
-        documents = await cursor.to_list(length=limit)
-        return [CommentInDB(**doc) for doc in documents]
 
-    async def comments_count(self, post_id: str | ObjectId) -> int:
-        return await self.comments.count_documents({"post_id": to_object_id(post_id)})
+def _invalidate_totals(department: Optional[str]) -> None:
+    feed_totals.invalidate("")
+    if department:
+        feed_totals.invalidate(department)
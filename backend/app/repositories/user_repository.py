@@ -5,6 +5,7 @@ from typing import Optional
 
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
 
 from app.core.utils import to_object_id
 from app.repositories.base import BaseRepository
@@ -51,13 +52,32 @@ class UserRepository(BaseRepository[UserInDB]):
             {"$set": {"status": status.value, "last_seen_at": datetime.utcnow()}},
         )
 
+    async def set_last_seen(self, last_seen: dict[str, datetime]) -> None:
+        """Persist ``last_seen_at`` for many users in one bulk write."""
+
+        if not last_seen:
+            return
+        operations = [
+            UpdateOne({"_id": to_object_id(user_id)}, {"$max": {"last_seen_at": seen_at}})
+            for user_id, seen_at in last_seen.items()
+        ]
+        await self.collection.bulk_write(operations, ordered=False)
+
     async def record_login(self, user_id: str | ObjectId) -> None:
         await self.collection.update_one(
             {"_id": to_object_id(user_id)},
             {"$set": {"last_login_at": datetime.utcnow(), "last_seen_at": datetime.utcnow(), "status": UserStatus.ONLINE.value}},
         )
 
-    async def search_users(self, query: str | None, department: str | None, *, skip: int, limit: int) -> tuple[list[UserInDB], int]:
+    async def search_users(
+        self,
+        query: str | None,
+        department: str | None,
+        *,
+        skip: int,
+        limit: int,
+        cursor: Optional[str] = None,
+    ) -> tuple[list[UserInDB], Optional[int], Optional[str]]:
         filters: dict = {}
         if query:
             filters["$or"] = [
@@ -68,15 +88,20 @@ class UserRepository(BaseRepository[UserInDB]):
         if department:
             filters["department"] = department
 
-        cursor = self.collection.find(filters).sort([("full_name", 1)]).skip(skip).limit(limit)
-        documents = await cursor.to_list(length=limit)
-        total = await self.collection.count_documents(filters)
-        return [UserInDB(**doc) for doc in documents], total
+        documents, next_cursor = await self.find_page(
+            filters,
+            sort=[("full_name", 1)],
+            limit=limit,
+            cursor=cursor,
+            skip=skip,
+        )
+        # The total only matters for the first page; keyset pages skip the full count.
+        total = None if cursor else await self.collection.count_documents(filters)
+        return [UserInDB(**doc) for doc in documents], total, next_cursor
 
-    async def list_users(self, *, skip: int, limit: int) -> list[UserInDB]:
-        cursor = self.collection.find({}).sort([("full_name", 1)]).skip(skip).limit(limit)
-        documents = await cursor.to_list(length=limit)
-        return [UserInDB(**doc) for doc in documents]
+    async def list_users(self, *, skip: int, limit: int, cursor: Optional[str] = None) -> tuple[list[UserInDB], Optional[str]]:
+        documents, next_cursor = await self.find_page({}, sort=[("full_name", 1)], limit=limit, cursor=cursor, skip=skip)
+        return [UserInDB(**doc) for doc in documents], next_cursor
 
     async def push_storage_delta(self, user_id: str | ObjectId, delta_bytes: int) -> None:
         await self.collection.update_one(
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, Response, status
 
 from app.core.dependencies import get_current_admin_user, get_user_repository
 from app.schemas.user import AdminUserUpdate, UserInDB, UserPublic
@@ -15,12 +15,17 @@ def get_admin_user_service(users=Depends(get_user_repository)) -> UserService:
 
 @router.get("/users", response_model=list[UserPublic])
 async def admin_list_users(
+    response: Response,
     limit: int = 100,
     offset: int = 0,
+    cursor: str | None = None,
     service: UserService = Depends(get_admin_user_service),
     _: UserInDB = Depends(get_current_admin_user),
 ) -> list[UserPublic]:
-    return await service.list_users(limit=limit, offset=offset)
+    users, next_cursor = await service.list_users(limit=limit, offset=offset, cursor=cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return users
 
 
 @router.patch("/users/{user_id}", response_model=UserPublic)
@@ -5,13 +5,26 @@ from datetime import datetime
 from fastapi import APIRouter, Body, Depends, Query, Response, status
 
 from app.core.dependencies import (
+    get_chat_change_repository,
     get_chat_repository,
     get_current_active_user,
     get_message_repository,
+    get_message_search_repository,
     get_notification_repository,
 )
 from app.services.message_service import MessageService
-from app.schemas.message import ChatCreate, ChatInDB, ChatSummary, MessageCreate, MessagePublic, MessageUpdate
+from app.schemas.message import (
+    ChatChanges,
+    ChatCreate,
+    ChatInDB,
+    ChatSummary,
+    MessageCreate,
+    MessagePublic,
+    MessageReceipts,
+    MessageSearchQuery,
+    MessageSearchResponse,
+    MessageUpdate,
+)
 from app.schemas.user import UserInDB
 
 router = APIRouter(prefix="/messaging", tags=["messaging"])
@@ -21,8 +34,10 @@ def get_message_service(
     chats=Depends(get_chat_repository),
     messages=Depends(get_message_repository),
     notifications=Depends(get_notification_repository),
+    search=Depends(get_message_search_repository),
+    changes=Depends(get_chat_change_repository),
 ) -> MessageService:
-    return MessageService(chats, messages, notifications)
+    return MessageService(chats, messages, notifications, search, changes)
 
 
 @router.post("/chats/direct", response_model=ChatInDB, status_code=status.HTTP_201_CREATED)
@@ -57,10 +72,50 @@ async def list_messages(
     chat_id: str,
     limit: int = Query(default=50, le=100),
     before: datetime | None = Query(default=None),
+    after: datetime | None = Query(default=None),
+    before_id: str | None = Query(default=None),
+    after_id: str | None = Query(default=None),
+    around: str | None = Query(default=None, description="Return a window centred on this message id"),
+    around_unread: bool = Query(default=False, description="Return a window centred on the caller's read watermark"),
     service: MessageService = Depends(get_message_service),
     current_user: UserInDB = Depends(get_current_active_user),
 ) -> list[MessagePublic]:
-    return await service.list_messages(chat_id, str(current_user.id), limit=limit, before=before)
+    return await service.list_messages(
+        chat_id,
+        str(current_user.id),
+        limit=limit,
+        before=before,
+        after=after,
+        before_id=before_id,
+        after_id=after_id,
+        around=around,
+        around_unread=around_unread,
+    )
+
+
+@router.get("/chats/{chat_id}/search", response_model=MessageSearchResponse)
+async def search_messages(
+    chat_id: str,
+    q: str = Query(..., min_length=1, max_length=256, description="Search query"),
+    limit: int = Query(default=20, le=50),
+    before: datetime | None = Query(default=None),
+    cursor: str | None = Query(default=None),
+    service: MessageService = Depends(get_message_service),
+    current_user: UserInDB = Depends(get_current_active_user),
+) -> MessageSearchResponse:
+    payload = MessageSearchQuery(chat_id=chat_id, query=q, limit=limit, before=before, cursor=cursor)
+    return await service.search_messages(str(current_user.id), payload)
+
+
+@router.get("/chats/{chat_id}/changes", response_model=ChatChanges)
+async def list_changes(
+    chat_id: str,
+    since: int = Query(default=0, ge=0, description="Last sequence number the client has applied"),
+    limit: int = Query(default=200, ge=1, le=1000),
+    service: MessageService = Depends(get_message_service),
+    current_user: UserInDB = Depends(get_current_active_user),
+) -> ChatChanges:
+    return await service.changes_since(chat_id, str(current_user.id), since, limit=limit)
 
 
 @router.post("/chats/{chat_id}/messages", response_model=MessagePublic, status_code=status.HTTP_201_CREATED)
@@ -116,6 +171,16 @@ async def mark_seen(
     await service.mark_seen(chat_id, str(current_user.id), message_id)
 
 
+@router.get("/chats/{chat_id}/messages/{message_id}/receipts", response_model=MessageReceipts)
+async def get_receipts(
+    chat_id: str,
+    message_id: str,
+    service: MessageService = Depends(get_message_service),
+    current_user: UserInDB = Depends(get_current_active_user),
+) -> MessageReceipts:
+    return await service.get_receipts(chat_id, str(current_user.id), message_id)
+
+
 @router.post(
     "/chats/{chat_id}/seen",
     status_code=status.HTTP_204_NO_CONTENT,
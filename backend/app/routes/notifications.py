@@ -18,10 +18,11 @@ def get_notification_service(notifications=Depends(get_notification_repository))
 async def list_notifications(
     limit: int = 50,
     offset: int = 0,
+    cursor: str | None = None,
     service: NotificationService = Depends(get_notification_service),
     current_user: UserInDB = Depends(get_current_active_user),
 ) -> NotificationListResponse:
-    return await service.list_notifications(str(current_user.id), limit=limit, offset=offset)
+    return await service.list_notifications(str(current_user.id), limit=limit, offset=offset, cursor=cursor)
 
 
 @router.post(
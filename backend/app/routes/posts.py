@@ -31,10 +31,13 @@ async def list_posts(
     department: str | None = Query(default=None),
     limit: int = Query(default=20, le=50),
     offset: int = Query(default=0, ge=0),
+    cursor: str | None = Query(default=None),
     service: PostService = Depends(get_post_service),
     current_user: UserInDB = Depends(get_current_active_user),
 ) -> FeedResponse:
-    return await service.list_feed(limit=limit, offset=offset, department=department)
+    return await service.list_feed(
+        limit=limit, offset=offset, cursor=cursor, department=department, viewer_id=str(current_user.id)
+    )
 
 
 @router.get("/{post_id}", response_model=PostPublic)
@@ -87,12 +90,17 @@ async def unlike_post(
 @router.get("/{post_id}/comments", response_model=list[CommentPublic])
 async def list_comments(
     post_id: str,
+    response: Response,
     limit: int = Query(default=50, le=100),
     offset: int = Query(default=0, ge=0),
+    cursor: str | None = Query(default=None),
     service: PostService = Depends(get_post_service),
     current_user: UserInDB = Depends(get_current_active_user),
 ) -> list[CommentPublic]:
-    return await service.list_comments(post_id, limit=limit, offset=offset)
+    comments, next_cursor = await service.list_comments(post_id, limit=limit, offset=offset, cursor=cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return comments
 
 
 @router.post("/{post_id}/comments", response_model=CommentPublic, status_code=status.HTTP_201_CREATED)
@@ -1,77 +1,243 @@
 from __future__ import annotations
 
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+import asyncio
+from typing import Any, Optional
 
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from starlette.websockets import WebSocketState
+
+from app.config import settings
+from app.core.dependencies import get_db
+from app.core.serialization import COMPACT_KEYS, loads_json, loads_msgpack, negotiate_encoding, negotiate_profile
 from app.core.security import TokenError, decode_token
-from app.db.mongo import get_database
-from app.repositories.message_repository import ChatRepository, MessageRepository
-from app.services.realtime import connection_manager
+from app.repositories.message_bucket_repository import create_message_repository
+from app.repositories.message_repository import ChatChangeRepository, ChatRepository
+from app.services.message_service import MessageService
+from app.services.presence import presence_service
+from app.services.realtime import IDLE_CLOSE_CODE, connection_manager
+from app.services.typing import typing_aggregator
 
 router = APIRouter()
 
 
 @router.websocket("/ws/chats/{chat_id}")
-async def chat_websocket(websocket: WebSocket, chat_id: str) -> None:
-    token = websocket.query_params.get("token")
-    if not token:
-        await websocket.close(code=4401)
-        return
-    try:
-        payload = decode_token(token)
-    except TokenError:
-        await websocket.close(code=4401)
-        return
-    user_id = payload.get("sub")
+async def chat_websocket(websocket: WebSocket, chat_id: str, db=Depends(get_db)) -> None:
+    user_id = await _authenticate(websocket)
     if not user_id:
-        await websocket.close(code=4401)
         return
 
-    db = get_database()
-    chat_repo = ChatRepository(db)
-    message_repo = MessageRepository(db)
-
-    chat = await chat_repo.get_chat(chat_id)
-    if not chat or all(str(member) != user_id for member in getattr(chat, "member_ids", [])):
+    service = _build_service(db)
+    if not await _is_member(service, chat_id, user_id):
         await websocket.close(code=4403)
         return
 
-    await connection_manager.connect(chat_id, websocket)
+    encoding = negotiate_encoding(websocket.query_params.get("encoding"))
+    profile = _negotiate_profile(websocket)
+    await connection_manager.connect(chat_id, websocket, encoding, profile)
+    await presence_service.connected(user_id)
     try:
-        await connection_manager.send_personal_message(websocket, {"event": "connected", "data": {"chat_id": chat_id}})
+        await _send_connected(websocket, {"chat_id": chat_id}, encoding, profile)
+        since_seq = websocket.query_params.get("since_seq")
+        if since_seq is not None and since_seq.isdigit():
+            await _send_missed_changes(websocket, service, chat_id, user_id, int(since_seq))
         while True:
-            data = await websocket.receive_json()
+            data = await _receive(websocket)
+            if data is None:
+                await connection_manager.disconnect(chat_id, websocket)
+                await _close(websocket, IDLE_CLOSE_CODE)
+                return
             event = data.get("event")
+            if event != "pong":
+                presence_service.heartbeat(user_id)
             if event == "ping":
                 await connection_manager.send_personal_message(websocket, {"event": "pong"})
+            elif event == "pong":
+                # Answers to server pings keep the socket open but do not count as activity.
+                continue
             elif event == "typing":
-                payload = {
-                    "event": "typing",
-                    "data": {
-                        "user_id": user_id,
-                        "is_typing": bool(data.get("data", {}).get("is_typing", True)),
-                    },
-                }
-                await connection_manager.broadcast(chat_id, payload)
+                typing_aggregator.update(chat_id, user_id, bool(data.get("data", {}).get("is_typing", True)))
             elif event == "seen":
-                payload_data = data.get("data", {})
-                message_id = payload_data.get("message_id")
-                if message_id:
-                    await message_repo.mark_as_seen(message_id, user_id)
-                    await connection_manager.broadcast(
-                        chat_id,
-                        {"event": "message:seen", "data": {"user_id": user_id, "message_id": message_id}},
+                message_id = data.get("data", {}).get("message_id")
+                try:
+                    await service.mark_seen(chat_id, user_id, message_id)
+                except HTTPException as exc:
+                    await connection_manager.send_personal_message(websocket, {"event": "error", "message": exc.detail})
+            else:
+                await connection_manager.send_personal_message(websocket, {"event": "error", "message": "Unknown event"})
+    except WebSocketDisconnect:
+        await connection_manager.disconnect(chat_id, websocket)
+    except Exception:
+        await connection_manager.disconnect(chat_id, websocket)
+        await _close(websocket, 1011)
+    finally:
+        await presence_service.disconnected(user_id)
+
+
+async def _send_missed_changes(websocket: WebSocket, service: MessageService, chat_id: str, user_id: str, since: int) -> None:
+    """Replay the chat's change log after ``since`` as ``sync`` frames when a client resumes."""
+
+    while True:
+        changes = await service.changes_since(chat_id, user_id, since)
+        await connection_manager.send_personal_message(
+            websocket, {"event": "sync", "data": changes.model_dump(mode="json", by_alias=True)}
+        )
+        if changes.reset or not changes.has_more:
+            return
+        since = changes.seq
+
+
+@router.websocket("/ws")
+async def user_websocket(websocket: WebSocket, db=Depends(get_db)) -> None:
+    """One socket per client for all of the user's chats.
+
+    Chat events arrive for chats subscribed with ``subscribe`` frames (optionally resuming
+    from ``since_seq``); chat-list events (``chat:message``, ``chat:read``, ``chat:joined``)
+    arrive for every chat the user belongs to.
+    """
+
+    user_id = await _authenticate(websocket)
+    if not user_id:
+        return
+    service = _build_service(db)
+
+    encoding = negotiate_encoding(websocket.query_params.get("encoding"))
+    profile = _negotiate_profile(websocket)
+    await connection_manager.connect_user(user_id, websocket, encoding, profile, replay=True)
+    await presence_service.connected(user_id)
+    try:
+        await _send_connected(websocket, {"user_id": user_id}, encoding, profile)
+        await connection_manager.replay_pending(websocket, user_id)
+        while True:
+            data = await _receive(websocket)
+            if data is None:
+                await connection_manager.disconnect_user(websocket)
+                await _close(websocket, IDLE_CLOSE_CODE)
+                return
+            event = data.get("event")
+            if event != "pong":
+                presence_service.heartbeat(user_id)
+            body = data.get("data") or {}
+            chat_id = body.get("chat_id")
+            if event == "ping":
+                await connection_manager.send_personal_message(websocket, {"event": "pong"})
+            elif event == "pong":
+                # Answers to server pings keep the socket open but do not count as activity.
+                continue
+            elif event == "ack":
+                event_id = body.get("event_id")
+                if isinstance(event_id, int):
+                    await connection_manager.pending.ack(user_id, event_id)
+            elif event == "subscribe" and chat_id:
+                if not await _is_member(service, chat_id, user_id):
+                    await connection_manager.send_personal_message(
+                        websocket, {"event": "error", "chat_id": chat_id, "message": "Not a member of this chat"}
                     )
+                    continue
+                await connection_manager.subscribe(websocket, chat_id)
+                await connection_manager.send_personal_message(websocket, {"event": "subscribed", "data": {"chat_id": chat_id}})
+                since_seq = body.get("since_seq")
+                if isinstance(since_seq, int) and since_seq >= 0:
+                    await _send_missed_changes(websocket, service, chat_id, user_id, since_seq)
+            elif event == "unsubscribe" and chat_id:
+                await connection_manager.unsubscribe(websocket, chat_id)
+                await connection_manager.send_personal_message(websocket, {"event": "unsubscribed", "data": {"chat_id": chat_id}})
+            elif event in {"feed:subscribe", "feed:unsubscribe"}:
+                department = body.get("department") or None
+                if event == "feed:subscribe":
+                    await connection_manager.subscribe_feed(websocket, department)
+                    reply = "feed:subscribed"
                 else:
-                    async for doc in message_repo.collection.find({"chat_id": chat.id}):
-                        await message_repo.mark_as_seen(doc["_id"], user_id)
-                    await connection_manager.broadcast(
-                        chat_id,
-                        {"event": "message:seen_all", "data": {"user_id": user_id}},
+                    await connection_manager.unsubscribe_feed(websocket, department)
+                    reply = "feed:unsubscribed"
+                await connection_manager.send_personal_message(websocket, {"event": reply, "data": {"department": department}})
+            elif event in {"typing", "seen"} and chat_id and not connection_manager.is_subscribed(websocket, chat_id):
+                await connection_manager.send_personal_message(
+                    websocket, {"event": "error", "chat_id": chat_id, "message": "Not subscribed to this chat"}
+                )
+            elif event == "typing" and chat_id:
+                typing_aggregator.update(chat_id, user_id, bool(body.get("is_typing", True)))
+            elif event == "seen" and chat_id:
+                try:
+                    await service.mark_seen(chat_id, user_id, body.get("message_id"))
+                except HTTPException as exc:
+                    await connection_manager.send_personal_message(
+                        websocket, {"event": "error", "chat_id": chat_id, "message": exc.detail}
                     )
             else:
                 await connection_manager.send_personal_message(websocket, {"event": "error", "message": "Unknown event"})
     except WebSocketDisconnect:
-        await connection_manager.disconnect(chat_id, websocket)
+        await connection_manager.disconnect_user(websocket)
     except Exception:
-        await connection_manager.disconnect(chat_id, websocket)
-        await websocket.close(code=1011)
+        await connection_manager.disconnect_user(websocket)
+        await _close(websocket, 1011)
+    finally:
+        await presence_service.disconnected(user_id)
+
+
+def _negotiate_profile(websocket: WebSocket) -> Optional[int]:
+    return negotiate_profile(websocket.query_params.get("profile"), websocket.query_params.get("profile_version"))
+
+
+async def _send_connected(websocket: WebSocket, data: dict[str, Any], encoding: str, profile: Optional[int]) -> None:
+    """Send the handshake, always in the full profile, announcing what the socket negotiated.
+
+    Compact sockets also get the key table so clients can expand abbreviated frames.
+    """
+
+    data = {**data, "encoding": encoding, "profile": "full" if profile is None else "compact"}
+    if profile is not None:
+        data["profile_version"] = profile
+        data["keys"] = COMPACT_KEYS
+    await connection_manager.send_personal_message(websocket, {"event": "connected", "data": data}, raw=True)
+
+
+async def _receive(websocket: WebSocket) -> Optional[dict[str, Any]]:
+    """Next client frame, or ``None`` once the client stayed silent for ``WS_IDLE_TIMEOUT_SECONDS``.
+
+    Clients keep an idle socket alive by answering the server's ``ping`` frames with ``pong``.
+    Text frames are JSON and binary frames MessagePack, whatever encoding the socket negotiated.
+    """
+
+    try:
+        message = await asyncio.wait_for(websocket.receive(), settings.ws_idle_timeout_seconds)
+    except asyncio.TimeoutError:
+        return None
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    if message.get("bytes") is not None:
+        return loads_msgpack(message["bytes"])
+    return loads_json(message["text"])
+
+
+async def _close(websocket: WebSocket, code: int) -> None:
+    # The manager may already have closed a socket it evicted as a slow consumer.
+    if websocket.application_state == WebSocketState.CONNECTED:
+        await websocket.close(code=code)
+
+
+async def _authenticate(websocket: WebSocket) -> Optional[str]:
+    """Resolve the user from the ``token`` query parameter, closing the socket with 4401 on failure."""
+
+    token = websocket.query_params.get("token")
+    user_id = None
+    if token:
+        try:
+            user_id = decode_token(token).get("sub")
+        except TokenError:
+            user_id = None
+    if not user_id:
+        await websocket.close(code=4401)
+    return user_id
+
+
+def _build_service(db: AsyncIOMotorDatabase) -> MessageService:
+    return MessageService(ChatRepository(db), create_message_repository(db), None, changes=ChatChangeRepository(db))
+
+
+async def _is_member(service: MessageService, chat_id: str, user_id: str) -> bool:
+    try:
+        membership = await service.chats.get_membership(chat_id)
+    except ValueError:
+        return False
+    return membership is not None and membership.is_member(user_id)
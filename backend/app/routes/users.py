@@ -47,10 +47,11 @@ async def search_users(
     department: str | None = Query(default=None),
     limit: int = Query(default=20, le=100),
     offset: int = Query(default=0, ge=0),
+    cursor: str | None = Query(default=None),
     service: UserService = Depends(get_user_service),
     current_user: UserInDB = Depends(get_current_active_user),
 ) -> UserListResponse:
-    payload = UserSearchQuery(query=q, department=department, limit=limit, offset=offset)
+    payload = UserSearchQuery(query=q, department=department, limit=limit, offset=offset, cursor=cursor)
     return await service.search(payload)
 
 
@@ -2,10 +2,11 @@ from __future__ import annotations
 
 from datetime import datetime
 from enum import Enum
-from typing import Optional
+from typing import Any, Optional
 
+from bson import ObjectId
 from pydantic import BaseModel
-from pydantic import Field
+from pydantic import ConfigDict, Field, PrivateAttr
 
 from app.core.object_id import MongoModel, PyObjectId
 from app.schemas.post import PostAttachment
@@ -16,6 +17,13 @@ class ChatType(str, Enum):
     GROUP = "group"
 
 
+class MessageType(str, Enum):
+    TEXT = "text"
+    IMAGE = "image"
+    FILE = "file"
+    SYSTEM = "system"
+
+
 class ChatBase(BaseModel):
     name: Optional[str] = Field(default=None, max_length=128)
     type: ChatType = ChatType.DIRECT
@@ -37,31 +45,65 @@ class ChatUpdate(BaseModel):
     remove_member_ids: list[PyObjectId] = Field(default_factory=list)
 
 
+class ChatLastMessage(BaseModel):
+    """Snapshot of the newest message, denormalized onto the chat document."""
+
+    id: PyObjectId
+    sender_id: PyObjectId
+    preview: Optional[str] = None
+    type: MessageType = MessageType.TEXT
+    created_at: datetime
+
+
+class ChatReadMarker(BaseModel):
+    """Per-member read watermark: everything up to and including this message has been read."""
+
+    message_id: PyObjectId
+    created_at: datetime
+
+
 class ChatInDB(MongoModel, ChatBase):
     id: PyObjectId | None = Field(default=None, alias="_id")
     created_by: PyObjectId
+    direct_key: Optional[str] = None
+    last_message: Optional[ChatLastMessage] = None
+    read_markers: dict[str, ChatReadMarker] = Field(default_factory=dict)
+    unread_counts: dict[str, int] = Field(default_factory=dict, exclude=True)
+    seq: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 
+class ChatMembership(BaseModel):
+    """Authorization view of a chat: the fields that only change with membership edits."""
+
+    model_config = ConfigDict(populate_by_name=True)
+
+    id: PyObjectId = Field(alias="_id")
+    type: ChatType = ChatType.DIRECT
+    member_ids: list[PyObjectId] = Field(default_factory=list)
+    admin_ids: list[PyObjectId] = Field(default_factory=list)
+    _member_keys: frozenset[str] = PrivateAttr(default_factory=frozenset)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._member_keys = frozenset(str(member) for member in self.member_ids)
+
+    def is_member(self, user_id: str | ObjectId) -> bool:
+        return str(user_id) in self._member_keys
+
+
 class ChatSummary(ChatInDB):
     last_message_preview: Optional[str] = None
     last_message_at: Optional[datetime] = None
     unread_count: int = 0
 
 
-class MessageType(str, Enum):
-    TEXT = "text"
-    IMAGE = "image"
-    FILE = "file"
-    SYSTEM = "system"
-
-
 class MessageBase(BaseModel):
     content: Optional[str] = Field(default=None, max_length=4000)
     type: MessageType = MessageType.TEXT
     attachments: list[PostAttachment] = Field(default_factory=list)
     reply_to_id: Optional[PyObjectId] = None
+    client_id: Optional[str] = Field(default=None, min_length=1, max_length=64)
 
 
 class MessageCreate(MessageBase):
@@ -76,7 +118,7 @@ class MessageInDB(MongoModel, MessageBase):
     id: PyObjectId | None = Field(default=None, alias="_id")
     chat_id: PyObjectId
     sender_id: PyObjectId
-    seen_by: list[PyObjectId] = Field(default_factory=list)
+    seq: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     edited: bool = False
@@ -86,6 +128,35 @@ class MessagePublic(MessageInDB):
     sender: Optional[dict] = None
 
 
+class MessageReceipts(BaseModel):
+    message_id: PyObjectId
+    seen_by: list[PyObjectId] = Field(default_factory=list)
+
+
+class ChatChangeKind(str, Enum):
+    INSERT = "insert"
+    UPDATE = "update"
+    DELETE = "delete"
+    READ = "read"
+
+
+class MessageDeletion(BaseModel):
+    id: PyObjectId
+    for_everyone: bool = False
+
+
+class ChatChanges(BaseModel):
+    """Compacted delta of a chat since a client's last seen sequence number."""
+
+    chat_id: PyObjectId
+    seq: int
+    reset: bool = False
+    has_more: bool = False
+    messages: list[MessagePublic] = Field(default_factory=list)
+    deleted: list[MessageDeletion] = Field(default_factory=list)
+    read_markers: dict[str, ChatReadMarker] = Field(default_factory=dict)
+
+
 class TypingIndicator(BaseModel):
     chat_id: PyObjectId
     user_id: PyObjectId
@@ -97,3 +168,15 @@ class MessageSearchQuery(BaseModel):
     query: Optional[str] = None
     limit: int = 50
     before: Optional[datetime] = None
+    cursor: Optional[str] = None
+
+
+class MessageSearchHit(BaseModel):
+    message: MessagePublic
+    score: int = 0
+    highlights: list[tuple[int, int]] = Field(default_factory=list)
+
+
+class MessageSearchResponse(BaseModel):
+    items: list[MessageSearchHit]
+    next_cursor: Optional[str] = None
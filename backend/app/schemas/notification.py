@@ -29,6 +29,7 @@ class NotificationInDB(MongoModel, NotificationBase):
     recipient_id: PyObjectId
     read: bool = False
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: Optional[datetime] = None
     read_at: Optional[datetime] = None
 
 
@@ -38,4 +39,5 @@ class NotificationPublic(NotificationInDB):
 
 class NotificationListResponse(BaseModel):
     items: list[NotificationPublic]
-    total: int
+    total: Optional[int] = None
+    next_cursor: Optional[str] = None
@@ -47,6 +47,9 @@ class PostInDB(MongoModel, PostBase):
     author_id: PyObjectId
     attachments: list[PostAttachment] = Field(default_factory=list)
     like_user_ids: list[PyObjectId] = Field(default_factory=list)
+    # Maintained alongside like_user_ids and the post's comments; see reconcile-post-counters.
+    like_count: int = 0
+    comment_count: int = 0
     share_parent_id: Optional[PyObjectId] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
@@ -75,8 +78,9 @@ class CommentInDB(MongoModel, CommentBase):
 
 
 class PostPublic(PostInDB):
-    comment_count: int = 0
-    like_count: int = 0
+    author: Optional[dict] = None
+    # Whether the requesting user liked the post; set on feed pages, which leave out like_user_ids.
+    liked: Optional[bool] = None
 
 
 class CommentPublic(CommentInDB):
@@ -85,5 +89,5 @@ class CommentPublic(CommentInDB):
 
 class FeedResponse(BaseModel):
     items: list[PostPublic]
-    total: int
+    total: Optional[int] = None
     next_cursor: Optional[str] = None
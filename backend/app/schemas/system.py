@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class HealthResponse(BaseModel):
@@ -14,3 +14,4 @@ class MetricsResponse(BaseModel):
     messages_today: int
     storage_used_mb: float
     uptime_seconds: float
+    caches: dict[str, dict[str, int]] = Field(default_factory=dict)
@@ -77,7 +77,8 @@ class UserPublic(MongoModel, UserBase):
 
 class UserListResponse(BaseModel):
     items: list[UserPublic]
-    total: int
+    total: Optional[int] = None
+    next_cursor: Optional[str] = None
 
 
 class UserSearchQuery(BaseModel):
@@ -85,3 +86,4 @@ class UserSearchQuery(BaseModel):
     department: Optional[str] = None
     limit: int = 20
     offset: int = 0
+    cursor: Optional[str] = None
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Optional
+
+from redis.asyncio import Redis
+
+from app.config import settings
+from app.core.serialization import dumps_json, loads_json
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[str, dict[str, Any]], Awaitable[None]]
+
+
+class Broker(ABC):
+    """Pub/sub transport between workers for realtime events.
+
+    Every published event comes back through the bound handler on each worker subscribed
+    to the channel, including the publisher, so local fan-out has a single code path.
+    ``shared`` brokers connect several workers, so per-user state kept for replays must
+    live outside the process.
+    """
+
+    shared = False
+
+    def __init__(self) -> None:
+        self._handler: Optional[Handler] = None
+
+    def bind(self, handler: Handler) -> None:
+        self._handler = handler
+
+    async def start(self) -> None:
+        return None
+
+    async def close(self) -> None:
+        return None
+
+    async def subscribe(self, channel: str) -> None:
+        return None
+
+    async def unsubscribe(self, channel: str) -> None:
+        return None
+
+    @abstractmethod
+    async def publish(self, channel: str, message: dict[str, Any]) -> None: ...
+
+    async def publish_many(self, messages: list[tuple[str, dict[str, Any]]]) -> None:
+        for channel, message in messages:
+            await self.publish(channel, message)
+
+
+class InProcessBroker(Broker):
+    """Single-worker broker: publishing delivers straight to this process."""
+
+    async def publish(self, channel: str, message: dict[str, Any]) -> None:
+        if self._handler is not None:
+            await self._handler(channel, message)
+
+
+class RedisBroker(Broker):
+    """Redis pub/sub broker; each worker subscribes only to channels it has sockets for."""
+
+    shared = True
+
+    def __init__(self, client: Any, poll_timeout: float = 1.0) -> None:
+        super().__init__()
+        self.client = client
+        self.poll_timeout = poll_timeout
+        self._pubsub: Any = None
+        self._listener: Optional[asyncio.Task[None]] = None
+        # Set by the first subscribe; the pubsub has no connection to read from before it.
+        self._subscribed = asyncio.Event()
+
+    async def start(self) -> None:
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        self._subscribed.clear()
+        await self.client.aclose()
+
+    async def subscribe(self, channel: str) -> None:
+        if self._pubsub is not None:
+            await self._pubsub.subscribe(channel)
+            self._subscribed.set()
+
+    async def unsubscribe(self, channel: str) -> None:
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(channel)
+
+    async def publish(self, channel: str, message: dict[str, Any]) -> None:
+        await self.client.publish(channel, dumps_json(message))
+
+    async def publish_many(self, messages: list[tuple[str, dict[str, Any]]]) -> None:
+        # One round-trip for a whole fan-out.
+        async with self.client.pipeline(transaction=False) as pipeline:
+            for channel, message in messages:
+                pipeline.publish(channel, dumps_json(message))
+            await pipeline.execute()
+
+    async def _listen(self) -> None:
+        await self._subscribed.wait()
+        while True:
+            try:
+                message = await self._pubsub.get_message(timeout=self.poll_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Realtime broker lost its Redis subscription; retrying")
+                await asyncio.sleep(self.poll_timeout)
+                continue
+            if message is None or message.get("type") != "message" or self._handler is None:
+                continue
+            channel = message["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            try:
+                await self._handler(channel, loads_json(message["data"]))
+            except Exception:
+                logger.exception("Failed to deliver realtime event on %s", channel)
+
+
+def create_broker() -> Broker:
+    """Broker for the configured ``REALTIME_BROKER`` backend."""
+
+    if settings.realtime_broker == "redis":
+        if not settings.redis_url:
+            raise RuntimeError("REALTIME_BROKER=redis requires REDIS_URL")
+        return RedisBroker(Redis.from_url(settings.redis_url))
+    return InProcessBroker()
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import itertools
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+from app.config import settings
+from app.core.cache import LRUCache
+from app.schemas.message import MessagePublic
+
+_MESSAGE_OVERHEAD_BYTES = 512
+_ATTACHMENT_OVERHEAD_BYTES = 256
+
+
+def _estimate_size(message: MessagePublic) -> int:
+    return _MESSAGE_OVERHEAD_BYTES + len(message.content or "") + _ATTACHMENT_OVERHEAD_BYTES * len(message.attachments)
+
+
+class _ChatBuffer:
+    __slots__ = ("messages", "complete", "loaded_at", "size")
+
+    def __init__(self, messages: deque[MessagePublic], complete: bool) -> None:
+        self.messages = messages
+        self.complete = complete
+        self.loaded_at = time.monotonic()
+        self.size = sum(_estimate_size(message) for message in messages)
+
+
+class RecentMessageCache:
+    """Ring buffer of the newest messages per chat, used to serve the first history page.
+
+    Buffers are kept oldest-to-newest and updated by the write paths of this process,
+    so the message service bypasses them while the realtime broker is shared between
+    workers. Chats are evicted least-recently-read first once the estimated memory budget
+    is exceeded, and a buffer is reloaded after ``ttl_seconds`` as a safety net.
+    """
+
+    def __init__(self, per_chat: int, memory_budget_bytes: int, ttl_seconds: Optional[float] = None) -> None:
+        self.per_chat = per_chat
+        self.memory_budget_bytes = memory_budget_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._buffers: OrderedDict[str, _ChatBuffer] = OrderedDict()
+        self._bytes = 0
+        self._loading: dict[str, int] = {}
+        self._tokens = itertools.count(1)
+
+    def get_page(self, chat_id: str, limit: int) -> Optional[list[MessagePublic]]:
+        """Return the newest ``limit`` messages newest-first, or None on a miss."""
+
+        buffer = self._buffers.get(chat_id)
+        if buffer is not None and self.ttl_seconds is not None and time.monotonic() - buffer.loaded_at > self.ttl_seconds:
+            self._drop(chat_id)
+            buffer = None
+        if buffer is None or (len(buffer.messages) < limit and not buffer.complete):
+            self.misses += 1
+            return None
+        self._buffers.move_to_end(chat_id)
+        self.hits += 1
+        return list(itertools.islice(reversed(buffer.messages), limit))
+
+    def begin_load(self, chat_id: str) -> int:
+        """Register a pending load; a write to the chat before ``fill`` discards it."""
+
+        token = next(self._tokens)
+        self._loading[chat_id] = token
+        return token
+
+    def fill(self, chat_id: str, newest_first: list[MessagePublic], token: int) -> None:
+        if self._loading.get(chat_id) != token:
+            return
+        del self._loading[chat_id]
+        if self.per_chat <= 0:
+            return
+        self._drop(chat_id)
+        messages = deque(reversed(newest_first[: self.per_chat]), maxlen=self.per_chat)
+        buffer = _ChatBuffer(messages, complete=len(newest_first) < self.per_chat)
+        self._buffers[chat_id] = buffer
+        self._bytes += buffer.size
+        self._enforce_budget()
+
+    def append(self, chat_id: str, message: MessagePublic) -> None:
+        self._loading.pop(chat_id, None)
+        buffer = self._buffers.get(chat_id)
+        if buffer is None:
+            return
+        if len(buffer.messages) == buffer.messages.maxlen:
+            dropped = buffer.messages[0]
+            buffer.size -= _estimate_size(dropped)
+            self._bytes -= _estimate_size(dropped)
+            buffer.complete = False
+        buffer.messages.append(message)
+        buffer.size += _estimate_size(message)
+        self._bytes += _estimate_size(message)
+        self._enforce_budget()
+
+    def replace(self, chat_id: str, message: MessagePublic) -> None:
+        self._loading.pop(chat_id, None)
+        buffer = self._buffers.get(chat_id)
+        if buffer is None:
+            return
+        for index, cached in enumerate(buffer.messages):
+            if cached.id == message.id:
+                delta = _estimate_size(message) - _estimate_size(cached)
+                buffer.messages[index] = message
+                buffer.size += delta
+                self._bytes += delta
+                break
+
+    def remove(self, chat_id: str, message_id: object) -> None:
+        self._loading.pop(chat_id, None)
+        buffer = self._buffers.get(chat_id)
+        if buffer is None:
+            return
+        for cached in buffer.messages:
+            if cached.id == message_id:
+                buffer.messages.remove(cached)
+                buffer.size -= _estimate_size(cached)
+                self._bytes -= _estimate_size(cached)
+                break
+
+    def invalidate(self, chat_id: str) -> None:
+        self._loading.pop(chat_id, None)
+        self._drop(chat_id)
+
+    def clear(self) -> None:
+        self._buffers.clear()
+        self._loading.clear()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "chats": len(self._buffers),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _drop(self, chat_id: str) -> None:
+        buffer = self._buffers.pop(chat_id, None)
+        if buffer is not None:
+            self._bytes -= buffer.size
+
+    def _enforce_budget(self) -> None:
+        while self._bytes > self.memory_budget_bytes and self._buffers:
+            _, buffer = self._buffers.popitem(last=False)
+            self._bytes -= buffer.size
+            self.evictions += 1
+
+
+recent_messages = RecentMessageCache(
+    settings.message_cache_per_chat,
+    settings.message_cache_memory_bytes,
+    ttl_seconds=settings.message_cache_ttl_seconds,
+)
+
+# Replies to recent sends keyed by (chat_id, sender_id, client_id), so client retries are answered from memory.
+sent_messages: LRUCache[tuple[str, str, str], MessagePublic] = LRUCache(
+    settings.message_dedupe_cache_size,
+    ttl_seconds=settings.message_dedupe_ttl_seconds,
+)
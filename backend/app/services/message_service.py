@@ -5,13 +5,38 @@ from typing import List, Optional
 
 from bson import ObjectId
 from fastapi import HTTPException, status
+from pymongo.errors import DuplicateKeyError
 
+from app.config import settings
 from app.core.utils import to_object_id
-from app.repositories.message_repository import ChatRepository, MessageRepository
+from app.repositories.base import InvalidCursorError
+from app.repositories.message_repository import ChatChangeRepository, ChatRepository, MessageRepository
+from app.repositories.message_search_repository import MAX_QUERY_TERMS, MessageSearchRepository, tokenize
 from app.repositories.notification_repository import NotificationRepository
-from app.schemas.message import ChatCreate, ChatInDB, ChatSummary, ChatType, MessageCreate, MessageInDB, MessagePublic, MessageUpdate
-from app.schemas.notification import NotificationInDB, NotificationType
+from app.schemas.message import (
+    ChatChangeKind,
+    ChatChanges,
+    ChatCreate,
+    ChatInDB,
+    ChatMembership,
+    ChatReadMarker,
+    ChatSummary,
+    ChatType,
+    MessageCreate,
+    MessageDeletion,
+    MessageInDB,
+    MessagePublic,
+    MessageReceipts,
+    MessageSearchHit,
+    MessageSearchQuery,
+    MessageSearchResponse,
+    MessageType,
+    MessageUpdate,
+)
+from app.services.message_cache import recent_messages, sent_messages
+from app.services.notification_service import NotificationService
 from app.services.realtime import connection_manager
+from app.services.typing import typing_aggregator
 
 
 class MessageService:
@@ -20,15 +45,16 @@ class MessageService:
         chats: ChatRepository,
         messages: MessageRepository,
         notifications: NotificationRepository | None,
+        search: MessageSearchRepository | None = None,
+        changes: ChatChangeRepository | None = None,
     ) -> None:
         self.chats = chats
         self.messages = messages
         self.notifications = notifications
+        self.search = search
+        self.changes = changes
 
     async def get_or_create_direct_chat(self, requester_id: str, other_user_id: str) -> ChatInDB:
-        chat = await self.chats.find_direct_chat(requester_id, other_user_id)
-        if chat:
-            return chat
         payload = ChatCreate(member_ids=[to_object_id(requester_id), to_object_id(other_user_id)])
         chat = ChatInDB(
             created_by=to_object_id(requester_id),
@@ -36,7 +62,7 @@ class MessageService:
             member_ids=payload.member_ids,
             admin_ids=[to_object_id(requester_id)],
         )
-        return await self.chats.create_chat(chat)
+        return await self.chats.get_or_create_direct_chat(chat)
 
     async def create_group_chat(self, requester_id: str, payload: ChatCreate) -> ChatInDB:
         members = set(payload.member_ids + [to_object_id(requester_id)])
@@ -48,30 +74,32 @@ class MessageService:
             member_ids=list(members),
             admin_ids=[to_object_id(requester_id)],
         )
-        return await self.chats.create_chat(chat)
+        created = await self.chats.create_chat(chat)
+        await connection_manager.send_to_users(
+            [str(member) for member in created.member_ids],
+            {"event": "chat:joined", "data": created.model_dump(mode="json", by_alias=True)},
+        )
+        return created
 
     async def list_user_chats(self, user_id: str, limit: int = 50) -> List[ChatSummary]:
-        chats = await self.chats.list_user_chats(user_id, limit=limit)
-        summaries: List[ChatSummary] = []
-        for chat in chats:
-            last_message = await self.messages.collection.find({"chat_id": chat.id}).sort("created_at", -1).limit(1).to_list(length=1)
-            last_message_at = last_message[0]["created_at"] if last_message else None
-            preview = last_message[0].get("content") if last_message else None
-            unread = await self.messages.count_unread(chat.id, user_id)
-            summaries.append(
-                ChatSummary(
-                    **chat.model_dump(),
-                    last_message_at=last_message_at,
-                    last_message_preview=preview,
-                    unread_count=unread,
-                )
-            )
-        return summaries
+        return await self.chats.list_user_chats(user_id, limit=limit)
 
     async def send_message(self, sender_id: str, payload: MessageCreate) -> MessagePublic:
-        chat = await self.chats.get_chat(payload.chat_id)
-        if not chat or to_object_id(sender_id) not in chat.member_ids:
-            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a member of this chat")
+        """Store and fan out a message.
+
+        A retried send carrying the same ``client_id`` returns the original message
+        without repeating notifications or broadcasts.
+        """
+
+        chat = await self._authorize(payload.chat_id, sender_id)
+        dedupe_key = (str(chat.id), sender_id, payload.client_id) if payload.client_id else None
+        if dedupe_key:
+            sent = sent_messages.get(dedupe_key)
+            if sent is not None:
+                return sent
+            existing = await self.messages.find_by_client_id(chat.id, sender_id, payload.client_id)
+            if existing:
+                return self._remember_sent(dedupe_key, existing)
         message = MessageInDB(
             chat_id=chat.id,
             sender_id=to_object_id(sender_id),
@@ -79,26 +107,47 @@ class MessageService:
             type=payload.type,
             attachments=payload.attachments,
             reply_to_id=payload.reply_to_id,
+            client_id=payload.client_id,
         )
-        created = await self.messages.create_message(message)
-        await self.chats.update_chat(chat.id, {"updated_at": datetime.utcnow()})
+        # The chat snapshot references the message, so its id is assigned up front.
+        message.id = ObjectId()
+        message.seq, unread_counts = await self.chats.record_message(chat, message)
+        try:
+            created = await self.messages.create_message(message)
+        except DuplicateKeyError:
+            # A concurrent retry inserted first; undo this attempt's chat bookkeeping.
+            return await self._resolve_duplicate_send(chat.id, message, dedupe_key)
+        await self._record_change(chat.id, created.seq, ChatChangeKind.INSERT, message_id=created.id)
+        if self.search is not None:
+            await self.search.index_message(created)
         await self._notify_chat_members(chat, created, sender_id)
         payload = MessagePublic(**created.model_dump())
+        if dedupe_key:
+            sent_messages.set(dedupe_key, payload)
+        recent_messages.append(str(chat.id), payload)
+        typing_aggregator.update(str(chat.id), str(sender_id), False)
         await connection_manager.broadcast(
             str(chat.id),
-            {"event": "message:new", "data": payload.model_dump(by_alias=True)},
+            {"event": "message:new", "seq": created.seq, "data": payload.model_dump(mode="json", by_alias=True)},
         )
+        await self._push_chat_message(chat, payload, unread_counts)
         return payload
 
     async def edit_message(self, message_id: str, user_id: str, payload: MessageUpdate) -> MessagePublic:
         message = await self.messages.get_message(message_id)
         if not message or str(message.sender_id) != user_id:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Message not found")
-        updated = await self.messages.update_message(message_id, payload.model_dump(exclude_none=True))
+        seq = await self.chats.next_seq(message.chat_id)
+        updated = await self.messages.update_message(message_id, payload.model_dump(exclude_none=True), seq=seq)
+        await self._record_change(updated.chat_id, seq, ChatChangeKind.UPDATE, message_id=updated.id)
+        await self.chats.update_last_message(updated.chat_id, updated)
+        if self.search is not None:
+            await self.search.reindex_message(updated)
         response = MessagePublic(**updated.model_dump())
+        recent_messages.replace(str(updated.chat_id), response)
         await connection_manager.broadcast(
             str(message.chat_id),
-            {"event": "message:updated", "data": response.model_dump(by_alias=True)},
+            {"event": "message:updated", "seq": seq, "data": response.model_dump(mode="json", by_alias=True)},
         )
         return response
 
@@ -108,35 +157,319 @@ class MessageService:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Message not found")
         if for_everyone and str(message.sender_id) != user_id:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Cannot delete message for everyone")
-        await self.messages.delete_message(message_id, for_everyone)
+        seq = await self.chats.next_seq(message.chat_id)
+        await self.messages.delete_message(message_id, for_everyone, seq=seq)
+        await self._record_change(
+            message.chat_id, seq, ChatChangeKind.DELETE, message_id=message.id, for_everyone=for_everyone
+        )
+        if self.search is not None:
+            await self.search.remove_message(message.id)
+        if for_everyone:
+            recent_messages.remove(str(message.chat_id), message.id)
+            replacement = await self.messages.latest_message(message.chat_id)
+            await self.chats.replace_last_message(message.chat_id, message.id, replacement)
+            chat = await self.chats.get_chat(message.chat_id)
+            if chat:
+                await self.chats.discount_unread(chat, message)
+        else:
+            message.content = None
+            message.attachments = []
+            message.type = MessageType.SYSTEM
+            recent_messages.replace(str(message.chat_id), MessagePublic(**message.model_dump()))
+            await self.chats.update_last_message(message.chat_id, message)
         await connection_manager.broadcast(
             str(message.chat_id),
-            {"event": "message:deleted", "data": {"id": str(message.id), "for_everyone": for_everyone}},
+            {"event": "message:deleted", "seq": seq, "data": {"id": str(message.id), "for_everyone": for_everyone}},
         )
 
     async def mark_seen(self, chat_id: str, user_id: str, message_id: Optional[str] = None) -> None:
+        chat = await self._get_member_chat(chat_id, user_id)
         if message_id:
-            await self.messages.mark_as_seen(message_id, user_id)
+            message = await self._get_chat_message(chat, message_id)
+            marker = ChatReadMarker(message_id=message.id, created_at=message.created_at)
+            unread = await self.messages.count_unread(chat.id, user_id, after=message.created_at)
+        elif (latest := chat.last_message or await self.messages.latest_message(chat.id)) is not None:
+            marker = ChatReadMarker(message_id=latest.id, created_at=latest.created_at)
+            unread = 0
         else:
-            # mark all messages
-            async for doc in self.messages.collection.find({"chat_id": to_object_id(chat_id)}):
-                await self.messages.mark_as_seen(doc["_id"], user_id)
+            return
+        seq = await self.chats.set_read_marker(chat.id, user_id, marker, unread)
+        if seq is None:
+            return
+        await self._record_change(chat.id, seq, ChatChangeKind.READ, user_id=user_id, marker=marker.model_dump())
+        await connection_manager.broadcast(
+            str(chat.id),
+            {"event": "message:seen", "seq": seq, "data": {"user_id": user_id, "message_id": str(marker.message_id)}},
+        )
+        await connection_manager.send_to_users(
+            [user_id],
+            {
+                "event": "chat:read",
+                "data": {"chat_id": str(chat.id), "seq": seq, "message_id": str(marker.message_id), "unread_count": unread},
+            },
+        )
 
-    async def list_messages(self, chat_id: str, user_id: str, limit: int = 50, before: Optional[datetime] = None) -> List[MessagePublic]:
+    async def get_receipts(self, chat_id: str, user_id: str, message_id: str) -> MessageReceipts:
+        chat = await self._get_member_chat(chat_id, user_id)
+        message = await self._get_chat_message(chat, message_id)
+        seen_by = [
+            member
+            for member in chat.member_ids
+            if member != message.sender_id
+            and (marker := chat.read_markers.get(str(member))) is not None
+            and marker.created_at >= message.created_at
+        ]
+        return MessageReceipts(message_id=message.id, seen_by=seen_by)
+
+    async def changes_since(self, chat_id: str, user_id: str, since: int, limit: int = 200) -> ChatChanges:
+        """Return what changed in a chat after sequence number ``since``, compacted per message.
+
+        ``reset`` is set when the log no longer covers the gap (entries expired or the
+        client is ahead of the server); the client should then reload the chat from
+        history. Pages end at ``seq``; continue from it while ``has_more`` is set.
+
+        A seq is allocated before its log entry is written, so pages stop at the first
+        missing seq. A fresh gap is a change still being written and is reported as
+        nothing new yet; one older than ``CHAT_CHANGES_GAP_GRACE_SECONDS`` was lost
+        and resets the client.
+        """
+
+        chat = await self._authorize(chat_id, user_id)
+        head = await self.chats.get_seq(chat.id)
+        if since >= head:
+            return ChatChanges(chat_id=chat.id, seq=head, reset=since > head)
+        if self.changes is None:
+            return ChatChanges(chat_id=chat.id, seq=head, reset=True)
+        entries = await self.changes.list_since(chat.id, since, limit + 1)
+        contiguous = 0
+        while contiguous < len(entries) and entries[contiguous]["seq"] == since + contiguous + 1:
+            contiguous += 1
+        if not contiguous:
+            if await self._change_gap_is_lost(chat.id, since, entries[0] if entries else None):
+                return ChatChanges(chat_id=chat.id, seq=head, reset=True)
+            return ChatChanges(chat_id=chat.id, seq=since)
+        has_more = len(entries) > min(contiguous, limit)
+        entries = entries[: min(contiguous, limit)]
+
+        touched: dict[ObjectId, None] = {}
+        deleted: dict[ObjectId, bool] = {}
+        read_markers: dict[str, ChatReadMarker] = {}
+        for entry in entries:
+            kind = ChatChangeKind(entry["kind"])
+            if kind == ChatChangeKind.READ:
+                read_markers[entry["user_id"]] = ChatReadMarker(**entry["marker"])
+                continue
+            message_id = entry["message_id"]
+            if kind == ChatChangeKind.DELETE:
+                deleted[message_id] = entry.get("for_everyone", False)
+                if deleted[message_id]:
+                    touched.pop(message_id, None)
+                    continue
+            touched[message_id] = None
+
+        messages = await self.messages.get_messages(list(touched))
+        messages.sort(key=lambda message: (message.created_at, message.id))
+        return ChatChanges(
+            chat_id=chat.id,
+            seq=entries[-1]["seq"],
+            has_more=has_more,
+            messages=[MessagePublic(**message.model_dump()) for message in messages],
+            deleted=[MessageDeletion(id=message_id, for_everyone=everyone) for message_id, everyone in deleted.items()],
+            read_markers=read_markers,
+        )
+
+    async def _change_gap_is_lost(self, chat_id: ObjectId, since: int, following: Optional[dict]) -> bool:
+        # Entries expire oldest first: if nothing up to ``since`` is left, the gap expired too.
+        if since > 0 and not await self.changes.has_entries_through(chat_id, since):
+            return True
+        if following is None:
+            # Nothing logged after ``since`` yet; the missing entries are still being written.
+            return False
+        age = datetime.utcnow() - following["created_at"]
+        return age.total_seconds() > settings.chat_changes_gap_grace_seconds
+
+    async def search_messages(self, user_id: str, query: MessageSearchQuery) -> MessageSearchResponse:
+        chat = await self._authorize(query.chat_id, user_id)
+        terms = list(tokenize(query.query))[:MAX_QUERY_TERMS]
+        if self.search is None or not terms:
+            return MessageSearchResponse(items=[])
+        try:
+            hits, next_cursor = await self.search.search(
+                chat.id,
+                terms,
+                limit=query.limit,
+                before=query.before,
+                cursor=query.cursor,
+            )
+        except InvalidCursorError as exc:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from exc
+        messages = await self.messages.get_messages([hit["message_id"] for hit in hits])
+        by_id = {message.id: message for message in messages}
+        items = [
+            MessageSearchHit(
+                message=MessagePublic(**by_id[hit["message_id"]].model_dump()),
+                score=hit["score"],
+                highlights=hit["highlights"],
+            )
+            for hit in hits
+            if hit["message_id"] in by_id
+        ]
+        return MessageSearchResponse(items=items, next_cursor=next_cursor)
+
+    async def list_messages(
+        self,
+        chat_id: str,
+        user_id: str,
+        limit: int = 50,
+        before: Optional[datetime] = None,
+        *,
+        after: Optional[datetime] = None,
+        before_id: Optional[str] = None,
+        after_id: Optional[str] = None,
+        around: Optional[str] = None,
+        around_unread: bool = False,
+    ) -> List[MessagePublic]:
+        """List chat history newest-first.
+
+        ``before``/``before_id`` page backwards, ``after``/``after_id`` page forwards and
+        ``around``/``around_unread`` return a window centred on a message or the caller's
+        read watermark. Id anchors take precedence over timestamps.
+        """
+
+        chat = await self._authorize(chat_id, user_id)
+        if around or around_unread:
+            anchor: Optional[ChatReadMarker]
+            if around:
+                message = await self._get_anchor_message(chat, around)
+                anchor = ChatReadMarker(message_id=message.id, created_at=message.created_at)
+            else:
+                anchor = await self.chats.get_read_marker(chat.id, user_id)
+            if anchor is None:
+                messages = await self.messages.list_messages_after(chat.id, limit=limit)
+                return [MessagePublic(**m.model_dump()) for m in reversed(messages)]
+            newer_limit = limit // 2
+            older = await self.messages.list_messages(
+                chat.id,
+                limit=limit - newer_limit,
+                before=anchor.created_at,
+                before_id=anchor.message_id,
+                inclusive=True,
+            )
+            newer = await self.messages.list_messages_after(
+                chat.id,
+                limit=newer_limit,
+                after=anchor.created_at,
+                after_id=anchor.message_id,
+            )
+            messages = list(reversed(newer)) + older
+        elif after or after_id:
+            anchor_id = None
+            if after_id:
+                message = await self._get_anchor_message(chat, after_id)
+                after, anchor_id = message.created_at, message.id
+            newer = await self.messages.list_messages_after(chat.id, limit=limit, after=after, after_id=anchor_id)
+            messages = list(reversed(newer))
+        elif before or before_id:
+            anchor_id = None
+            if before_id:
+                message = await self._get_anchor_message(chat, before_id)
+                before, anchor_id = message.created_at, message.id
+            messages = await self.messages.list_messages(chat.id, limit=limit, before=before, before_id=anchor_id)
+        else:
+            return await self._latest_page(str(chat.id), limit)
+        return [MessagePublic(**m.model_dump()) for m in messages]
+
+    async def _get_member_chat(self, chat_id: str | ObjectId, user_id: str) -> ChatInDB:
         chat = await self.chats.get_chat(chat_id)
         if not chat or to_object_id(user_id) not in chat.member_ids:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a member of this chat")
-        messages = await self.messages.list_messages(chat_id, limit=limit, before=before)
-        return [MessagePublic(**m.model_dump()) for m in messages]
+        return chat
+
+    async def _latest_page(self, chat_id: str, limit: int) -> List[MessagePublic]:
+        if connection_manager.broker.shared:
+            # Other workers write to the chat without updating this process's buffer.
+            messages = await self.messages.list_messages(chat_id, limit=limit)
+            return [MessagePublic(**m.model_dump()) for m in messages]
+        cached = recent_messages.get_page(chat_id, limit)
+        if cached is not None:
+            return cached
+        token = recent_messages.begin_load(chat_id)
+        messages = await self.messages.list_messages(chat_id, limit=max(limit, recent_messages.per_chat))
+        page = [MessagePublic(**m.model_dump()) for m in messages]
+        recent_messages.fill(chat_id, page, token)
+        return page[:limit]
+
+    async def _authorize(self, chat_id: str | ObjectId, user_id: str) -> ChatMembership:
+        membership = await self.chats.get_membership(chat_id)
+        if not membership or not membership.is_member(user_id):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not a member of this chat")
+        return membership
 
-    async def _notify_chat_members(self, chat: ChatInDB, message: MessageInDB, sender_id: str) -> None:
+    async def _get_chat_message(self, chat: ChatInDB | ChatMembership, message_id: str) -> MessageInDB:
+        try:
+            message = await self.messages.get_message(message_id)
+        except ValueError:
+            message = None
+        if not message or message.chat_id != chat.id:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Message not found")
+        return message
+
+    async def _get_anchor_message(self, chat: ChatMembership, message_id: str) -> MessageInDB:
+        # History anchors may point past the hot window, e.g. the oldest message of the last page.
+        try:
+            message = await self.messages.get_history_message(chat.id, message_id)
+        except ValueError:
+            message = None
+        if not message:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Message not found")
+        return message
+
+    def _remember_sent(self, key: tuple[str, str, str], message: MessageInDB) -> MessagePublic:
+        payload = MessagePublic(**message.model_dump())
+        sent_messages.set(key, payload)
+        return payload
+
+    async def _resolve_duplicate_send(
+        self,
+        chat_id: ObjectId,
+        attempt: MessageInDB,
+        dedupe_key: Optional[tuple[str, str, str]],
+    ) -> MessagePublic:
+        existing = await self.messages.find_by_client_id(chat_id, attempt.sender_id, attempt.client_id)
+        if not existing or not dedupe_key:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Duplicate message")
+        replacement = await self.messages.latest_message(chat_id)
+        await self.chats.replace_last_message(chat_id, attempt.id, replacement)
+        chat = await self.chats.get_chat(chat_id)
+        if chat:
+            await self.chats.discount_unread(chat, attempt)
+        # Keep the change log gapless so syncing clients are not forced to reset.
+        await self._record_change(chat_id, attempt.seq, ChatChangeKind.UPDATE, message_id=existing.id)
+        return self._remember_sent(dedupe_key, existing)
+
+    async def _record_change(self, chat_id: ObjectId, seq: int, kind: ChatChangeKind, **fields) -> None:
+        if self.changes is not None and seq:
+            await self.changes.record(chat_id, seq, kind, **fields)
+
+    async def _push_chat_message(
+        self,
+        chat: ChatMembership,
+        message: MessagePublic,
+        unread_counts: dict[str, int],
+    ) -> None:
+        # Chat-list update for every member's user sockets, whether or not the chat is open.
+        members = [str(member) for member in chat.member_ids]
+        await connection_manager.send_to_users(
+            members,
+            {
+                "event": "chat:message",
+                "data": {"chat_id": str(chat.id), "seq": message.seq, "message": message.model_dump(mode="json", by_alias=True)},
+            },
+            data_by_user={member: {"unread_count": unread_counts.get(member, 0)} for member in members},
+        )
+
+    async def _notify_chat_members(self, chat: ChatMembership, message: MessageInDB, sender_id: str) -> None:
         recipients = [member for member in chat.member_ids if str(member) != sender_id]
         if not recipients or self.notifications is None:
             return
-        for recipient in recipients:
-            notification = NotificationInDB(
-                recipient_id=recipient,
-                type=NotificationType.MESSAGE,
-                data={"chat_id": str(chat.id), "message_id": str(message.id)},
-            )
-            await self.notifications.create_notification(notification)
+        await NotificationService(self.notifications).notify_chat_message(chat.id, message.id, message.sender_id, recipients)
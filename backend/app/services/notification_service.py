@@ -1,28 +1,90 @@
 from __future__ import annotations
 
+from typing import Iterable, Optional
+
+from bson import ObjectId
 from fastapi import HTTPException, status
 
-from app.core.utils import to_object_id
+from app.repositories.base import InvalidCursorError
 from app.repositories.notification_repository import NotificationRepository
-from app.schemas.notification import NotificationListResponse, NotificationPublic
+from app.schemas.notification import NotificationInDB, NotificationListResponse, NotificationPublic
+from app.services.realtime import connection_manager
 
 
 class NotificationService:
+    """Notification reads and writes, pushed to the recipient's user sockets.
+
+    New notifications go out as ``notification:new`` and every change to a user's unread
+    count as ``unread:changed``, so clients do not need to poll. Messages folded into an
+    existing rolling chat notification push nothing here; the recipient's ``chat:message``
+    already carries the message and the chat's unread count.
+    """
+
     def __init__(self, notifications: NotificationRepository) -> None:
         self.notifications = notifications
 
-    async def list_notifications(self, user_id: str, limit: int = 50, offset: int = 0) -> NotificationListResponse:
-        items, total = await self.notifications.list_for_user(user_id, limit=limit, skip=offset)
-        return NotificationListResponse(items=[NotificationPublic(**i.model_dump()) for i in items], total=total)
+    async def create_notification(self, notification: NotificationInDB) -> NotificationPublic:
+        created = await self.notifications.create_notification(notification)
+        await self._push_notifications([created], [created.recipient_id] if not created.read else [])
+        return NotificationPublic(**created.model_dump())
+
+    async def notify_chat_message(
+        self,
+        chat_id: ObjectId,
+        message_id: ObjectId,
+        sender_id: ObjectId,
+        recipient_ids: list[ObjectId],
+    ) -> None:
+        created = await self.notifications.upsert_message_notifications(chat_id, message_id, sender_id, recipient_ids)
+        await self._push_notifications(created, [notification.recipient_id for notification in created])
+
+    async def list_notifications(
+        self,
+        user_id: str,
+        limit: int = 50,
+        offset: int = 0,
+        cursor: Optional[str] = None,
+    ) -> NotificationListResponse:
+        try:
+            items, next_cursor = await self.notifications.list_for_user(user_id, limit=limit, skip=offset, cursor=cursor)
+        except InvalidCursorError as exc:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from exc
+        total = None if cursor else await self.notifications.count_for_user(user_id)
+        return NotificationListResponse(
+            items=[NotificationPublic(**i.model_dump()) for i in items],
+            total=total,
+            next_cursor=next_cursor,
+        )
 
     async def mark_read(self, notification_id: str, user_id: str) -> None:
-        notification = await self.notifications.collection.find_one({"_id": to_object_id(notification_id)})
-        if not notification or str(notification["recipient_id"]) != user_id:
+        try:
+            notification = await self.notifications.get_notification(notification_id)
+        except ValueError:
+            notification = None
+        if not notification or str(notification.recipient_id) != user_id:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Notification not found")
-        await self.notifications.mark_as_read(notification_id)
+        if await self.notifications.mark_as_read(notification_id):
+            await self._push_unread_counts([notification.recipient_id])
 
     async def mark_all_read(self, user_id: str) -> int:
-        return await self.notifications.mark_all_as_read(user_id)
+        marked = await self.notifications.mark_all_as_read(user_id)
+        if marked:
+            await self._push_unread_counts([ObjectId(user_id)])
+        return marked
 
     async def unread_count(self, user_id: str) -> int:
         return await self.notifications.unread_count(user_id)
+
+    async def _push_notifications(self, notifications: list[NotificationInDB], unread_changed: Iterable[ObjectId]) -> None:
+        for notification in notifications:
+            await connection_manager.send_to_users(
+                [str(notification.recipient_id)],
+                {"event": "notification:new", "data": NotificationPublic(**notification.model_dump()).model_dump(mode="json", by_alias=True)},
+            )
+        await self._push_unread_counts(list(unread_changed))
+
+    async def _push_unread_counts(self, user_ids: list[ObjectId]) -> None:
+        if not user_ids:
+            return
+        for user_id, unread in (await self.notifications.unread_counts(user_ids)).items():
+            await connection_manager.send_to_users([user_id], {"event": "unread:changed", "data": {"unread_count": unread}})
@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, Optional, Set
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+@dataclass
+class PendingEvent:
+    event_id: int
+    expires_at: float
+    frame: dict[str, Any]
+
+
+class PendingEventQueue:
+    """Per-user queue of user-addressed events kept until the client acknowledges them.
+
+    Every queued frame gets an ``event_id`` that grows per user (microseconds since the
+    epoch, bumped past the previous id), so ids stay ordered across restarts; once events
+    reach MongoDB, ids come from a counter there instead, so workers never mint the same
+    or an out-of-order id and cumulative acks stay safe. A user keeps
+    at most ``max_events`` unacknowledged events for ``ttl`` seconds; clients replay them
+    after reconnecting and trim them with cumulative ``ack`` frames. Queues are in memory;
+    with ``spill`` enabled, events beyond ``memory_events`` per user move to the
+    ``pending_events`` collection instead of being dropped, which also makes them visible
+    to other workers. A user whose backlog was cut short is told to resync on replay.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_events: Optional[int] = None,
+        ttl: Optional[float] = None,
+        memory_events: Optional[int] = None,
+        spill: Optional[bool] = None,
+    ) -> None:
+        self.max_events = max_events or settings.pending_events_max_per_user
+        self.ttl = ttl or settings.pending_events_ttl_seconds
+        self.memory_events = settings.pending_events_memory_per_user if memory_events is None else memory_events
+        self.spill = settings.pending_events_spill if spill is None else spill
+        self._queues: Dict[str, Deque[PendingEvent]] = {}
+        self._last_ids: Dict[str, int] = {}
+        self._truncated: Set[str] = set()
+        self._db: Optional[AsyncIOMotorDatabase] = None
+        self._counter_seeded = False
+        self._sweeper: Optional[asyncio.Task[None]] = None
+
+    async def start(self, db: AsyncIOMotorDatabase) -> None:
+        self._db = db
+        self._sweeper = asyncio.create_task(self._sweep_periodically())
+
+    def write_through(self) -> None:
+        """Keep every event in the ``pending_events`` collection, for brokers shared by workers.
+
+        The socket that acks an event, and the one that replays it after a reconnect, are
+        usually on another worker than the one that queued it.
+        """
+
+        if not self.spill or self.memory_events:
+            logger.info("Pending events are written through to MongoDB for the shared realtime broker")
+        self.spill = True
+        self.memory_events = 0
+
+    async def close(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    async def push(self, user_id: str, message: dict[str, Any]) -> dict[str, Any]:
+        """Queue ``message`` for ``user_id`` and return it stamped with its ``event_id``."""
+
+        return (await self.push_many([(user_id, message)]))[0]
+
+    async def push_many(self, messages: list[tuple[str, dict[str, Any]]]) -> list[dict[str, Any]]:
+        """Queue each ``(user_id, message)`` pair; return the messages stamped with their ids.
+
+        A batch costs at most one counter update and one insert, however many users it addresses.
+        """
+
+        if not messages:
+            return []
+        event_ids = await self._next_ids([user_id for user_id, _ in messages])
+        expires_at = time.time() + self.ttl
+        limit = self.memory_events if self._spilling else self.max_events
+        frames: list[dict[str, Any]] = []
+        overflow: list[tuple[str, PendingEvent]] = []
+        for (user_id, message), event_id in zip(messages, event_ids):
+            frame = {**message, "event_id": event_id}
+            frames.append(frame)
+            queue = self._queues.setdefault(user_id, deque())
+            self._expire(queue)
+            queue.append(PendingEvent(event_id, expires_at, frame))
+            if len(queue) > limit:
+                dropped = [queue.popleft() for _ in range(len(queue) - limit)]
+                if self._spilling:
+                    overflow.extend((user_id, event) for event in dropped)
+                else:
+                    self._truncated.add(user_id)
+            if not queue:
+                del self._queues[user_id]
+        if overflow:
+            await self._spill(overflow)
+        return frames
+
+    async def pending(self, user_id: str) -> tuple[list[dict[str, Any]], bool]:
+        """Unacknowledged frames for ``user_id``, oldest first, and whether older ones were dropped."""
+
+        queue = self._queues.get(user_id)
+        events = []
+        if queue is not None:
+            self._expire(queue)
+            events = [event.frame for event in queue]
+        if self._spilling:
+            # Newest spilled events first; one extra row tells whether older ones were cut off.
+            cursor = (
+                self._collection.find({"user_id": user_id, "expires_at": {"$gt": datetime.utcnow()}})
+                .sort("event_id", -1)
+                .limit(max(self.max_events - len(events), 0) + 1)
+            )
+            spilled = [doc["frame"] async for doc in cursor]
+            events = spilled[::-1] + events
+        truncated = user_id in self._truncated
+        if len(events) > self.max_events:
+            events = events[-self.max_events :]
+            truncated = True
+        self._truncated.discard(user_id)
+        return events, truncated
+
+    async def ack(self, user_id: str, event_id: int) -> None:
+        """Drop every queued event of ``user_id`` up to and including ``event_id``."""
+
+        queue = self._queues.get(user_id)
+        if queue is not None:
+            while queue and queue[0].event_id <= event_id:
+                queue.popleft()
+            if not queue:
+                del self._queues[user_id]
+        if self._spilling:
+            await self._collection.delete_many({"user_id": user_id, "event_id": {"$lte": event_id}})
+
+    def sweep(self) -> None:
+        for user_id, queue in list(self._queues.items()):
+            self._expire(queue)
+            if not queue:
+                del self._queues[user_id]
+        # A last id is only needed while it is ahead of the clock.
+        now = time.time_ns() // 1000
+        for user_id, event_id in list(self._last_ids.items()):
+            if event_id < now:
+                del self._last_ids[user_id]
+
+    def clear(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        self._db = None
+        self._counter_seeded = False
+        self._queues.clear()
+        self._last_ids.clear()
+        self._truncated.clear()
+
+    @property
+    def _spilling(self) -> bool:
+        return self.spill and self._db is not None
+
+    @property
+    def _collection(self) -> Any:
+        return self._db["pending_events"]
+
+    @property
+    def _counter(self) -> Any:
+        return self._db["pending_event_ids"]
+
+    async def _next_ids(self, user_ids: list[str]) -> list[int]:
+        if self._spilling:
+            if not self._counter_seeded:
+                # Start above the time-based ids of events stored before the counter existed.
+                await self._counter.update_one(
+                    {"_id": "event_id"}, {"$max": {"value": time.time_ns() // 1000}}, upsert=True
+                )
+                self._counter_seeded = True
+            counter = await self._counter.find_one_and_update(
+                {"_id": "event_id"},
+                {"$inc": {"value": len(user_ids)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            return list(range(counter["value"] - len(user_ids) + 1, counter["value"] + 1))
+        now = time.time_ns() // 1000
+        event_ids = []
+        for user_id in user_ids:
+            event_id = max(now, self._last_ids.get(user_id, 0) + 1)
+            self._last_ids[user_id] = event_id
+            event_ids.append(event_id)
+        return event_ids
+
+    async def _spill(self, events: list[tuple[str, PendingEvent]]) -> None:
+        documents = [
+            {
+                "user_id": user_id,
+                "event_id": event.event_id,
+                "frame": event.frame,
+                "expires_at": datetime.utcnow() + timedelta(seconds=event.expires_at - time.time()),
+            }
+            for user_id, event in events
+        ]
+        try:
+            await self._collection.insert_many(documents, ordered=False)
+        except BulkWriteError as exc:
+            errors = exc.details.get("writeErrors", [])
+            if exc.details.get("writeConcernErrors") or any(error["code"] != DUPLICATE_KEY for error in errors):
+                raise
+            # The events were already delivered live; users who miss them resync on replay.
+            for error in errors:
+                self._truncated.add(documents[error["index"]]["user_id"])
+            logger.warning("Skipped %s pending events whose event_id was already stored", len(errors))
+
+    @staticmethod
+    def _expire(queue: Deque[PendingEvent]) -> None:
+        now = time.time()
+        while queue and queue[0].expires_at <= now:
+            queue.popleft()
+
+    async def _sweep_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(min(self.ttl, 60.0))
+            self.sweep()
@@ -7,7 +7,8 @@ from bson import ObjectId
 from fastapi import HTTPException, status
 
 from app.core.utils import to_object_id
-from app.repositories.post_repository import PostRepository
+from app.repositories.base import InvalidCursorError
+from app.repositories.post_repository import PostRepository, author_summary
 from app.repositories.user_repository import UserRepository
 from app.schemas.post import (
     CommentCreate,
@@ -20,9 +21,17 @@ from app.schemas.post import (
     PostPublic,
     PostUpdate,
 )
+from app.services.realtime import connection_manager
 
 
 class PostService:
+    """Posts and comments; every change a feed shows is published as a live feed event.
+
+    ``feed:post`` carries a new post, ``feed:counts`` the new like and comment counts of a
+    post, and ``feed:post_deleted`` a removed post id, so clients following the global or
+    a department feed patch loaded pages in place instead of refetching them.
+    """
+
     def __init__(self, posts: PostRepository, users: UserRepository) -> None:
         self.posts = posts
         self.users = users
@@ -30,7 +39,11 @@ class PostService:
     async def create_post(self, author_id: str, payload: PostCreate) -> PostPublic:
         post = PostInDB(author_id=to_object_id(author_id), **payload.model_dump())
         created = await self.posts.create_post(post)
-        return await self._enrich_post(created)
+        public = await self._enrich_post(created)
+        await connection_manager.publish_feed(
+            public.department, {"event": "feed:post", "data": public.model_dump(mode="json", by_alias=True)}
+        )
+        return public
 
     async def update_post(self, post_id: str, user_id: str, payload: PostUpdate) -> PostPublic:
         post = await self.posts.get_post(post_id)
@@ -49,19 +62,20 @@ class PostService:
         if str(post.author_id) != user_id:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Cannot delete this post")
         await self.posts.delete_post(post_id)
+        await connection_manager.publish_feed(post.department, {"event": "feed:post_deleted", "data": {"post_id": str(post.id)}})
 
     async def like_post(self, post_id: str, user_id: str) -> PostPublic:
-        await self.posts.like_post(post_id, user_id)
-        post = await self.posts.get_post(post_id)
+        post = await self.posts.like_post(post_id, user_id)
         if not post:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+        await self._publish_counts(post, post.like_count, post.comment_count)
         return await self._enrich_post(post)
 
     async def unlike_post(self, post_id: str, user_id: str) -> PostPublic:
-        await self.posts.unlike_post(post_id, user_id)
-        post = await self.posts.get_post(post_id)
+        post = await self.posts.unlike_post(post_id, user_id)
         if not post:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+        await self._publish_counts(post, post.like_count, post.comment_count)
         return await self._enrich_post(post)
 
     async def add_comment(self, post_id: str, author_id: str, payload: CommentCreate) -> CommentPublic:
@@ -70,6 +84,7 @@ class PostService:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
         comment = CommentInDB(post_id=post.id, author_id=to_object_id(author_id), **payload.model_dump())
         created = await self.posts.add_comment(comment)
+        await self._publish_counts(post, *await self.posts.get_counts(post.id))
         return await self._enrich_comment(created)
 
     async def update_comment(self, comment_id: str, user_id: str, payload: CommentUpdate) -> CommentPublic:
@@ -85,15 +100,27 @@ class PostService:
         deleted = await self.posts.delete_comment(comment_id, user_id)
         if not deleted:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Comment not found")
-
-    async def list_feed(self, *, limit: int = 20, offset: int = 0, department: Optional[str] = None) -> FeedResponse:
-        posts = await self.posts.list_feed(skip=offset, limit=limit, department=department)
-        items = [await self._enrich_post(p) for p in posts]
-        total = await self.posts.collection.count_documents({})
-        next_cursor = None
-        if len(items) == limit:
-            next_cursor = str(items[-1].created_at.timestamp())
-        return FeedResponse(items=items, total=total, next_cursor=next_cursor)
+        post = await self.posts.get_post(deleted.post_id)
+        if post:
+            await self._publish_counts(post, post.like_count, post.comment_count)
+
+    async def list_feed(
+        self,
+        *,
+        limit: int = 20,
+        offset: int = 0,
+        cursor: Optional[str] = None,
+        department: Optional[str] = None,
+        viewer_id: Optional[str] = None,
+    ) -> FeedResponse:
+        try:
+            posts, next_cursor = await self.posts.list_feed(
+                skip=offset, limit=limit, cursor=cursor, department=department, viewer_id=viewer_id
+            )
+        except InvalidCursorError as exc:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from exc
+        total = None if cursor else await self.posts.count_feed(department)
+        return FeedResponse(items=posts, total=total, next_cursor=next_cursor)
 
     async def get_post(self, post_id: str) -> PostPublic:
         post = await self.posts.get_post(post_id)
@@ -101,30 +128,32 @@ class PostService:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
         return await self._enrich_post(post)
 
-    async def list_comments(self, post_id: str, *, limit: int = 50, offset: int = 0) -> list[CommentPublic]:
-        comments = await self.posts.list_comments(post_id, skip=offset, limit=limit)
-        return [await self._enrich_comment(c) for c in comments]
+    async def list_comments(
+        self,
+        post_id: str,
+        *,
+        limit: int = 50,
+        offset: int = 0,
+        cursor: Optional[str] = None,
+    ) -> tuple[list[CommentPublic], Optional[str]]:
+        try:
+            comments, next_cursor = await self.posts.list_comments(post_id, skip=offset, limit=limit, cursor=cursor)
+        except InvalidCursorError as exc:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from exc
+        return [await self._enrich_comment(c) for c in comments], next_cursor
+
+    async def _publish_counts(self, post: PostInDB, like_count: int, comment_count: int) -> None:
+        await connection_manager.publish_feed(
+            post.department,
+            {"event": "feed:counts", "data": {"post_id": str(post.id), "like_count": like_count, "comment_count": comment_count}},
+        )
 
     async def _enrich_post(self, post: PostInDB | None) -> PostPublic:
         if not post:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
-        comment_count = await self.posts.comments_count(post.id)
-        like_count = len(post.like_user_ids)
         author = await self.users.get_by_id(post.author_id)
-        return PostPublic(
-            **post.model_dump(),
-            comment_count=comment_count,
-            like_count=like_count,
-        )
+        return PostPublic(**post.model_dump(), author=author_summary(author.model_dump() if author else None))
 
     async def _enrich_comment(self, comment: CommentInDB) -> CommentPublic:
         author = await self.users.get_by_id(comment.author_id)
-        author_public = None
-        if author:
-            author_public = {
-                "id": str(author.id),
-                "full_name": author.full_name,
-                "avatar_url": author.avatar_url,
-                "username": author.username,
-            }
-        return CommentPublic(**comment.model_dump(), author=author_public)
+        return CommentPublic(**comment.model_dump(), author=author_summary(author.model_dump() if author else None))
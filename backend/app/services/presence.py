@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Optional, Set
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from app.config import settings
+from app.core.cache import LRUCache
+from app.repositories.message_repository import ChatRepository
+from app.repositories.user_repository import UserRepository
+from app.schemas.user import UserStatus
+from app.services.broker import RedisBroker
+from app.services.realtime import ConnectionManager, connection_manager
+
+logger = logging.getLogger(__name__)
+
+# Redis keys with the Redis broker: a hash of socket counts per worker for each user, and
+# a key per live worker that expires unless the worker refreshes it.
+SOCKET_COUNT_PREFIX = "presence:sockets:"
+WORKER_PREFIX = "presence:worker:"
+
+# Users sharing a chat with a given user, i.e. who receives their presence changes.
+presence_contacts: LRUCache[str, set[str]] = LRUCache(
+    settings.presence_contacts_cache_size, ttl_seconds=settings.presence_contacts_ttl_seconds
+)
+
+
+class PresenceService:
+    """Derives online/away/offline state from live websocket connections.
+
+    A user is ``online`` while they hold a socket and sent a frame other than ``pong``
+    within ``away_after`` seconds, ``away`` while connected but quiet, and ``offline`` once
+    their last socket closes. State lives in memory: every ``broadcast_interval`` seconds
+    the status changes are batched into one ``presence`` frame per user sharing a chat
+    with a changed user, and ``last_seen_at`` is persisted with one bulk write every
+    ``flush_interval`` seconds rather than once per heartbeat.
+
+    Each worker sees only the sockets it holds. With the Redis broker, every worker also
+    records its socket count per user in Redis, and a worker whose last socket for the user
+    closes only announces them offline if no live worker holds one. A worker counts as live
+    while it refreshes its key every flush, so a crashed worker's sockets stop counting after
+    ``PRESENCE_SHARED_TTL_SECONDS``. ``away`` is still judged by each worker on its own sockets.
+    """
+
+    def __init__(
+        self,
+        manager: ConnectionManager,
+        *,
+        broadcast_interval: Optional[float] = None,
+        flush_interval: Optional[float] = None,
+        away_after: Optional[float] = None,
+    ) -> None:
+        self.manager = manager
+        self.broadcast_interval = broadcast_interval or settings.presence_broadcast_interval_seconds
+        self.flush_interval = flush_interval or settings.presence_flush_interval_seconds
+        self.away_after = away_after or settings.presence_away_after_seconds
+        self.shared_ttl = settings.presence_shared_ttl_seconds
+        self.worker_id = uuid.uuid4().hex
+        self._db: Optional[AsyncIOMotorDatabase] = None
+        self._sockets: Dict[str, int] = {}
+        self._active_at: Dict[str, float] = {}
+        self._announced: Dict[str, UserStatus] = {}
+        self._last_seen: Dict[str, datetime] = {}
+        self._disconnected: Set[str] = set()
+        self._task: Optional[asyncio.Task[None]] = None
+
+    async def start(self, db: AsyncIOMotorDatabase) -> None:
+        self._db = db
+        await self._mark_alive()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        client = self._shared_client()
+        if client is not None:
+            # Sockets still counted under this worker are ignored from now on.
+            await client.delete(WORKER_PREFIX + self.worker_id)
+
+    async def connected(self, user_id: str) -> None:
+        self._sockets[user_id] = self._sockets.get(user_id, 0) + 1
+        self.heartbeat(user_id)
+        await self._change_shared_count(user_id, 1)
+
+    async def disconnected(self, user_id: str) -> None:
+        remaining = self._sockets.get(user_id, 0) - 1
+        elsewhere = await self._change_shared_count(user_id, -1)
+        if remaining > 0:
+            self._sockets[user_id] = remaining
+            return
+        self._sockets.pop(user_id, None)
+        self._active_at.pop(user_id, None)
+        self._last_seen[user_id] = datetime.utcnow()
+        if elsewhere:
+            # Another worker still holds a socket and reports the user's status.
+            self._announced.pop(user_id, None)
+            return
+        self._disconnected.add(user_id)
+
+    def heartbeat(self, user_id: str) -> None:
+        if user_id not in self._sockets:
+            return
+        self._active_at[user_id] = asyncio.get_running_loop().time()
+        self._last_seen[user_id] = datetime.utcnow()
+
+    def status_of(self, user_id: str) -> UserStatus:
+        active_at = self._active_at.get(user_id)
+        if user_id not in self._sockets or active_at is None:
+            return UserStatus.OFFLINE
+        if asyncio.get_running_loop().time() - active_at > self.away_after:
+            return UserStatus.AWAY
+        return UserStatus.ONLINE
+
+    async def publish_changes(self) -> None:
+        """Push one ``presence`` frame to each contact of the users whose status changed."""
+
+        candidates = set(self._sockets) | self._announced.keys() | self._disconnected
+        self._disconnected.clear()
+        changes: list[dict[str, Any]] = []
+        for user_id in candidates:
+            current = self.status_of(user_id)
+            if current == self._announced.get(user_id, UserStatus.OFFLINE):
+                continue
+            if current == UserStatus.OFFLINE:
+                self._announced.pop(user_id, None)
+            else:
+                self._announced[user_id] = current
+            seen_at = self._last_seen.get(user_id)
+            changes.append(
+                {"user_id": user_id, "status": current.value, "last_seen_at": seen_at.isoformat() if seen_at else None}
+            )
+        if not changes or self._db is None:
+            return
+        recipients: Dict[str, list[dict[str, Any]]] = defaultdict(list)
+        for change in changes:
+            for contact_id in await self._contacts(change["user_id"]):
+                recipients[contact_id].append(change)
+        for recipient_id, users in recipients.items():
+            await self.manager.send_to_users([recipient_id], {"event": "presence", "data": {"users": users}}, durable=False)
+
+    async def flush(self) -> None:
+        """Write pending ``last_seen_at`` values in a single bulk update."""
+
+        if not self._last_seen or self._db is None:
+            return
+        pending, self._last_seen = self._last_seen, {}
+        try:
+            await UserRepository(self._db).set_last_seen(pending)
+        except Exception:
+            logger.exception("Failed to persist last_seen_at for %d users", len(pending))
+            for user_id, seen_at in pending.items():
+                self._last_seen.setdefault(user_id, seen_at)
+
+    def clear(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._db = None
+        self._sockets.clear()
+        self._active_at.clear()
+        self._announced.clear()
+        self._last_seen.clear()
+        self._disconnected.clear()
+
+    def _shared_client(self) -> Any:
+        broker = self.manager.broker
+        return broker.client if isinstance(broker, RedisBroker) else None
+
+    async def _change_shared_count(self, user_id: str, delta: int) -> int:
+        """Move this worker's socket count for the user; returns the sockets live workers hold elsewhere."""
+
+        client = self._shared_client()
+        if client is None:
+            return 0
+        key = SOCKET_COUNT_PREFIX + user_id
+        try:
+            async with client.pipeline(transaction=True) as pipeline:
+                pipeline.hincrby(key, self.worker_id, delta)
+                pipeline.hgetall(key)
+                own, counts = await pipeline.execute()
+            if own <= 0:
+                await client.hdel(key, self.worker_id)
+            others = {_text(worker): int(count) for worker, count in counts.items() if _text(worker) != self.worker_id}
+            if not others:
+                return 0
+            workers = list(others)
+            alive = await client.mget([WORKER_PREFIX + worker for worker in workers])
+            dead = [worker for worker, flag in zip(workers, alive) if flag is None]
+            if dead:
+                await client.hdel(key, *dead)
+            return sum(max(others[worker], 0) for worker, flag in zip(workers, alive) if flag is not None)
+        except Exception:
+            logger.exception("Failed to update the shared socket count of %s", user_id)
+            return 0
+
+    async def _mark_alive(self) -> None:
+        client = self._shared_client()
+        if client is not None:
+            await client.set(WORKER_PREFIX + self.worker_id, 1, ex=int(self.shared_ttl))
+
+    async def _contacts(self, user_id: str) -> set[str]:
+        contacts = presence_contacts.get(user_id)
+        if contacts is None:
+            contacts = await ChatRepository(self._db).list_contact_ids(user_id)
+            presence_contacts.set(user_id, contacts)
+        return contacts
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_flush = loop.time() + self.flush_interval
+        while True:
+            await asyncio.sleep(self.broadcast_interval)
+            try:
+                await self.publish_changes()
+                if loop.time() >= next_flush:
+                    next_flush = loop.time() + self.flush_interval
+                    await self.flush()
+                    await self._mark_alive()
+            except Exception:
+                logger.exception("Presence update failed")
+
+
+def _text(value: str | bytes) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+presence_service = PresenceService(connection_manager)
@@ -1,40 +1,420 @@
 from __future__ import annotations
 
 import asyncio
+import logging
 from collections import defaultdict
-from typing import Any, Dict, Set
+from contextlib import suppress
+from typing import Any, Coroutine, Dict, Iterable, Mapping, Optional, Set
 
 from fastapi import WebSocket
 
+from app.config import settings
+from app.core.serialization import EncodedFrame, WireEncoding
+from app.services.broker import Broker, InProcessBroker
+from app.services.pending_events import PendingEventQueue
+
+logger = logging.getLogger(__name__)
+
+CHAT_CHANNEL_PREFIX = "chat:"
+USER_CHANNEL_PREFIX = "user:"
+FEED_CHANNEL = "feed"
+DEPARTMENT_FEED_PREFIX = "feed:"
+
+# Close codes follow the 44xx "HTTP status" convention of the websocket routes.
+IDLE_CLOSE_CODE = 4408
+SLOW_CONSUMER_CLOSE_CODE = 4429
+PING_FRAME = {"event": "ping"}
+_ENCODED_PING = EncodedFrame(PING_FRAME)
+
 
 class ConnectionManager:
-    def __init__(self) -> None:
+    """Tracks live sockets and routes events to them.
+
+    Two kinds of sockets are supported: legacy per-chat sockets registered with ``connect``
+    and multiplexed per-user sockets registered with ``connect_user``. A user socket gets
+    chat events only for chats it subscribed to, plus every user-addressed event (chat-list
+    updates) sent with ``send_to_users``. ``_chat_users`` maps a chat to the users with at
+    least one subscribed socket, so a broadcast touches only interested users. User sockets
+    may also follow the global post feed or a department's feed with ``subscribe_feed``.
+
+    Events are published to per-chat, per-user and feed channels on ``broker`` and fanned out to
+    local sockets when they come back, so every worker sees every event for the chats and
+    users it holds sockets for. The manager keeps the broker subscribed to exactly those
+    channels.
+
+    Every socket gets a bounded outbound queue drained by its own writer task, so delivery
+    only enqueues and one slow client never holds up the others. A delivered frame is
+    wrapped in one ``EncodedFrame`` shared by all its sockets, so it is serialized once per
+    wire encoding and event profile (JSON text or MessagePack binary, full or compact keys,
+    both chosen per socket at connect). A socket
+    whose queue overflows, or whose send stalls past ``send_timeout``, is closed with
+    ``SLOW_CONSUMER_CLOSE_CODE`` and unregistered. Writers send ``PING_FRAME`` every
+    ``ping_interval`` seconds; clients answer with ``pong`` to keep the connection alive.
+    """
+
+    def __init__(
+        self,
+        broker: Optional[Broker] = None,
+        *,
+        queue_size: Optional[int] = None,
+        send_timeout: Optional[float] = None,
+        ping_interval: Optional[float] = None,
+    ) -> None:
+        self.queue_size = queue_size or settings.ws_send_queue_size
+        self.send_timeout = send_timeout or settings.ws_send_timeout_seconds
+        self.ping_interval = ping_interval or settings.ws_ping_interval_seconds
         self._connections: Dict[str, Set[WebSocket]] = defaultdict(set)
+        self._socket_chats: Dict[WebSocket, str] = {}
+        self._queues: Dict[WebSocket, asyncio.Queue[EncodedFrame]] = {}
+        self._encodings: Dict[WebSocket, WireEncoding] = {}
+        self._profiles: Dict[WebSocket, Optional[int]] = {}
+        self._replaying: Dict[WebSocket, list[EncodedFrame]] = {}
+        self._writers: Dict[WebSocket, asyncio.Task[None]] = {}
+        self._evictions: Set[asyncio.Task[None]] = set()
+        self._user_connections: Dict[str, Set[WebSocket]] = defaultdict(set)
+        self._chat_users: Dict[str, Set[str]] = defaultdict(set)
+        self._subscriptions: Dict[WebSocket, Set[str]] = {}
+        self._socket_users: Dict[WebSocket, str] = {}
+        self._feeds: Dict[str, Set[WebSocket]] = defaultdict(set)
+        self._socket_feeds: Dict[WebSocket, Set[str]] = {}
+        self._channels: Set[str] = set()
         self._lock = asyncio.Lock()
+        self.broker = broker or InProcessBroker()
+        self.broker.bind(self._deliver)
+        self.pending = PendingEventQueue()
+
+    async def start(self, broker: Optional[Broker] = None) -> None:
+        if broker is not None:
+            self.broker = broker
+            self.broker.bind(self._deliver)
+            self._channels.clear()
+        if self.broker.shared:
+            self.pending.write_through()
+        await self.broker.start()
+
+    async def close(self) -> None:
+        await self.pending.close()
+        await self.broker.close()
+        self._channels.clear()
+        tasks = [*self._writers.values(), *self._evictions]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._writers.clear()
+        self._queues.clear()
 
-    async def connect(self, chat_id: str, websocket: WebSocket) -> None:
+    async def connect(
+        self, chat_id: str, websocket: WebSocket, encoding: WireEncoding = "json", profile: Optional[int] = None
+    ) -> None:
         await websocket.accept()
         async with self._lock:
             self._connections[chat_id].add(websocket)
+            self._socket_chats[websocket] = chat_id
+            self._start_writer(websocket, encoding, profile)
+            await self._sync_channel(CHAT_CHANNEL_PREFIX + chat_id)
 
     async def disconnect(self, chat_id: str, websocket: WebSocket) -> None:
         async with self._lock:
+            self._stop_writer(websocket)
+            self._socket_chats.pop(websocket, None)
             connections = self._connections.get(chat_id)
-            if connections and websocket in connections:
-                connections.remove(websocket)
-            if connections and not connections:
-                self._connections.pop(chat_id, None)
+            if connections is not None:
+                connections.discard(websocket)
+                if not connections:
+                    self._connections.pop(chat_id, None)
+            await self._sync_channel(CHAT_CHANNEL_PREFIX + chat_id)
+
+    async def connect_user(
+        self,
+        user_id: str,
+        websocket: WebSocket,
+        encoding: WireEncoding = "json",
+        profile: Optional[int] = None,
+        *,
+        replay: bool = False,
+    ) -> None:
+        """Register a user socket; with ``replay``, its user events are held until ``replay_pending``."""
+
+        await websocket.accept()
+        async with self._lock:
+            self._start_writer(websocket, encoding, profile)
+            if replay:
+                self._replaying[websocket] = []
+            self._user_connections[user_id].add(websocket)
+            self._socket_users[websocket] = user_id
+            self._subscriptions[websocket] = set()
+            await self._sync_channel(USER_CHANNEL_PREFIX + user_id)
+
+    async def disconnect_user(self, websocket: WebSocket) -> None:
+        async with self._lock:
+            self._stop_writer(websocket)
+            user_id = self._socket_users.pop(websocket, None)
+            chat_ids = self._subscriptions.pop(websocket, set())
+            if user_id is None:
+                return
+            sockets = self._user_connections.get(user_id)
+            if sockets is not None:
+                sockets.discard(websocket)
+                if not sockets:
+                    self._user_connections.pop(user_id, None)
+            await self._sync_channel(USER_CHANNEL_PREFIX + user_id)
+            for chat_id in chat_ids:
+                await self._release_chat(chat_id, user_id)
+            for channel in self._socket_feeds.pop(websocket, set()):
+                await self._release_feed(channel, websocket)
+
+    async def subscribe(self, websocket: WebSocket, chat_id: str) -> None:
+        async with self._lock:
+            user_id = self._socket_users.get(websocket)
+            if user_id is None:
+                return
+            self._subscriptions[websocket].add(chat_id)
+            self._chat_users[chat_id].add(user_id)
+            await self._sync_channel(CHAT_CHANNEL_PREFIX + chat_id)
+
+    async def unsubscribe(self, websocket: WebSocket, chat_id: str) -> None:
+        async with self._lock:
+            user_id = self._socket_users.get(websocket)
+            chat_ids = self._subscriptions.get(websocket)
+            if user_id is None or chat_ids is None or chat_id not in chat_ids:
+                return
+            chat_ids.discard(chat_id)
+            await self._release_chat(chat_id, user_id)
+
+    def is_subscribed(self, websocket: WebSocket, chat_id: str) -> bool:
+        return chat_id in self._subscriptions.get(websocket, ())
+
+    async def subscribe_feed(self, websocket: WebSocket, department: Optional[str] = None) -> None:
+        """Follow the post feed of ``department``, or the global feed when it is ``None``."""
+
+        async with self._lock:
+            if websocket not in self._socket_users:
+                return
+            channel = _feed_channel(department)
+            self._socket_feeds.setdefault(websocket, set()).add(channel)
+            self._feeds[channel].add(websocket)
+            await self._sync_channel(channel)
+
+    async def unsubscribe_feed(self, websocket: WebSocket, department: Optional[str] = None) -> None:
+        async with self._lock:
+            channel = _feed_channel(department)
+            channels = self._socket_feeds.get(websocket)
+            if channels is None or channel not in channels:
+                return
+            channels.discard(channel)
+            await self._release_feed(channel, websocket)
+
+    async def publish_feed(self, department: Optional[str], message: dict[str, Any]) -> None:
+        """Publish a feed event to the global feed and, for department posts, that department's feed."""
+
+        await self.broker.publish(FEED_CHANNEL, message)
+        if department:
+            await self.broker.publish(_feed_channel(department), message)
 
     async def broadcast(self, chat_id: str, message: dict[str, Any]) -> None:
-        connections = list(self._connections.get(chat_id, []))
-        for websocket in connections:
+        # Multiplexed sockets need the chat id to route frames client-side.
+        await self.broker.publish(CHAT_CHANNEL_PREFIX + chat_id, {**message, "chat_id": chat_id})
+
+    async def send_to_users(
+        self,
+        user_ids: Iterable[str],
+        message: dict[str, Any],
+        *,
+        durable: bool = True,
+        data_by_user: Optional[Mapping[str, Mapping[str, Any]]] = None,
+    ) -> None:
+        """Deliver a user-addressed event (chat list, unread state) to every socket of each user.
+
+        ``data_by_user`` adds per-user fields to the shared ``data`` of ``message``. Durable
+        events are stamped with an ``event_id`` and kept in ``pending`` until the client acks
+        them, so a user who is offline gets them replayed on reconnect.
+        """
+
+        user_ids = [str(user_id) for user_id in user_ids]
+        messages = [message] * len(user_ids)
+        if data_by_user:
+            messages = [
+                {**message, "data": {**message["data"], **data_by_user[user_id]}} if user_id in data_by_user else message
+                for user_id in user_ids
+            ]
+        frames = await self.pending.push_many(list(zip(user_ids, messages))) if durable else messages
+        await self.broker.publish_many([(USER_CHANNEL_PREFIX + user_id, frame) for user_id, frame in zip(user_ids, frames)])
+
+    async def replay_pending(self, websocket: WebSocket, user_id: str) -> None:
+        """Resend the user's unacknowledged events, then a ``pending:replayed`` marker.
+
+        User events delivered to the socket meanwhile were held back; they follow the
+        marker, minus those the replay already contained.
+        """
+
+        frames, truncated = await self.pending.pending(user_id)
+        marker = {"event": "pending:replayed", "data": {"count": len(frames), "truncated": truncated}}
+        for frame in [*frames, marker]:
+            queue = self._queues.get(websocket)
+            if queue is None:
+                self._replaying.pop(websocket, None)
+                return
+            # A backlog may exceed the queue; wait for the writer instead of evicting the socket.
+            await queue.put(EncodedFrame(frame))
+        replayed = {frame["event_id"] for frame in frames}
+        for held in self._replaying.pop(websocket, []):
+            if held.frame.get("event_id") not in replayed:
+                self._enqueue(websocket, held)
+
+    async def send_personal_message(self, websocket: WebSocket, message: dict[str, Any], *, raw: bool = False) -> None:
+        # Queued behind pending broadcasts so the socket sees frames in order. ``raw`` frames
+        # skip the compact profile (the handshake that announces it).
+        self._enqueue(websocket, EncodedFrame(message, raw=raw))
+
+    def clear(self) -> None:
+        self.pending.clear()
+        for task in [*self._writers.values(), *self._evictions]:
+            task.cancel()
+        self._writers.clear()
+        self._queues.clear()
+        self._encodings.clear()
+        self._profiles.clear()
+        self._replaying.clear()
+        self._evictions.clear()
+        self._socket_chats.clear()
+        self._connections.clear()
+        self._user_connections.clear()
+        self._chat_users.clear()
+        self._subscriptions.clear()
+        self._socket_users.clear()
+        self._feeds.clear()
+        self._socket_feeds.clear()
+        self._channels.clear()
+
+    async def _deliver(self, channel: str, message: dict[str, Any]) -> None:
+        frame = EncodedFrame(message)
+        if channel.startswith(USER_CHANNEL_PREFIX):
+            for websocket in list(self._user_connections.get(channel[len(USER_CHANNEL_PREFIX) :], ())):
+                held = self._replaying.get(websocket)
+                if held is not None:
+                    held.append(frame)
+                else:
+                    self._enqueue(websocket, frame)
+            return
+        if _is_feed_channel(channel):
+            for websocket in list(self._feeds.get(channel, ())):
+                self._enqueue(websocket, frame)
+            return
+        chat_id = channel[len(CHAT_CHANNEL_PREFIX) :]
+        for websocket in list(self._connections.get(chat_id, ())):
+            self._enqueue(websocket, frame)
+        for user_id in list(self._chat_users.get(chat_id, ())):
+            for websocket in list(self._user_connections.get(user_id, ())):
+                if chat_id in self._subscriptions.get(websocket, ()):
+                    self._enqueue(websocket, frame)
+
+    def _enqueue(self, websocket: WebSocket, frame: EncodedFrame) -> None:
+        queue = self._queues.get(websocket)
+        if queue is None:
+            return
+        try:
+            queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # Drop the queue right away so later frames are not queued for a doomed socket.
+            self._queues.pop(websocket, None)
+            self._spawn(self._evict(websocket, SLOW_CONSUMER_CLOSE_CODE))
+
+    def _start_writer(self, websocket: WebSocket, encoding: WireEncoding, profile: Optional[int]) -> None:
+        queue: asyncio.Queue[EncodedFrame] = asyncio.Queue(maxsize=self.queue_size)
+        self._queues[websocket] = queue
+        self._encodings[websocket] = encoding
+        self._profiles[websocket] = profile
+        self._writers[websocket] = asyncio.create_task(self._write(websocket, queue))
+
+    def _stop_writer(self, websocket: WebSocket) -> None:
+        self._queues.pop(websocket, None)
+        self._encodings.pop(websocket, None)
+        self._profiles.pop(websocket, None)
+        self._replaying.pop(websocket, None)
+        writer = self._writers.pop(websocket, None)
+        if writer is not None and writer is not asyncio.current_task():
+            writer.cancel()
+
+    async def _write(self, websocket: WebSocket, queue: asyncio.Queue[EncodedFrame]) -> None:
+        binary = self._encodings.get(websocket) == "msgpack"
+        # Version 1 is the only compact profile so far.
+        compact = self._profiles.get(websocket) is not None
+        loop = asyncio.get_running_loop()
+        next_ping = loop.time() + self.ping_interval
+        while True:
             try:
-                await websocket.send_json(message)
-            except RuntimeError:
-                await self.disconnect(chat_id, websocket)
+                frame = await asyncio.wait_for(queue.get(), max(next_ping - loop.time(), 0))
+            except asyncio.TimeoutError:
+                frame = _ENCODED_PING
+                next_ping = loop.time() + self.ping_interval
+            try:
+                send = (
+                    websocket.send_bytes(frame.binary(compact)) if binary else websocket.send_text(frame.text(compact))
+                )
+                await asyncio.wait_for(send, self.send_timeout)
+            except asyncio.TimeoutError:
+                await self._evict(websocket, SLOW_CONSUMER_CLOSE_CODE)
+                return
+            except Exception:
+                # The peer went away; drop it from the registries without a close frame.
+                await self._evict(websocket, None)
+                return
+
+    async def _evict(self, websocket: WebSocket, code: Optional[int]) -> None:
+        if websocket in self._socket_users:
+            await self.disconnect_user(websocket)
+        elif websocket in self._socket_chats:
+            await self.disconnect(self._socket_chats[websocket], websocket)
+        if code is not None:
+            logger.info("Closing websocket that fell behind on outbound frames")
+            with suppress(Exception):
+                await asyncio.wait_for(websocket.close(code=code), self.send_timeout)
+
+    def _spawn(self, coroutine: Coroutine[Any, Any, None]) -> None:
+        task = asyncio.create_task(coroutine)
+        self._evictions.add(task)
+        task.add_done_callback(self._evictions.discard)
+
+    async def _release_chat(self, chat_id: str, user_id: str) -> None:
+        # Keep the user registered for the chat while another of their sockets subscribes to it.
+        if not any(chat_id in self._subscriptions.get(socket, ()) for socket in self._user_connections.get(user_id, ())):
+            users = self._chat_users.get(chat_id)
+            if users is not None:
+                users.discard(user_id)
+                if not users:
+                    self._chat_users.pop(chat_id, None)
+        await self._sync_channel(CHAT_CHANNEL_PREFIX + chat_id)
+
+    async def _release_feed(self, channel: str, websocket: WebSocket) -> None:
+        sockets = self._feeds.get(channel)
+        if sockets is not None:
+            sockets.discard(websocket)
+            if not sockets:
+                self._feeds.pop(channel, None)
+        await self._sync_channel(channel)
+
+    async def _sync_channel(self, channel: str) -> None:
+        if channel.startswith(USER_CHANNEL_PREFIX):
+            wanted = bool(self._user_connections.get(channel[len(USER_CHANNEL_PREFIX) :]))
+        elif _is_feed_channel(channel):
+            wanted = bool(self._feeds.get(channel))
+        else:
+            chat_id = channel[len(CHAT_CHANNEL_PREFIX) :]
+            wanted = bool(self._connections.get(chat_id)) or bool(self._chat_users.get(chat_id))
+        if wanted and channel not in self._channels:
+            self._channels.add(channel)
+            await self.broker.subscribe(channel)
+        elif not wanted and channel in self._channels:
+            self._channels.discard(channel)
+            await self.broker.unsubscribe(channel)
+
+
+def _feed_channel(department: Optional[str]) -> str:
+    return DEPARTMENT_FEED_PREFIX + department if department else FEED_CHANNEL
+
 
-    async def send_personal_message(self, websocket: WebSocket, message: dict[str, Any]) -> None:
-        await websocket.send_json(message)
+def _is_feed_channel(channel: str) -> bool:
+    return channel == FEED_CHANNEL or channel.startswith(DEPARTMENT_FEED_PREFIX)
 
 
 connection_manager = ConnectionManager()
@@ -4,7 +4,12 @@ from datetime import datetime, timedelta
 
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
+from app.repositories.message_bucket_repository import create_message_repository
+from app.repositories.message_repository import chat_membership_cache
+from app.repositories.post_repository import feed_totals
 from app.schemas.system import MetricsResponse
+from app.services.message_cache import recent_messages, sent_messages
+from app.services.presence import presence_contacts
 
 
 class SystemService:
@@ -17,7 +22,7 @@ class SystemService:
         start_of_day = datetime(now.year, now.month, now.day)
         total_users = await self.db.users.count_documents({})
         posts_today = await self.db.posts.count_documents({"created_at": {"$gte": start_of_day}})
-        messages_today = await self.db.messages.count_documents({"created_at": {"$gte": start_of_day}})
+        messages_today = await create_message_repository(self.db).count_since(start_of_day)
         storage_agg = await self.db.users.aggregate([
             {"$group": {"_id": None, "total": {"$sum": "$storage_used"}}}
         ]).to_list(length=1)
@@ -28,4 +33,11 @@ class SystemService:
             messages_today=messages_today,
             storage_used_mb=round(storage_used / (1024 * 1024), 2),
             uptime_seconds=(now - self.started_at).total_seconds(),
+            caches={
+                "chat_membership": chat_membership_cache.stats(),
+                "recent_messages": recent_messages.stats(),
+                "sent_messages": sent_messages.stats(),
+                "presence_contacts": presence_contacts.stats(),
+                "feed_totals": feed_totals.stats(),
+            },
         )
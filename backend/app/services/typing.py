@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Dict, FrozenSet, Optional
+
+from app.config import settings
+from app.services.realtime import ConnectionManager, connection_manager
+
+logger = logging.getLogger(__name__)
+
+
+class TypingAggregator:
+    """Coalesces typing updates into at most one ``typing`` frame per chat per interval.
+
+    Typing state is kept per chat and user with an expiry ``ttl`` seconds out, so repeated
+    keystroke frames only push the expiry back. While a chat has typers, a flush task wakes
+    every ``interval`` seconds, drops expired typers and broadcasts one frame if the set
+    changed since the last one: ``user_ids`` lists everyone typing and ``stopped`` those who
+    stopped or expired. Each worker only knows the typers on its own sockets, so clients
+    add ``user_ids`` and remove ``stopped`` instead of replacing their set.
+    """
+
+    def __init__(
+        self,
+        manager: ConnectionManager,
+        *,
+        interval: Optional[float] = None,
+        ttl: Optional[float] = None,
+    ) -> None:
+        self.manager = manager
+        self.interval = interval or settings.typing_broadcast_interval_seconds
+        self.ttl = ttl or settings.typing_ttl_seconds
+        self._typers: Dict[str, Dict[str, float]] = {}
+        self._announced: Dict[str, FrozenSet[str]] = {}
+        self._flushers: Dict[str, asyncio.Task[None]] = {}
+
+    def update(self, chat_id: str, user_id: str, is_typing: bool) -> None:
+        if is_typing:
+            self._typers.setdefault(chat_id, {})[user_id] = asyncio.get_running_loop().time() + self.ttl
+        elif self._typers.get(chat_id, {}).pop(user_id, None) is None:
+            return
+        if chat_id not in self._flushers:
+            self._flushers[chat_id] = asyncio.create_task(self._flush(chat_id))
+
+    async def close(self) -> None:
+        tasks = list(self._flushers.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.clear()
+
+    def clear(self) -> None:
+        for task in self._flushers.values():
+            task.cancel()
+        self._flushers.clear()
+        self._typers.clear()
+        self._announced.clear()
+
+    async def _flush(self, chat_id: str) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                typers = self._typers.get(chat_id, {})
+                now = loop.time()
+                for user_id, expires_at in list(typers.items()):
+                    if expires_at <= now:
+                        del typers[user_id]
+                current = frozenset(typers)
+                announced = self._announced.get(chat_id, frozenset())
+                self._announced[chat_id] = current
+                if current != announced:
+                    frame = {"event": "typing", "data": {"user_ids": sorted(current), "stopped": sorted(announced - current)}}
+                    try:
+                        await self.manager.broadcast(chat_id, frame)
+                    except Exception:
+                        logger.exception("Failed to broadcast typing state for chat %s", chat_id)
+                # Typers may have arrived during the broadcast; keep flushing for them.
+                if not self._typers.get(chat_id) and not self._announced[chat_id]:
+                    self._typers.pop(chat_id, None)
+                    self._announced.pop(chat_id, None)
+                    return
+        finally:
+            if self._flushers.get(chat_id) is asyncio.current_task():
+                del self._flushers[chat_id]
+
+
+typing_aggregator = TypingAggregator(connection_manager)
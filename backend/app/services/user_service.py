@@ -6,6 +6,7 @@ from fastapi import HTTPException, status
 
 from app.core.security import hash_password, verify_password
 from app.core.utils import to_object_id
+from app.repositories.base import InvalidCursorError
 from app.repositories.user_repository import UserRepository
 from app.schemas.user import AdminUserUpdate, UserInDB, UserListResponse, UserPublic, UserSearchQuery, UserUpdate
 
@@ -43,17 +44,24 @@ class UserService:
         await self.users.update_password(user_id, hash_password(new_password))
 
     async def search(self, query: UserSearchQuery) -> UserListResponse:
-        items, total = await self.users.search_users(
-            query=query.query,
-            department=query.department,
-            skip=query.offset,
-            limit=query.limit,
-        )
-        return UserListResponse(items=[UserPublic(**i.model_dump()) for i in items], total=total)
+        try:
+            items, total, next_cursor = await self.users.search_users(
+                query=query.query,
+                department=query.department,
+                skip=query.offset,
+                limit=query.limit,
+                cursor=query.cursor,
+            )
+        except InvalidCursorError as exc:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from exc
+        return UserListResponse(items=[UserPublic(**i.model_dump()) for i in items], total=total, next_cursor=next_cursor)
 
-    async def list_users(self, limit: int = 50, offset: int = 0) -> list[UserPublic]:
-        users = await self.users.list_users(skip=offset, limit=limit)
-        return [UserPublic(**u.model_dump()) for u in users]
+    async def list_users(self, limit: int = 50, offset: int = 0, cursor: Optional[str] = None) -> tuple[list[UserPublic], Optional[str]]:
+        try:
+            users, next_cursor = await self.users.list_users(skip=offset, limit=limit, cursor=cursor)
+        except InvalidCursorError as exc:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from exc
+        return [UserPublic(**u.model_dump()) for u in users], next_cursor
 
     async def set_status(self, user_id: str, status_value: str) -> None:
         from app.schemas.user import UserStatus
@@ -1 +1 @@
-uvicorn app.main:app --reload
\ No newline at end of file
+uvicorn app.main:app --reload --ws websockets --ws-per-message-deflate true
@@ -11,7 +11,13 @@ from mongomock_motor import AsyncMongoMockClient
 from app.config import settings
 from app.core.dependencies import get_db
 from app.db import mongo
+from app.repositories.message_archive_repository import segment_cache
+from app.repositories.message_repository import chat_membership_cache
+from app.repositories.post_repository import feed_totals
+from app.services.message_cache import recent_messages, sent_messages
+from app.services.presence import presence_contacts, presence_service
 from app.services.realtime import connection_manager
+from app.services.typing import typing_aggregator
 
 
 @pytest.fixture
@@ -115,6 +121,27 @@ async def create_user(client: AsyncClient) -> Callable[..., Awaitable[dict[str,
 
 @pytest.fixture(autouse=True)
 def reset_connections() -> AsyncIterator[None]:
-    connection_manager._connections.clear()
+    connection_manager.clear()
+    typing_aggregator.clear()
+    presence_service.clear()
     yield
-    connection_manager._connections.clear()
+    typing_aggregator.clear()
+    presence_service.clear()
+    connection_manager.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_caches() -> AsyncIterator[None]:
+    chat_membership_cache.clear()
+    recent_messages.clear()
+    sent_messages.clear()
+    segment_cache.clear()
+    presence_contacts.clear()
+    feed_totals.clear()
+    yield
+    chat_membership_cache.clear()
+    recent_messages.clear()
+    sent_messages.clear()
+    segment_cache.clear()
+    presence_contacts.clear()
+    feed_totals.clear()
@@ -1,8 +1,17 @@
 from __future__ import annotations
 
+from datetime import datetime, timedelta
+
 from bson import ObjectId
 import pytest
 
+from app.config import settings
+from app.db import maintenance
+from app.db.maintenance import archive_messages, migrate_messages, migrate_read_markers
+from app.repositories.message_repository import ChatRepository, MessageRepository, chat_membership_cache
+from app.services.message_cache import recent_messages, sent_messages
+from app.services.realtime import connection_manager
+
 
 pytestmark = pytest.mark.asyncio
 
@@ -71,9 +80,8 @@ async def test_direct_and_group_messaging_flow(client, create_user, test_db):
     )
     assert mark_seen_response.status_code == 204
 
-    message_doc = await test_db.messages.find_one({"_id": ObjectId(message_id)})
-    assert message_doc is not None
-    assert alice["user"]["_id"] in {str(item) for item in message_doc.get("seen_by", [])}
+    chat_doc = await test_db.chats.find_one({"_id": ObjectId(direct_chat_id)})
+    assert str(chat_doc["read_markers"][alice["user"]["_id"]]["message_id"]) == message_id
 
     mark_chat_seen_response = await client.post(
         f"/api/messaging/chats/{direct_chat_id}/seen",
@@ -107,3 +115,502 @@ async def test_direct_and_group_messaging_flow(client, create_user, test_db):
     assert delete_everyone_response.status_code == 204
     removed = await test_db.messages.find_one({"_id": ObjectId(second_message["_id"])})
     assert removed is None
+
+
+async def test_chat_list_tracks_last_message(client, create_user):
+    alice = await create_user(email="carol@example.com", username="carol", full_name="Carol")
+    bob = await create_user(email="dave@example.com", username="dave", full_name="Dave")
+    alice_headers = {"Authorization": f"Bearer {alice['tokens']['access_token']}"}
+    bob_headers = {"Authorization": f"Bearer {bob['tokens']['access_token']}"}
+
+    chat_response = await client.post(
+        "/api/messaging/chats/direct",
+        headers=alice_headers,
+        json={"other_user_id": bob["user"]["_id"]},
+    )
+    chat_id = chat_response.json()["_id"]
+
+    first = await client.post(
+        f"/api/messaging/chats/{chat_id}/messages",
+        headers=alice_headers,
+        json={"chat_id": chat_id, "content": "First"},
+    )
+    second = await client.post(
+        f"/api/messaging/chats/{chat_id}/messages",
+        headers=alice_headers,
+        json={"chat_id": chat_id, "content": "Second"},
+    )
+    second_id = second.json()["_id"]
+
+    chats = (await client.get("/api/messaging/chats", headers=bob_headers)).json()
+    summary = next(chat for chat in chats if chat["_id"] == chat_id)
+    assert summary["last_message"]["id"] == second_id
+    assert summary["last_message_preview"] == "Second"
+    assert summary["unread_count"] == 2
+
+    await client.patch(
+        f"/api/messaging/chats/{chat_id}/messages/{second_id}",
+        headers=alice_headers,
+        json={"content": "Second, edited"},
+    )
+    chats = (await client.get("/api/messaging/chats", headers=bob_headers)).json()
+    summary = next(chat for chat in chats if chat["_id"] == chat_id)
+    assert summary["last_message"]["preview"] == "Second, edited"
+
+    await client.delete(
+        f"/api/messaging/chats/{chat_id}/messages/{second_id}",
+        headers=alice_headers,
+        params={"for_everyone": "true"},
+    )
+    chats = (await client.get("/api/messaging/chats", headers=bob_headers)).json()
+    summary = next(chat for chat in chats if chat["_id"] == chat_id)
+    assert summary["last_message"]["id"] == first.json()["_id"]
+    assert summary["unread_count"] == 1
+
+    first_id = first.json()["_id"]
+    receipts = await client.get(f"/api/messaging/chats/{chat_id}/messages/{first_id}/receipts", headers=alice_headers)
+    assert receipts.json()["seen_by"] == []
+
+    seen = await client.post(f"/api/messaging/chats/{chat_id}/seen", headers=bob_headers)
+    assert seen.status_code == 204
+    chats = (await client.get("/api/messaging/chats", headers=bob_headers)).json()
+    assert next(chat for chat in chats if chat["_id"] == chat_id)["unread_count"] == 0
+    receipts = await client.get(f"/api/messaging/chats/{chat_id}/messages/{first_id}/receipts", headers=alice_headers)
+    assert receipts.json()["seen_by"] == [bob["user"]["_id"]]
+
+
+async def test_chats_without_last_message_are_backfilled(client, create_user, test_db):
+    alice = await create_user(email="erin@example.com", username="erin", full_name="Erin")
+    bob = await create_user(email="frank@example.com", username="frank", full_name="Frank")
+    alice_headers = {"Authorization": f"Bearer {alice['tokens']['access_token']}"}
+    bob_headers = {"Authorization": f"Bearer {bob['tokens']['access_token']}"}
+    chat_id = (
+        await client.post("/api/messaging/chats/direct", headers=alice_headers, json={"other_user_id": bob["user"]["_id"]})
+    ).json()["_id"]
+    sent = await client.post(f"/api/messaging/chats/{chat_id}/messages", headers=alice_headers, json={"chat_id": chat_id, "content": "Old"})
+    # As written before chats carried a last-message snapshot.
+    await test_db.chats.update_one({"_id": ObjectId(chat_id)}, {"$unset": {"last_message": ""}})
+    chat_membership_cache.clear()
+
+    assert (await client.post(f"/api/messaging/chats/{chat_id}/seen", headers=bob_headers)).status_code == 204
+    chat = await test_db.chats.find_one({"_id": ObjectId(chat_id)})
+    assert str(chat["read_markers"][bob["user"]["_id"]]["message_id"]) == sent.json()["_id"]
+
+    chats = ChatRepository(test_db)
+    assert await chats.backfill_last_messages(MessageRepository(test_db)) == 1
+    assert await chats.backfill_last_messages(MessageRepository(test_db)) == 0
+    summary = next(chat for chat in (await client.get("/api/messaging/chats", headers=bob_headers)).json() if chat["_id"] == chat_id)
+    assert (summary["last_message_preview"], summary["unread_count"]) == ("Old", 0)
+
+
+async def test_seen_by_is_migrated_into_read_markers(client, create_user, test_db):
+    alice = await create_user(email="grace@example.com", username="grace", full_name="Grace")
+    bob = await create_user(email="heidi@example.com", username="heidi", full_name="Heidi")
+    alice_headers = {"Authorization": f"Bearer {alice['tokens']['access_token']}"}
+    chat_id = (
+        await client.post("/api/messaging/chats/direct", headers=alice_headers, json={"other_user_id": bob["user"]["_id"]})
+    ).json()["_id"]
+    url = f"/api/messaging/chats/{chat_id}/messages"
+    sent = [(await client.post(url, headers=alice_headers, json={"chat_id": chat_id, "content": f"m{n}"})).json() for n in range(3)]
+    assert "seen_by" not in sent[0]
+
+    # Bob read the first two messages under the old per-message receipts.
+    bob_id = ObjectId(bob["user"]["_id"])
+    await test_db.messages.update_many({"chat_id": ObjectId(chat_id)}, {"$set": {"seen_by": []}})
+    await test_db.messages.update_many({"_id": {"$in": [ObjectId(m["_id"]) for m in sent[:2]]}}, {"$set": {"seen_by": [bob_id]}})
+    await test_db.chats.update_one({"_id": ObjectId(chat_id)}, {"$unset": {f"read_markers.{bob_id}": ""}})
+
+    assert await migrate_read_markers(test_db) == 1
+    chat = await test_db.chats.find_one({"_id": ObjectId(chat_id)})
+    assert str(chat["read_markers"][str(bob_id)]["message_id"]) == sent[1]["_id"]
+    assert chat["unread_counts"][str(bob_id)] == 1
+    assert await test_db.messages.count_documents({"seen_by": {"$exists": True}}) == 0
+    assert await migrate_read_markers(test_db) == 0
+
+
+async def test_message_history_windows(client, create_user):
+    alice = await create_user(email="erin@example.com", username="erin", full_name="Erin")
+    bob = await create_user(email="frank@example.com", username="frank", full_name="Frank")
+    alice_headers = {"Authorization": f"Bearer {alice['tokens']['access_token']}"}
+    bob_headers = {"Authorization": f"Bearer {bob['tokens']['access_token']}"}
+
+    chat_id = (
+        await client.post(
+            "/api/messaging/chats/direct",
+            headers=alice_headers,
+            json={"other_user_id": bob["user"]["_id"]},
+        )
+    ).json()["_id"]
+    ids = []
+    for index in range(9):
+        response = await client.post(
+            f"/api/messaging/chats/{chat_id}/messages",
+            headers=alice_headers,
+            json={"chat_id": chat_id, "content": f"Message {index}"},
+        )
+        ids.append(response.json()["_id"])
+    url = f"/api/messaging/chats/{chat_id}/messages"
+
+    around = (await client.get(url, headers=bob_headers, params={"around": ids[4], "limit": 4})).json()
+    assert [item["_id"] for item in around] == [ids[6], ids[5], ids[4], ids[3]]
+
+    older = (await client.get(url, headers=bob_headers, params={"before_id": ids[3], "limit": 10})).json()
+    assert [item["_id"] for item in older] == [ids[2], ids[1], ids[0]]
+
+    newer = (await client.get(url, headers=bob_headers, params={"after_id": ids[6], "limit": 10})).json()
+    assert [item["_id"] for item in newer] == [ids[8], ids[7]]
+
+    await client.post(f"{url}/{ids[2]}/seen", headers=bob_headers)
+    unread_window = (await client.get(url, headers=bob_headers, params={"around_unread": "true", "limit": 4})).json()
+    assert [item["_id"] for item in unread_window] == [ids[4], ids[3], ids[2], ids[1]]
+
+    missing = await client.get(url, headers=bob_headers, params={"around": "0" * 24})
+    assert missing.status_code == 404
+
+
+async def test_message_search(client, create_user, test_db):
+    alice = await create_user(email="grace@example.com", username="grace", full_name="Grace")
+    bob = await create_user(email="heidi@example.com", username="heidi", full_name="Heidi")
+    outsider = await create_user(email="ivan@example.com", username="ivan", full_name="Ivan")
+    alice_headers = {"Authorization": f"Bearer {alice['tokens']['access_token']}"}
+
+    chat_id = (
+        await client.post(
+            "/api/messaging/chats/direct",
+            headers=alice_headers,
+            json={"other_user_id": bob["user"]["_id"]},
+        )
+    ).json()["_id"]
+    url = f"/api/messaging/chats/{chat_id}/messages"
+    ids = []
+    for content in ["Deploy the release tonight", "Lunch?", "Release notes: deploy went fine", "deploy again"]:
+        ids.append((await client.post(url, headers=alice_headers, json={"chat_id": chat_id, "content": content})).json()["_id"])
+
+    search_url = f"/api/messaging/chats/{chat_id}/search"
+    result = (await client.get(search_url, headers=alice_headers, params={"q": "deploy RELEASE"})).json()
+    assert [hit["message"]["_id"] for hit in result["items"]] == [ids[2], ids[0]]
+    assert result["items"][1]["highlights"] == [[0, 6], [11, 18]]
+
+    first_page = (await client.get(search_url, headers=alice_headers, params={"q": "deploy", "limit": 2})).json()
+    assert [hit["message"]["_id"] for hit in first_page["items"]] == [ids[3], ids[2]]
+    second_page = (
+        await client.get(search_url, headers=alice_headers, params={"q": "deploy", "limit": 2, "cursor": first_page["next_cursor"]})
+    ).json()
+    assert [hit["message"]["_id"] for hit in second_page["items"]] == [ids[0]]
+
+    await client.patch(f"{url}/{ids[1]}", headers=alice_headers, json={"content": "Lunch after deploy?"})
+    await client.delete(f"{url}/{ids[3]}", headers=alice_headers, params={"for_everyone": "true"})
+    result = (await client.get(search_url, headers=alice_headers, params={"q": "deploy"})).json()
+    assert [hit["message"]["_id"] for hit in result["items"]] == [ids[2], ids[1], ids[0]]
+    frequencies = {
+        stat["term"]: stat["count"]
+        async for stat in test_db.message_term_stats.find({"chat_id": ObjectId(chat_id), "term": {"$in": ["deploy", "lunch", "again"]}})
+    }
+    assert frequencies == {"deploy": 3, "lunch": 1, "again": 0}
+    absent = (await client.get(search_url, headers=alice_headers, params={"q": "deploy nowhere"})).json()
+    assert absent["items"] == []
+
+    repeated = (await client.post(url, headers=alice_headers, json={"chat_id": chat_id, "content": "deploy, deploy"})).json()["_id"]
+    newest = (await client.post(url, headers=alice_headers, json={"chat_id": chat_id, "content": "deploy now"})).json()["_id"]
+    result = (await client.get(search_url, headers=alice_headers, params={"q": "deploy"})).json()
+    assert [hit["message"]["_id"] for hit in result["items"]] == [repeated, newest, ids[2], ids[1], ids[0]]
+
+    forbidden = await client.get(
+        search_url,
+        headers={"Authorization": f"Bearer {outsider['tokens']['access_token']}"},
+        params={"q": "deploy"},
+    )
+    assert forbidden.status_code == 403
+
+
+async def test_chat_membership_cache_serves_checks_and_is_invalidated(client, create_user, test_db):
+    alice = await create_user(email="olga@example.com", username="olga", full_name="Olga")
+    bob = await create_user(email="pavel@example.com", username="pavel", full_name="Pavel")
+    carol = await create_user(email="rita@example.com", username="rita", full_name="Rita")
+    bob_headers = {"Authorization": f"Bearer {bob['tokens']['access_token']}"}
+    carol_headers = {"Authorization": f"Bearer {carol['tokens']['access_token']}"}
+    chat_id = (
+        await client.post(
+            "/api/messaging/chats/group",
+            headers={"Authorization": f"Bearer {alice['tokens']['access_token']}"},
+            json={"member_ids": [bob["user"]["_id"]], "name": "Cache"},
+        )
+    ).json()["_id"]
+    url = f"/api/messaging/chats/{chat_id}/messages"
+
+    assert (await client.get(url, headers=bob_headers)).status_code == 200
+    hits = chat_membership_cache.hits
+    # Edited behind the repository's back: the cached membership still authorizes bob.
+    await test_db.chats.update_one({"_id": ObjectId(chat_id)}, {"$pull": {"member_ids": ObjectId(bob["user"]["_id"])}})
+    assert (await client.get(url, headers=bob_headers)).status_code == 200
+    assert chat_membership_cache.hits == hits + 1
+
+    chats = ChatRepository(test_db)
+    await chats.remove_members(chat_id, [bob["user"]["_id"]])
+    assert (await client.get(url, headers=bob_headers)).status_code == 403
+    assert (await client.get(url, headers=carol_headers)).status_code == 403
+    await chats.add_members(chat_id, [carol["user"]["_id"]])
+    assert (await client.get(url, headers=carol_headers)).status_code == 200
+
+
+async def test_direct_chat_is_unique_per_pair(client, create_user, test_db):
+    alice = await create_user(email="judy@example.com", username="judy", full_name="Judy")
+    bob = await create_user(email="mallory@example.com", username="mallory", full_name="Mallory")
+    alice_headers = {"Authorization": f"Bearer {alice['tokens']['access_token']}"}
+    bob_headers = {"Authorization": f"Bearer {bob['tokens']['access_token']}"}
+
+    first = await client.post("/api/messaging/chats/direct", headers=alice_headers, json={"other_user_id": bob["user"]["_id"]})
+    second = await client.post("/api/messaging/chats/direct", headers=bob_headers, json={"other_user_id": alice["user"]["_id"]})
+    assert first.json()["_id"] == second.json()["_id"]
+    assert await test_db.chats.count_documents({"type": "direct"}) == 1
+
+
+async def test_first_page_served_from_recent_message_cache(client, create_user, test_db, monkeypatch):
+    alice = await create_user(email="niaj@example.com", username="niaj", full_name="Niaj")
+    bob = await create_user(email="olivia@example.com", username="olivia", full_name="Olivia")
+    alice_headers = {"Authorization": f"Bearer {alice['tokens']['access_token']}"}
+
+    chat_id = (
+        await client.post(
+            "/api/messaging/chats/direct",
+            headers=alice_headers,
+            json={"other_user_id": bob["user"]["_id"]},
+        )
+    ).json()["_id"]
+    url = f"/api/messaging/chats/{chat_id}/messages"
+    first = (await client.post(url, headers=alice_headers, json={"chat_id": chat_id, "content": "One"})).json()
+
+    assert [m["_id"] for m in (await client.get(url, headers=alice_headers)).json()] == [first["_id"]]
+    second = (await client.post(url, headers=alice_headers, json={"chat_id": chat_id, "content": "Two"})).json()
+    await client.patch(f"{url}/{first['_id']}", headers=alice_headers, json={"content": "One, edited"})
+
+    page = (await client.get(url, headers=alice_headers)).json()
+    assert [m["_id"] for m in page] == [second["_id"], first["_id"]]
+    assert page[1]["content"] == "One, edited"
+
+    await client.delete(f"{url}/{second['_id']}", headers=alice_headers, params={"for_everyone": "true"})
+    page = (await client.get(url, headers=alice_headers)).json()
+    assert [m["_id"] for m in page] == [first["_id"]]
+
+    stats = (await client.get("/api/metrics")).json()["caches"]["recent_messages"]
+    assert stats["misses"] == 1
+    assert stats["hits"] == 2
+
+    # With several workers, another one may have written the message; the buffer is skipped.
+    monkeypatch.setattr(connection_manager.broker, "shared", True)
+    await test_db.messages.update_one({"_id": ObjectId(first["_id"])}, {"$set": {"content": "One, elsewhere"}})
+    page = (await client.get(url, headers=alice_headers)).json()
+    assert page[0]["content"] == "One, elsewhere"
+    assert (await client.get("/api/metrics")).json()["caches"]["recent_messages"]["hits"] == 2
+
+
+async def test_changes_since_sequence(client, create_user, test_db):
+    alice = await create_user(email="peggy@example.com", username="peggy", full_name="Peggy")
+    bob = await create_user(email="rupert@example.com", username="rupert", full_name="Rupert")
+    alice_headers = {"Authorization": f"Bearer {alice['tokens']['access_token']}"}
+    bob_headers = {"Authorization": f"Bearer {bob['tokens']['access_token']}"}
+
+    chat_id = (
+        await client.post(
+            "/api/messaging/chats/direct",
+            headers=alice_headers,
+            json={"other_user_id": bob["user"]["_id"]},
+        )
+    ).json()["_id"]
+    url = f"/api/messaging/chats/{chat_id}/messages"
+    changes_url = f"/api/messaging/chats/{chat_id}/changes"
+    first = (await client.post(url, headers=alice_headers, json={"chat_id": chat_id, "content": "One"})).json()
+    second = (await client.post(url, headers=alice_headers, json={"chat_id": chat_id, "content": "Two"})).json()
+    assert (first["seq"], second["seq"]) == (1, 2)
+
+    synced = (await client.get(changes_url, headers=bob_headers, params={"since": 0})).json()
+    assert synced["seq"] == 2
+    assert [m["_id"] for m in synced["messages"]] == [first["_id"], second["_id"]]
+
+    await client.patch(f"{url}/{first['_id']}", headers=alice_headers, json={"content": "One, edited"})
+    await client.delete(f"{url}/{second['_id']}", headers=alice_headers, params={"for_everyone": "true"})
+    await client.post(f"/api/messaging/chats/{chat_id}/seen", headers=bob_headers)
+
+    delta = (await client.get(changes_url, headers=bob_headers, params={"since": 2})).json()
+    assert delta["seq"] == 5
+    assert delta["reset"] is False
+    assert [(m["_id"], m["content"]) for m in delta["messages"]] == [(first["_id"], "One, edited")]
+    assert delta["deleted"] == [{"id": second["_id"], "for_everyone": True}]
+    assert delta["read_markers"][bob["user"]["_id"]]["message_id"] == first["_id"]
+
+    paged = (await client.get(changes_url, headers=bob_headers, params={"since": 2, "limit": 1})).json()
+    assert (paged["seq"], paged["has_more"]) == (3, True)
+
+    up_to_date = (await client.get(changes_url, headers=bob_headers, params={"since": 5})).json()
+    assert up_to_date == {**up_to_date, "seq": 5, "reset": False, "messages": []}
+
+    await test_db.chat_changes.delete_many({"seq": {"$lte": 3}})
+    expired = (await client.get(changes_url, headers=bob_headers, params={"since": 1})).json()
+    assert expired["reset"] is True
+    assert expired["seq"] == 5
+
+
+async def test_changes_stop_at_a_seq_not_logged_yet(client, create_user, test_db):
+    alice = await create_user(email="quentin@example.com", username="quentin", full_name="Quentin")
+    bob = await create_user(email="ursula@example.com", username="ursula", full_name="Ursula")
+    alice_headers = {"Authorization": f"Bearer {alice['tokens']['access_token']}"}
+    bob_headers = {"Authorization": f"Bearer {bob['tokens']['access_token']}"}
+    chat_id = (
+        await client.post("/api/messaging/chats/direct", headers=alice_headers, json={"other_user_id": bob["user"]["_id"]})
+    ).json()["_id"]
+    url = f"/api/messaging/chats/{chat_id}/messages"
+    changes_url = f"/api/messaging/chats/{chat_id}/changes"
+    first = (await client.post(url, headers=alice_headers, json={"chat_id": chat_id, "content": "One"})).json()
+
+    # Seq 2 is allocated by a writer that has not logged its change yet; seq 3 is logged.
+    assert await ChatRepository(test_db).next_seq(chat_id) == 2
+    third = (await client.post(url, headers=alice_headers, json={"chat_id": chat_id, "content": "Three"})).json()
+    assert third["seq"] == 3
+
+    page = (await client.get(changes_url, headers=bob_headers, params={"since": 0})).json()
+    assert (page["seq"], page["has_more"], page["reset"]) == (1, True, False)
+    assert [m["_id"] for m in page["messages"]] == [first["_id"]]
+    pending = (await client.get(changes_url, headers=bob_headers, params={"since": 1})).json()
+    assert pending == {**pending, "seq": 1, "has_more": False, "reset": False, "messages": []}
+
+    # Still missing after the grace period: the change was lost, so the client must reload.
+    stale = datetime.utcnow() - timedelta(seconds=settings.chat_changes_gap_grace_seconds + 1)
+    await test_db.chat_changes.update_one({"chat_id": ObjectId(chat_id), "seq": 3}, {"$set": {"created_at": stale}})
+    lost = (await client.get(changes_url, headers=bob_headers, params={"since": 1})).json()
+    assert (lost["seq"], lost["reset"]) == (3, True)
+
+
+async def test_send_is_idempotent_per_client_id(client, create_user, test_db):
+    alice = await create_user(email="sybil@example.com", username="sybil", full_name="Sybil")
+    bob = await create_user(email="trent@example.com", username="trent", full_name="Trent")
+    alice_headers = {"Authorization": f"Bearer {alice['tokens']['access_token']}"}
+
+    chat_id = (
+        await client.post(
+            "/api/messaging/chats/direct",
+            headers=alice_headers,
+            json={"other_user_id": bob["user"]["_id"]},
+        )
+    ).json()["_id"]
+    url = f"/api/messaging/chats/{chat_id}/messages"
+    body = {"chat_id": chat_id, "content": "Hello", "client_id": "tmp-1"}
+
+    first = await client.post(url, headers=alice_headers, json=body)
+    retry = await client.post(url, headers=alice_headers, json=body)
+    assert first.status_code == retry.status_code == 201
+    assert retry.json()["_id"] == first.json()["_id"]
+    assert retry.json()["client_id"] == "tmp-1"
+
+    sent_messages.clear()
+    after_restart = await client.post(url, headers=alice_headers, json=body)
+    assert after_restart.json()["_id"] == first.json()["_id"]
+
+    other = await client.post(url, headers=alice_headers, json={**body, "client_id": "tmp-2"})
+    assert other.json()["_id"] != first.json()["_id"]
+
+    assert await test_db.messages.count_documents({"chat_id": ObjectId(chat_id)}) == 2
+    notification = await test_db.notifications.find_one({"recipient_id": ObjectId(bob["user"]["_id"])})
+    assert notification["data"]["count"] == 2
+    assert await test_db.chats.find_one({"_id": ObjectId(chat_id)}, {"seq": 1}) == {"_id": ObjectId(chat_id), "seq": 2}
+
+
+async def test_bucketed_message_storage(client, create_user, test_db, monkeypatch):
+    monkeypatch.setattr(settings, "message_storage", "buckets")
+    monkeypatch.setattr(settings, "message_bucket_size", 2)
+    alice = await create_user(email="uma@example.com", username="uma", full_name="Uma")
+    bob = await create_user(email="victor@example.com", username="victor", full_name="Victor")
+    alice_headers = {"Authorization": f"Bearer {alice['tokens']['access_token']}"}
+    bob_headers = {"Authorization": f"Bearer {bob['tokens']['access_token']}"}
+
+    chat_id = (
+        await client.post(
+            "/api/messaging/chats/direct",
+            headers=alice_headers,
+            json={"other_user_id": bob["user"]["_id"]},
+        )
+    ).json()["_id"]
+    url = f"/api/messaging/chats/{chat_id}/messages"
+    sent = [
+        (await client.post(url, headers=alice_headers, json={"chat_id": chat_id, "content": f"Message {i}"})).json()
+        for i in range(5)
+    ]
+    ids = [m["_id"] for m in sent]
+    assert await test_db.messages.count_documents({}) == 0
+    assert await test_db.message_buckets.count_documents({"chat_id": ObjectId(chat_id)}) == 3
+
+    older = (await client.get(url, headers=bob_headers, params={"before_id": ids[3], "limit": 2})).json()
+    assert [m["_id"] for m in older] == [ids[2], ids[1]]
+    newer = (await client.get(url, headers=bob_headers, params={"after_id": ids[1], "limit": 2})).json()
+    assert [m["_id"] for m in newer] == [ids[3], ids[2]]
+
+    await client.patch(f"{url}/{ids[1]}", headers=alice_headers, json={"content": "Edited"})
+    await client.delete(f"{url}/{ids[4]}", headers=alice_headers, params={"for_everyone": "true"})
+    await client.post(f"/api/messaging/chats/{chat_id}/messages/{ids[0]}/seen", headers=bob_headers)
+
+    recent_messages.clear()
+    page = (await client.get(url, headers=bob_headers)).json()
+    assert [m["_id"] for m in page] == [ids[3], ids[2], ids[1], ids[0]]
+    assert page[2]["content"] == "Edited"
+    chats = (await client.get("/api/messaging/chats", headers=bob_headers)).json()
+    assert chats[0]["unread_count"] == 3
+    assert chats[0]["last_message"]["id"] == ids[3]
+
+    assert await migrate_messages(test_db, "documents", purge=True) == 4
+    assert await test_db.message_buckets.count_documents({}) == 0
+    monkeypatch.setattr(settings, "message_storage", "documents")
+    recent_messages.clear()
+    page = (await client.get(url, headers=bob_headers)).json()
+    assert [m["_id"] for m in page] == [ids[3], ids[2], ids[1], ids[0]]
+
+    # Back again, streamed one bucket per chunk.
+    monkeypatch.setattr(maintenance, "MIGRATION_CHUNK_BUCKETS", 1)
+    assert await migrate_messages(test_db, "buckets") == 4
+    assert [bucket["count"] async for bucket in test_db.message_buckets.find().sort("first_at", 1)] == [2, 2]
+
+
+async def test_archived_history_reads_through(client, create_user, test_db, monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "message_archive_path", tmp_path / "archive")
+    monkeypatch.setattr(settings, "message_archive_segment_size", 2)
+    alice = await create_user(email="wendy@example.com", username="wendy", full_name="Wendy")
+    bob = await create_user(email="xavier@example.com", username="xavier", full_name="Xavier")
+    alice_headers = {"Authorization": f"Bearer {alice['tokens']['access_token']}"}
+
+    chat_id = (
+        await client.post(
+            "/api/messaging/chats/direct",
+            headers=alice_headers,
+            json={"other_user_id": bob["user"]["_id"]},
+        )
+    ).json()["_id"]
+    url = f"/api/messaging/chats/{chat_id}/messages"
+    ids = [
+        (await client.post(url, headers=alice_headers, json={"chat_id": chat_id, "content": f"Old {i}"})).json()["_id"]
+        for i in range(5)
+    ]
+    long_ago = datetime.utcnow().replace(microsecond=0) - timedelta(days=400)
+    for offset, message_id in enumerate(ids[:3]):
+        await test_db.messages.update_one(
+            {"_id": ObjectId(message_id)},
+            {"$set": {"created_at": long_ago + timedelta(seconds=offset)}},
+        )
+
+    assert await archive_messages(test_db, older_than_days=180) == 3
+    assert await test_db.messages.count_documents({"chat_id": ObjectId(chat_id)}) == 2
+    assert await test_db.message_segments.count_documents({"chat_id": ObjectId(chat_id)}) == 2
+    assert await test_db.message_terms.count_documents({"message_id": ObjectId(ids[0])}) == 0
+
+    recent_messages.clear()
+    page = (await client.get(url, headers=alice_headers)).json()
+    assert [m["_id"] for m in page] == list(reversed(ids))
+    assert page[-1]["content"] == "Old 0"
+
+    older = (await client.get(url, headers=alice_headers, params={"before_id": ids[3], "limit": 2})).json()
+    assert [m["_id"] for m in older] == [ids[2], ids[1]]
+    oldest = (await client.get(url, headers=alice_headers, params={"before_id": ids[1], "limit": 2})).json()
+    assert [m["_id"] for m in oldest] == [ids[0]]
+    window = (await client.get(url, headers=alice_headers, params={"around": ids[1], "limit": 3})).json()
+    assert [m["_id"] for m in window] == [ids[2], ids[1], ids[0]]
+    forward = (
+        await client.get(url, headers=alice_headers, params={"after": (long_ago + timedelta(seconds=1)).isoformat(), "limit": 3})
+    ).json()
+    assert [m["_id"] for m in forward] == [ids[4], ids[3], ids[2]]
@@ -1,12 +1,16 @@
 from __future__ import annotations
 
+from bson import ObjectId
 import pytest
+from pymongo.errors import BulkWriteError
+
+from app.repositories.notification_repository import NotificationRepository
 
 
 pytestmark = pytest.mark.asyncio
 
 
-async def test_notification_lifecycle(client, create_user):
+async def test_notification_lifecycle(client, create_user, test_db):
     sender = await create_user(
         email="notify-sender@example.com",
         username="notify_sender",
@@ -63,6 +67,18 @@ async def test_notification_lifecycle(client, create_user):
         headers=sender_headers,
         json={"chat_id": chat_id, "content": "Second ping"},
     )
+    await client.post(
+        f"/api/messaging/chats/{chat_id}/messages",
+        headers=sender_headers,
+        json={"chat_id": chat_id, "content": "Third ping"},
+    )
+
+    coalesced = (await client.get("/api/notifications", headers=recipient_headers)).json()
+    assert coalesced["total"] == 2
+    rolling = coalesced["items"][0]
+    assert rolling["read"] is False
+    assert rolling["data"]["chat_id"] == chat_id
+    assert rolling["data"]["count"] == 2
 
     mark_all = await client.post("/api/notifications/read-all", headers=recipient_headers)
     assert mark_all.status_code == 204
@@ -70,3 +86,47 @@ async def test_notification_lifecycle(client, create_user):
     final_unread = await client.get("/api/notifications/unread-count", headers=recipient_headers)
     assert final_unread.status_code == 200
     assert final_unread.json() == 0
+
+    await client.post(
+        f"/api/messaging/chats/{chat_id}/messages",
+        headers=sender_headers,
+        json={"chat_id": chat_id, "content": "Fourth ping"},
+    )
+    counted = await client.get("/api/notifications/unread-count", headers=recipient_headers)
+    assert counted.json() == 1
+
+    # A counter that drifted low is healed by mark-all-read rather than driven negative.
+    await test_db.notification_counters.update_many({}, {"$set": {"unread": 0}})
+    await client.post("/api/notifications/read-all", headers=recipient_headers)
+    await client.post(
+        f"/api/messaging/chats/{chat_id}/messages",
+        headers=sender_headers,
+        json={"chat_id": chat_id, "content": "Fifth ping"},
+    )
+    healed = await client.get("/api/notifications/unread-count", headers=recipient_headers)
+    assert healed.json() == 1
+
+
+async def test_rolling_notification_keeps_created_at_and_retries_a_lost_race(test_db, monkeypatch):
+    notifications = NotificationRepository(test_db)
+    chat_id, recipient_id = ObjectId(), ObjectId()
+    created = await notifications.upsert_message_notifications(chat_id, ObjectId(), ObjectId(), [recipient_id])
+    assert len(created) == 1
+    first = await test_db.notifications.find_one({"recipient_id": recipient_id})
+
+    bulk_write, calls = notifications.collection.bulk_write, []
+
+    async def lose_first_race(operations, **kwargs):
+        calls.append(len(operations))
+        result = await bulk_write(operations, **kwargs)
+        if len(calls) == 1:
+            # As if a concurrent send's insert had won the unique index.
+            raise BulkWriteError({"writeErrors": [{"index": 0, "code": 11000, "errmsg": "E11000"}], "upserted": []})
+        return result
+
+    monkeypatch.setattr(notifications.collection, "bulk_write", lose_first_race)
+    assert await notifications.upsert_message_notifications(chat_id, ObjectId(), ObjectId(), [recipient_id]) == []
+    assert calls == [1, 1]
+    document = await test_db.notifications.find_one({"recipient_id": recipient_id})
+    assert document["data"]["count"] == 3
+    assert document["created_at"] == first["created_at"] <= document["updated_at"]
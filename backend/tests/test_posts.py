@@ -1,7 +1,10 @@
 from __future__ import annotations
 
 import pytest
+from bson import ObjectId
 
+from app.db.maintenance import reconcile_post_counters
+from app.repositories.post_repository import PostRepository
 
 pytestmark = pytest.mark.asyncio
 
@@ -84,3 +87,94 @@ async def test_post_lifecycle(client, create_user):
 
     missing_post = await client.get(f"/api/posts/{post_id}", headers=headers)
     assert missing_post.status_code == 404
+
+
+async def test_feed_keyset_pagination(client, create_user):
+    author = await create_user(
+        email="pager@example.com",
+        username="pager",
+        full_name="Pager User",
+    )
+    headers = {"Authorization": f"Bearer {author['tokens']['access_token']}"}
+    for index in range(5):
+        response = await client.post("/api/posts", headers=headers, json={"content": f"Post {index}"})
+        assert response.status_code == 201
+
+    first_page = (await client.get("/api/posts", headers=headers, params={"limit": 2})).json()
+    assert first_page["total"] == 5
+    assert first_page["next_cursor"]
+
+    seen = [item["_id"] for item in first_page["items"]]
+    cursor = first_page["next_cursor"]
+    while cursor:
+        page = (await client.get("/api/posts", headers=headers, params={"limit": 2, "cursor": cursor})).json()
+        assert page["total"] is None
+        seen.extend(item["_id"] for item in page["items"])
+        cursor = page["next_cursor"]
+    assert len(seen) == len(set(seen)) == 5
+
+    invalid = await client.get("/api/posts", headers=headers, params={"cursor": "not-a-cursor"})
+    assert invalid.status_code == 400
+
+
+async def test_feed_page_includes_authors_counts_and_filtered_total(client, create_user):
+    author = await create_user(
+        email="feeder@example.com",
+        username="feeder",
+        full_name="Feeder User",
+    )
+    headers = {"Authorization": f"Bearer {author['tokens']['access_token']}"}
+    await client.post("/api/posts", headers=headers, json={"content": "Sales update", "department": "sales"})
+    post = (await client.post("/api/posts", headers=headers, json={"content": "Eng update", "department": "eng"})).json()
+    await client.post(f"/api/posts/{post['_id']}/like", headers=headers)
+    await client.post(f"/api/posts/{post['_id']}/comments", headers=headers, json={"content": "First"})
+
+    feed = (await client.get("/api/posts", headers=headers, params={"department": "eng"})).json()
+    assert feed["total"] == 1
+    (item,) = feed["items"]
+    assert (item["like_count"], item["comment_count"]) == (1, 1)
+    assert item["author"] == {
+        "id": author["user"]["_id"],
+        "full_name": "Feeder User",
+        "avatar_url": None,
+        "username": "feeder",
+    }
+
+    await client.post("/api/posts", headers=headers, json={"content": "More eng", "department": "eng"})
+    assert (await client.get("/api/posts", headers=headers, params={"department": "eng"})).json()["total"] == 2
+    assert (await client.get("/api/posts", headers=headers)).json()["total"] == 3
+
+
+async def test_post_counters_are_maintained_and_reconciled(client, create_user, test_db):
+    author = await create_user(
+        email="counter@example.com",
+        username="counter",
+        full_name="Counter User",
+    )
+    headers = {"Authorization": f"Bearer {author['tokens']['access_token']}"}
+    post_id = (await client.post("/api/posts", headers=headers, json={"content": "Count me"})).json()["_id"]
+    await client.post(f"/api/posts/{post_id}/like", headers=headers)
+    liked = (await client.post(f"/api/posts/{post_id}/like", headers=headers)).json()
+    assert liked["like_count"] == 1
+    comment = (await client.post(f"/api/posts/{post_id}/comments", headers=headers, json={"content": "One"})).json()
+    await client.post(f"/api/posts/{post_id}/comments", headers=headers, json={"content": "Two"})
+    await client.delete(f"/api/posts/{post_id}/comments/{comment['_id']}", headers=headers)
+
+    (item,) = (await client.get("/api/posts", headers=headers)).json()["items"]
+    assert (item["like_count"], item["comment_count"], item["liked"], item["like_user_ids"]) == (1, 1, True, [])
+    unliked = (await client.post(f"/api/posts/{post_id}/unlike", headers=headers)).json()
+    assert unliked["like_count"] == 0
+
+    await test_db.posts.update_one({"_id": ObjectId(post_id)}, {"$set": {"like_count": 7}, "$unset": {"comment_count": ""}})
+    assert await reconcile_post_counters(test_db) == 1
+    assert await reconcile_post_counters(test_db) == 0
+    detail = (await client.get(f"/api/posts/{post_id}", headers=headers)).json()
+    assert (detail["like_count"], detail["comment_count"]) == (0, 1)
+
+    # A post from before the counters: they are filled in at startup, so unlike never goes below zero.
+    await client.post(f"/api/posts/{post_id}/like", headers=headers)
+    await test_db.posts.update_one({"_id": ObjectId(post_id)}, {"$unset": {"like_count": "", "comment_count": ""}})
+    assert await PostRepository(test_db).backfill_counts() == 1
+    assert await PostRepository(test_db).backfill_counts() == 0
+    unliked = (await client.post(f"/api/posts/{post_id}/unlike", headers=headers)).json()
+    assert (unliked["like_count"], unliked["comment_count"]) == (0, 1)
@@ -0,0 +1,503 @@
+from __future__ import annotations
+
+import asyncio
+import json
+
+import msgpack
+import pytest
+from bson import ObjectId
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
+from fastapi.testclient import TestClient
+
+from app.core import serialization
+from app.services.broker import RedisBroker
+from app.services.pending_events import PendingEventQueue
+from app.services.presence import WORKER_PREFIX, PresenceService
+from app.services.realtime import PING_FRAME, SLOW_CONSUMER_CLOSE_CODE, ConnectionManager
+from app.services.typing import TypingAggregator
+
+
+def _login(client: TestClient, name: str) -> dict:
+    payload = {"email": f"{name}@example.com", "username": name, "password": "Password123!", "full_name": name.title()}
+    assert client.post("/api/auth/register", json=payload).status_code == 201
+    response = client.post("/api/auth/login", json={"email": payload["email"], "password": payload["password"]})
+    return response.json()
+
+
+def test_user_socket_multiplexes_chats(app):
+    with TestClient(app) as client:
+        yara, zane = _login(client, "yara"), _login(client, "zane")
+        yara_headers = {"Authorization": f"Bearer {yara['tokens']['access_token']}"}
+        zane_id = zane["user"]["_id"]
+
+        with client.websocket_connect(f"/api/ws?token={zane['tokens']['access_token']}") as socket:
+            assert socket.receive_json() == {"event": "connected", "data": {"user_id": zane_id, "encoding": "json", "profile": "full"}}
+            assert socket.receive_json()["event"] == "pending:replayed"
+
+            chat = client.post(
+                "/api/messaging/chats/group",
+                headers=yara_headers,
+                json={"member_ids": [zane_id], "name": "Launch"},
+            ).json()
+            chat_id = chat["_id"]
+            joined = socket.receive_json()
+            assert (joined["event"], joined["data"]["_id"]) == ("chat:joined", chat_id)
+
+            socket.send_json({"event": "subscribe", "data": {"chat_id": chat_id}})
+            assert socket.receive_json() == {"event": "subscribed", "data": {"chat_id": chat_id}}
+
+            url = f"/api/messaging/chats/{chat_id}/messages"
+            first = client.post(url, headers=yara_headers, json={"chat_id": chat_id, "content": "Hi"}).json()
+            notified = socket.receive_json()
+            assert (notified["event"], notified["data"]["data"]["count"]) == ("notification:new", 1)
+            unread = socket.receive_json()
+            assert (unread["event"], unread["data"]) == ("unread:changed", {"unread_count": 1})
+            new = socket.receive_json()
+            assert (new["event"], new["chat_id"], new["data"]["_id"]) == ("message:new", chat_id, first["_id"])
+            listed = socket.receive_json()
+            assert listed["event"] == "chat:message"
+            assert (listed["data"]["chat_id"], listed["data"]["unread_count"]) == (chat_id, 1)
+
+            socket.send_json({"event": "seen", "data": {"chat_id": chat_id, "message_id": first["_id"]}})
+            assert socket.receive_json()["event"] == "message:seen"
+            read = socket.receive_json()
+            assert (read["event"], read["data"]["unread_count"]) == ("chat:read", 0)
+
+            socket.send_json({"event": "unsubscribe", "data": {"chat_id": chat_id}})
+            assert socket.receive_json()["event"] == "unsubscribed"
+            # Folded into the rolling notification: only the chat-list event is pushed.
+            client.post(url, headers=yara_headers, json={"chat_id": chat_id, "content": "Still there?"})
+            listed = socket.receive_json()
+            assert (listed["event"], listed["data"]["unread_count"]) == ("chat:message", 1)
+
+            other = client.post("/api/messaging/chats/group", headers=yara_headers, json={"member_ids": [], "name": "Private"}).json()
+            socket.send_json({"event": "subscribe", "data": {"chat_id": other["_id"]}})
+            assert socket.receive_json()["event"] == "error"
+
+
+def test_missed_user_events_are_replayed_until_acked(app):
+    with TestClient(app) as client:
+        owen, pia = _login(client, "owen"), _login(client, "pia")
+        owen_headers = {"Authorization": f"Bearer {owen['tokens']['access_token']}"}
+        chat = client.post(
+            "/api/messaging/chats/group",
+            headers=owen_headers,
+            json={"member_ids": [pia["user"]["_id"]], "name": "Offsite"},
+        ).json()
+        url = f"/api/ws?token={pia['tokens']['access_token']}"
+
+        with client.websocket_connect(url) as socket:
+            socket.receive_json()
+            joined = socket.receive_json()
+            assert (joined["event"], joined["data"]["_id"]) == ("chat:joined", chat["_id"])
+            assert socket.receive_json() == {"event": "pending:replayed", "data": {"count": 1, "truncated": False}}
+
+        with client.websocket_connect(url) as socket:
+            socket.receive_json()
+            assert socket.receive_json()["event_id"] == joined["event_id"]
+            socket.receive_json()
+            socket.send_json({"event": "ack", "data": {"event_id": joined["event_id"]}})
+
+        with client.websocket_connect(url) as socket:
+            socket.receive_json()
+            assert socket.receive_json() == {"event": "pending:replayed", "data": {"count": 0, "truncated": False}}
+
+
+def test_user_socket_negotiates_msgpack(app):
+    with TestClient(app) as client:
+        quinn = _login(client, "quinn")
+        url = f"/api/ws?token={quinn['tokens']['access_token']}&encoding=msgpack"
+        with client.websocket_connect(url) as socket:
+            connected = msgpack.unpackb(socket.receive_bytes())
+            assert connected == {"event": "connected", "data": {"user_id": quinn["user"]["_id"], "encoding": "msgpack", "profile": "full"}}
+            assert msgpack.unpackb(socket.receive_bytes())["event"] == "pending:replayed"
+            socket.send_bytes(msgpack.packb({"event": "ping"}))
+            assert msgpack.unpackb(socket.receive_bytes()) == {"event": "pong"}
+            socket.send_json({"event": "ping"})
+            assert msgpack.unpackb(socket.receive_bytes()) == {"event": "pong"}
+
+
+def test_user_socket_negotiates_compact_profile(app):
+    assert len(set(serialization.COMPACT_KEYS.values())) == len(serialization.COMPACT_KEYS)
+    with TestClient(app) as client:
+        rory, sam = _login(client, "rory"), _login(client, "sam")
+        url = f"/api/ws?token={sam['tokens']['access_token']}&profile=compact&profile_version=9"
+        with client.websocket_connect(url) as socket:
+            connected = socket.receive_json()
+            assert connected["event"] == "connected"
+            assert connected["data"]["profile"] == "compact"
+            assert connected["data"]["profile_version"] == serialization.COMPACT_PROFILE_VERSION
+            assert connected["data"]["keys"]["event_id"] == "n"
+            assert socket.receive_json() == {"e": "pending:replayed", "d": {"count": 0}}
+            socket.send_json({"event": "feed:subscribe", "data": {}})
+            assert socket.receive_json() == {"e": "feed:subscribed"}
+
+            headers = {"Authorization": f"Bearer {rory['tokens']['access_token']}"}
+            post = client.post("/api/posts", headers=headers, json={"content": "Hello"}).json()
+            created = socket.receive_json()
+            assert (created["e"], created["d"]["i"], created["d"]["t"]) == ("feed:post", post["_id"], "Hello")
+            assert created["d"]["lc"] == 0
+            assert "attachments" not in created["d"] and "a" not in created["d"]
+
+
+def test_feed_subscribers_receive_posts_and_count_deltas(app):
+    with TestClient(app) as client:
+        uma, vic = _login(client, "uma"), _login(client, "vic")
+        uma_headers = {"Authorization": f"Bearer {uma['tokens']['access_token']}"}
+        with client.websocket_connect(f"/api/ws?token={vic['tokens']['access_token']}") as socket:
+            socket.receive_json()
+            socket.receive_json()
+            socket.send_json({"event": "feed:subscribe", "data": {"department": "eng"}})
+            assert socket.receive_json() == {"event": "feed:subscribed", "data": {"department": "eng"}}
+
+            client.post("/api/posts", headers=uma_headers, json={"content": "Quarterly numbers", "department": "sales"})
+            post = client.post("/api/posts", headers=uma_headers, json={"content": "Ship it", "department": "eng"}).json()
+            created = socket.receive_json()
+            assert (created["event"], created["data"]["_id"]) == ("feed:post", post["_id"])
+
+            client.post(f"/api/posts/{post['_id']}/like", headers=uma_headers)
+            assert socket.receive_json() == {
+                "event": "feed:counts",
+                "data": {"post_id": post["_id"], "like_count": 1, "comment_count": 0},
+            }
+            client.post(f"/api/posts/{post['_id']}/comments", headers=uma_headers, json={"content": "Nice"})
+            assert socket.receive_json()["data"] == {"post_id": post["_id"], "like_count": 1, "comment_count": 1}
+
+
+class _RecordingSocket:
+    def __init__(self) -> None:
+        self.frames: list[dict] = []
+        self.close_code: int | None = None
+
+    async def accept(self) -> None:
+        return None
+
+    async def send_text(self, data: str) -> None:
+        self.frames.append(json.loads(data))
+
+    async def send_bytes(self, data: bytes) -> None:
+        self.frames.append(msgpack.unpackb(data))
+
+    async def close(self, code: int = 1000) -> None:
+        self.close_code = code
+
+
+class _StalledSocket(_RecordingSocket):
+    """A client that stopped reading: every send blocks until released."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.released = asyncio.Event()
+
+    async def send_text(self, data: str) -> None:
+        await self.released.wait()
+        await super().send_text(data)
+
+
+async def _wait_for(condition, timeout: float = 2.0) -> None:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out waiting for broker delivery"
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_redis_broker_fans_out_across_workers(caplog):
+    server = FakeServer()
+    worker_a = ConnectionManager(RedisBroker(FakeRedis(server=server), poll_timeout=0.01))
+    worker_b = ConnectionManager(RedisBroker(FakeRedis(server=server), poll_timeout=0.01))
+    await worker_a.start()
+    await worker_b.start()
+    # Acks and replays may land on another worker, so pending events skip process memory.
+    assert worker_a.pending.spill and worker_a.pending.memory_events == 0
+    try:
+        chat_socket, user_socket, idle_socket = _RecordingSocket(), _RecordingSocket(), _RecordingSocket()
+        await worker_b.connect("chat-1", chat_socket)
+        await worker_b.connect_user("user-1", user_socket)
+        await worker_b.subscribe(user_socket, "chat-1")
+        await worker_b.connect_user("user-2", idle_socket)
+
+        await worker_a.broadcast("chat-1", {"event": "message:new", "data": {"id": "m1"}})
+        await worker_a.send_to_users(
+            ["user-2", "user-3"], {"event": "chat:message", "data": {"chat_id": "chat-1"}}, data_by_user={"user-2": {"unread_count": 3}}
+        )
+        await _wait_for(lambda: chat_socket.frames and user_socket.frames and idle_socket.frames)
+
+        expected = {"event": "message:new", "data": {"id": "m1"}, "chat_id": "chat-1"}
+        assert chat_socket.frames == [expected]
+        assert user_socket.frames == [expected]
+        assert [(frame["event"], frame["data"]) for frame in idle_socket.frames] == [
+            ("chat:message", {"chat_id": "chat-1", "unread_count": 3})
+        ]
+
+        await worker_b.unsubscribe(user_socket, "chat-1")
+        await worker_b.disconnect("chat-1", chat_socket)
+        await worker_a.broadcast("chat-1", {"event": "message:new", "data": {"id": "m2"}})
+        await worker_a.send_to_users(["user-2"], {"event": "ping"})
+        await _wait_for(lambda: len(idle_socket.frames) == 2)
+        assert len(chat_socket.frames) == len(user_socket.frames) == 1
+        # worker_a holds no sockets, so it never subscribed; its listener waits quietly.
+        assert "lost its Redis subscription" not in caplog.text
+    finally:
+        await worker_a.close()
+        await worker_b.close()
+
+
+@pytest.mark.asyncio
+async def test_events_pushed_during_replay_follow_it_once():
+    manager = ConnectionManager()
+    await manager.start()
+    snapshot = manager.pending.pending
+
+    async def pending_then_push(user_id):
+        frames = await snapshot(user_id)
+        await manager.send_to_users([user_id], {"event": "chat:message", "data": {"n": 2}})
+        return frames
+
+    manager.pending.pending = pending_then_push
+    try:
+        socket = _RecordingSocket()
+        await manager.connect_user("user-1", socket, replay=True)
+        await manager.send_to_users(["user-1"], {"event": "chat:message", "data": {"n": 1}})
+        await manager.replay_pending(socket, "user-1")
+        await _wait_for(lambda: len(socket.frames) == 3)
+
+        assert [(frame["event"], frame["data"].get("n")) for frame in socket.frames] == [
+            ("chat:message", 1),
+            ("pending:replayed", None),
+            ("chat:message", 2),
+        ]
+        assert not manager._replaying
+    finally:
+        await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_slow_consumer_is_evicted_without_blocking_others():
+    manager = ConnectionManager(queue_size=2, send_timeout=5)
+    await manager.start()
+    try:
+        stalled, healthy = _StalledSocket(), _RecordingSocket()
+        await manager.connect("chat-1", stalled)
+        await manager.connect_user("user-1", healthy)
+        await manager.subscribe(healthy, "chat-1")
+
+        for index in range(5):
+            await manager.broadcast("chat-1", {"event": "message:new", "data": {"id": index}})
+            await asyncio.sleep(0.01)
+        await _wait_for(lambda: stalled.close_code is not None and len(healthy.frames) == 5)
+
+        assert stalled.close_code == SLOW_CONSUMER_CLOSE_CODE
+        assert "chat-1" not in manager._connections
+        assert manager._chat_users["chat-1"] == {"user-1"}
+        assert [frame["data"]["id"] for frame in healthy.frames] == list(range(5))
+    finally:
+        await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_idle_socket_gets_server_pings_and_registries_drain():
+    manager = ConnectionManager(ping_interval=0.05)
+    await manager.start()
+    try:
+        socket = _RecordingSocket()
+        await manager.connect("chat-1", socket)
+        await _wait_for(lambda: len(socket.frames) >= 2)
+        assert socket.frames[:2] == [PING_FRAME, PING_FRAME]
+
+        await manager.disconnect("chat-1", socket)
+        assert not manager._connections and not manager._writers and not manager._queues
+    finally:
+        await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_broadcast_serializes_once_per_encoding(monkeypatch):
+    calls = {"json": 0, "msgpack": 0}
+    dumps_json, dumps_msgpack = serialization.dumps_json, serialization.dumps_msgpack
+
+    def counting_json(value):
+        calls["json"] += 1
+        return dumps_json(value)
+
+    def counting_msgpack(value):
+        calls["msgpack"] += 1
+        return dumps_msgpack(value)
+
+    monkeypatch.setattr(serialization, "dumps_json", counting_json)
+    monkeypatch.setattr(serialization, "dumps_msgpack", counting_msgpack)
+    manager = ConnectionManager()
+    await manager.start()
+    try:
+        sockets = [_RecordingSocket() for _ in range(4)]
+        for index, socket in enumerate(sockets):
+            await manager.connect("chat-1", socket, "msgpack" if index == 0 else "json")
+        await manager.broadcast("chat-1", {"event": "message:new", "data": {"id": "m1"}})
+        await _wait_for(lambda: all(socket.frames for socket in sockets))
+
+        assert calls == {"json": 1, "msgpack": 1}
+        assert all(socket.frames == sockets[0].frames for socket in sockets)
+    finally:
+        await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_typing_updates_are_coalesced_and_expire():
+    manager = ConnectionManager()
+    await manager.start()
+    aggregator = TypingAggregator(manager, interval=0.05, ttl=0.2)
+    try:
+        socket = _RecordingSocket()
+        await manager.connect("chat-1", socket)
+        for _ in range(10):
+            aggregator.update("chat-1", "user-a", True)
+        aggregator.update("chat-1", "user-b", True)
+        aggregator.update("chat-1", "user-c", True)
+        aggregator.update("chat-1", "user-c", False)
+        await _wait_for(lambda: socket.frames)
+        await asyncio.sleep(0.06)
+        assert socket.frames == [{"event": "typing", "data": {"user_ids": ["user-a", "user-b"], "stopped": []}, "chat_id": "chat-1"}]
+
+        aggregator.update("chat-1", "user-b", False)
+        await _wait_for(lambda: len(socket.frames) == 3, timeout=1.0)
+        assert [frame["data"] for frame in socket.frames[1:]] == [
+            {"user_ids": ["user-a"], "stopped": ["user-b"]},
+            {"user_ids": [], "stopped": ["user-a"]},
+        ]
+        await _wait_for(lambda: not aggregator._flushers)
+        assert not aggregator._typers and not aggregator._announced
+    finally:
+        await aggregator.close()
+        await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_presence_diffs_reach_only_chat_partners_and_flush_in_bulk(test_db):
+    alice, bob, carol = ObjectId(), ObjectId(), ObjectId()
+    await test_db.users.insert_many([{"_id": user_id} for user_id in (alice, bob, carol)])
+    await test_db.chats.insert_one({"member_ids": [alice, bob]})
+    manager = ConnectionManager()
+    await manager.start()
+    presence = PresenceService(manager, broadcast_interval=60, flush_interval=60)
+    await presence.start(test_db)
+    try:
+        bob_socket, carol_socket = _RecordingSocket(), _RecordingSocket()
+        await manager.connect_user(str(bob), bob_socket)
+        await manager.connect_user(str(carol), carol_socket)
+
+        await presence.connected(str(alice))
+        await presence.connected(str(alice))
+        for _ in range(5):
+            presence.heartbeat(str(alice))
+        await presence.publish_changes()
+        await _wait_for(lambda: bob_socket.frames)
+        assert [(user["user_id"], user["status"]) for user in bob_socket.frames[0]["data"]["users"]] == [(str(alice), "online")]
+
+        await presence.disconnected(str(alice))
+        await presence.publish_changes()
+        assert presence.status_of(str(alice)).value == "online"
+        await presence.disconnected(str(alice))
+        await presence.publish_changes()
+        await _wait_for(lambda: len(bob_socket.frames) == 2)
+        assert bob_socket.frames[1]["data"]["users"][0]["status"] == "offline"
+        assert carol_socket.frames == []
+
+        await presence.flush()
+        stored = await test_db.users.find_one({"_id": alice})
+        assert stored["last_seen_at"] is not None
+        assert await test_db.users.find_one({"_id": carol, "last_seen_at": {"$exists": True}}) is None
+    finally:
+        await presence.close()
+        await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_presence_stays_online_while_another_worker_holds_a_socket(test_db):
+    alice, bob = ObjectId(), ObjectId()
+    await test_db.users.insert_many([{"_id": user_id} for user_id in (alice, bob)])
+    await test_db.chats.insert_one({"member_ids": [alice, bob]})
+    server = FakeServer()
+    managers = [ConnectionManager(RedisBroker(FakeRedis(server=server), poll_timeout=0.01)) for _ in range(2)]
+    services = [PresenceService(manager, broadcast_interval=60, flush_interval=60) for manager in managers]
+    for manager, service in zip(managers, services):
+        await manager.start()
+        await service.start(test_db)
+    try:
+        bob_socket = _RecordingSocket()
+        await managers[1].connect_user(str(bob), bob_socket)
+        await services[0].connected(str(alice))
+        await services[1].connected(str(alice))
+        await services[0].publish_changes()
+        await _wait_for(lambda: bob_socket.frames)
+
+        # Worker A's last socket for Alice closes; worker B still holds one.
+        await services[0].disconnected(str(alice))
+        await services[0].publish_changes()
+        await services[1].publish_changes()
+        await asyncio.sleep(0.05)
+        assert len(bob_socket.frames) == 2
+        assert [frame["data"]["users"][0]["status"] for frame in bob_socket.frames] == ["online", "online"]
+
+        await services[1].disconnected(str(alice))
+        await services[1].publish_changes()
+        await _wait_for(lambda: len(bob_socket.frames) == 3)
+        assert bob_socket.frames[2]["data"]["users"][0]["status"] == "offline"
+
+        # Worker B dies holding a socket; once its key lapses, its sockets no longer count.
+        await services[1].connected(str(alice))
+        await services[0].connected(str(alice))
+        await services[0].publish_changes()
+        await FakeRedis(server=server).delete(WORKER_PREFIX + services[1].worker_id)
+        await services[0].disconnected(str(alice))
+        await services[0].publish_changes()
+        await _wait_for(lambda: len(bob_socket.frames) == 5)
+        assert bob_socket.frames[4]["data"]["users"][0]["status"] == "offline"
+    finally:
+        for manager, service in zip(managers, services):
+            await service.close()
+            await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_pending_events_spill_to_mongo_and_stay_bounded(test_db):
+    queue = PendingEventQueue(max_events=3, memory_events=1, spill=True)
+    await queue.start(test_db)
+    try:
+        frames = [await queue.push("user-1", {"event": "chat:message", "data": {"n": n}}) for n in range(5)]
+        assert await test_db.pending_events.count_documents({"user_id": "user-1"}) == 4
+
+        pending, truncated = await queue.pending("user-1")
+        assert [frame["data"]["n"] for frame in pending] == [2, 3, 4]
+        assert truncated
+
+        await queue.ack("user-1", frames[3]["event_id"])
+        pending, truncated = await queue.pending("user-1")
+        assert [frame["data"]["n"] for frame in pending] == [4]
+        assert not truncated
+        assert await test_db.pending_events.count_documents({}) == 0
+    finally:
+        await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_write_through_workers_mint_ordered_unique_event_ids(test_db):
+    workers = [PendingEventQueue(memory_events=1, spill=True) for _ in range(2)]
+    for worker in workers:
+        worker.write_through()
+        await worker.start(test_db)
+    try:
+        frames = []
+        for n in range(3):
+            frames += await workers[n % 2].push_many([("user-1", {"event": "chat:message", "data": {"n": n}}), ("user-2", {"event": "ping"})])
+        event_ids = [frame["event_id"] for frame in frames]
+        assert event_ids == sorted(set(event_ids))
+        assert await test_db.pending_events.count_documents({}) == 6
+
+        # Acked on the other worker: only events up to the acked one go.
+        await workers[1].ack("user-1", frames[2]["event_id"])
+        pending, _ = await workers[0].pending("user-1")
+        assert [frame["data"]["n"] for frame in pending] == [2]
+    finally:
+        for worker in workers:
+            await worker.close()